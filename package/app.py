@@ -45,7 +45,10 @@ def run(setup: bool = False) -> int:
     window = MainWindow(dbx, json_data['DROPBOX_LOCATION'])
     window.show()
 
-    return app.exec_()
+    exit_code = app.exec_()
+    window.shutdown()
+    utils.close_ledger()
+    return exit_code
 
 def run_setup() -> bool:
     starter_window = StarterWindow()
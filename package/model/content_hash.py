@@ -0,0 +1,130 @@
+"""
+Dropbox's content hash of local files, so unchanged contents aren't uploaded again
+"""
+
+from __future__ import annotations
+
+import hashlib
+import multiprocessing
+import os
+from collections.abc import Iterable
+from concurrent.futures import (Executor, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+
+from package.model.ledger import LedgerWriter, SyncLedger
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class ContentHasher:
+    '''
+    the sha256 of the sha256 of every 4 MiB block, which is what Dropbox
+    reports as content_hash, of data that comes in pieces of any size
+    (e.g. as it is downloaded)
+    '''
+
+    def __init__(self) -> None:
+        self._block_hashes = hashlib.sha256()
+        self._block = hashlib.sha256()
+        self._block_length = 0
+
+    def update(self, data: bytes) -> None:
+        data = memoryview(data)
+        while data:
+            length = min(len(data), BLOCK_SIZE - self._block_length)
+            self._block.update(data[:length])
+            self._block_length += length
+            data = data[length:]
+            if self._block_length == BLOCK_SIZE:
+                self._block_hashes.update(self._block.digest())
+                self._block = hashlib.sha256()
+                self._block_length = 0
+
+    def hexdigest(self) -> str:
+        block_hashes = self._block_hashes.copy()
+        if self._block_length:
+            block_hashes.update(self._block.digest())
+        return block_hashes.hexdigest()
+
+
+def content_hash(local_path: str) -> str:
+    '''
+    the file is read one block at a time
+    '''
+    hasher = ContentHasher()
+    with open(local_path, 'rb') as file:
+        while True:
+            block = file.read(BLOCK_SIZE)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class HashCache:
+    '''
+    Content hashes of local files kept in the ledger, keyed by
+    (inode, size, mtime_ns) so a file is only hashed again once it changes.
+
+    Many files are hashed in a process pool since hashing is CPU bound,
+    a handful in threads which avoids starting the processes.
+    '''
+
+    PROCESS_POOL_THRESHOLD = 64 # files, or PROCESS_POOL_BYTES, whichever comes first
+    PROCESS_POOL_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, ledger: SyncLedger, ledger_writer: LedgerWriter, workers: int = None) -> None:
+        self.ledger = ledger
+        self.ledger_writer = ledger_writer
+        self.workers = workers or os.cpu_count() or 1
+
+    def get(self, local_path: str, stat: os.stat_result = None) -> str:
+        stat = stat or os.stat(local_path)
+        return self.hash_files({local_path: stat})[local_path]
+
+    def hash_files(self, files: dict[str, os.stat_result]) -> dict[str, str | None]:
+        '''
+        files: local path -> its stat, as it was scanned
+        returns local path -> content hash, or None if the file couldn't be read
+        '''
+        hashes: dict[str, str | None] = {}
+        to_hash: dict[str, os.stat_result] = {}
+        for local_path, stat in files.items():
+            cached = self.ledger.get_local_hash(stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if cached is None:
+                to_hash[local_path] = stat
+            else:
+                hashes[local_path] = cached
+
+        if not to_hash:
+            return hashes
+
+        with self._executor(to_hash.values()) as executor:
+            futures = {local_path: executor.submit(content_hash, local_path) for local_path in to_hash}
+            for local_path, future in futures.items():
+                try:
+                    hashes[local_path] = future.result()
+                except OSError as e:
+                    print(f"Couldn't hash {local_path}: {e}")
+                    hashes[local_path] = None
+                    continue
+
+                # the file may have been written to while it was being hashed
+                stat = to_hash[local_path]
+                try:
+                    changed = os.stat(local_path).st_mtime_ns != stat.st_mtime_ns
+                except OSError:
+                    changed = True
+                if changed:
+                    hashes[local_path] = None
+                else:
+                    self.ledger_writer.set_local_hash(stat.st_ino, stat.st_size, stat.st_mtime_ns, hashes[local_path])
+
+        return hashes
+
+    def _executor(self, stats: Iterable[os.stat_result]) -> Executor:
+        stats = list(stats)
+        if len(stats) >= self.PROCESS_POOL_THRESHOLD or sum(stat.st_size for stat in stats) >= self.PROCESS_POOL_BYTES:
+            # spawn, since forking a process with Qt and the ledger's threads in it isn't safe
+            return ProcessPoolExecutor(min(self.workers, len(stats)), mp_context=multiprocessing.get_context("spawn"))
+        return ThreadPoolExecutor(min(self.workers, len(stats)))
@@ -1,58 +1,91 @@
-import datetime
-import json
+from __future__ import annotations
+
+import calendar
 import os
-import shutil
 import threading
 import webbrowser
-import zipfile
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
 from pprint import pprint
-from time import sleep
+from time import sleep, time_ns
 
 import colorama
 import pytz
 from dropbox import Dropbox
 from dropbox.exceptions import ApiError
-from dropbox.files import (CommitInfo, FileMetadata, FolderMetadata,
-                           GetMetadataError, UploadSessionCursor,
-                           UploadSessionStartResult, WriteMode)
-
+from dropbox.files import (CommitInfo, DeletedMetadata, FileMetadata,
+                           FolderMetadata, GetMetadataError,
+                           ListFolderContinueError, Metadata,
+                           RelocationBatchV2Result, RelocationPath,
+                           UploadSessionCursor, UploadSessionFinishArg,
+                           UploadSessionFinishBatchResult,
+                           UploadSessionFinishError, UploadSessionLookupError,
+                           UploadSessionStartResult, UploadSessionType,
+                           WriteMode)
+
+from package.model.content_hash import ContentHasher
+from package.model.folder_sizes import FolderSizes
+from package.model.ignore import PARTIAL_DOWNLOAD_SUFFIX, IgnoreMatcher
 from package.model.interface_model import (ExplorerTask, InterfaceModel,
                                            MyThread)
-from package.utils import TIMESTAMP_FORMAT, read_config
+from package.model.ledger import LedgerEntry, SyncLedger, UploadSession
+from package.model.listing import list_changes, list_folder
+from package.model.listing_cache import ListingCache
+from package.model.progress import TransferProgress
+from package.model.sync_plan import PlanAction, PlanItem, SyncPlan
+from package.model.upload_policy import UploadPolicy
+from package.model.upload_pool import UploadJob, UploadPool, UploadResult
+from package.utils import (NANOSECONDS, format_timestamp, get_config,
+                           get_gitignore_cache, get_hash_cache, get_ledger,
+                           get_ledger_writer, get_upload_budget)
 
 colorama.init(autoreset=True)
 
 class DropboxModel(InterfaceModel):
 
-    MAX_BUCKET_SIZE = 50 # in megabytes
     BYTES_TO_MEGABYTES = 1000 ** 2
-    MAX_BUCKET_SIZE_BYTES = BYTES_TO_MEGABYTES * MAX_BUCKET_SIZE
+    BATCH_MAX_FILES = 1000 # the most upload_session_finish_batch_v2 and the relocation batches take at once
+    BATCH_CHECK_INTERVAL = 1 # seconds between checks on a relocation batch
+    DOWNLOAD_CHUNK_SIZE = 1024 * 1024 # bytes read from a download at a time
 
     def __init__(self, local_root, dbx) -> None:
         super().__init__(local_root)
         self.dbx = dbx #type: Dropbox
+        self.folder_sizes = FolderSizes(dbx)
+        self.listings = ListingCache(dbx)
+        # local paths a sync is downloading to whose ledger entries may not be committed yet
+        self._downloading: set[str] = set()
+        self._downloading_lock = threading.Lock()
 
 
     def get_list_of_paths(self, root: str) -> list:
-        file_list = []
-        files = self.dbx.files_list_folder(root)
+        '''
+        (path, is_file, size) of everything in root. The size of a folder is
+        only known once it, or a folder it is in, has been listed recursively
+        recently (see FolderSizes)
+        '''
+        file_list = self.listings.list(root)
 
-        def process_entries(entries):
-            for entry in entries:
-                file_list.append(entry)
+        file_list.sort(key= lambda x: x.path_lower)
+        folder_sizes = self.folder_sizes.sizes_in(root)
+        file_list = [(i.path_display, isinstance(i, FileMetadata), i.size if isinstance(i, FileMetadata) else folder_sizes.get(i.path_lower)) for i in file_list]
 
-        process_entries(files.entries)
+        return file_list
 
-        while files.has_more:
-            files = self.dbx.files_list_folder_continue(files.cursor)
 
-            process_entries(files.entries)
+    def invalidate(self, path: str) -> None:
+        self.listings.invalidate(path)
 
-        file_list.sort(key= lambda x: x.path_lower)
-        file_list = [(i.path_display, isinstance(i, FileMetadata)) for i in file_list]
 
-        return file_list
+    def is_downloading(self, file_local_path: str) -> bool:
+        """
+        whether a sync is putting file_local_path in place, so a change to it
+        is the download rather than something to upload
+        """
+        with self._downloading_lock:
+            return file_local_path in self._downloading
 
 
     def perform_task(self, task: ExplorerTask) -> MyThread:
@@ -64,7 +97,9 @@ class DropboxModel(InterfaceModel):
             'download': self.download,
             'upload_file': self.upload_file,
             'upload_folder': self.upload_folder,
-            'sync': self.sync
+            'sync': self.sync,
+            'plan_sync': self.plan_sync,
+            'folder_size': self.folder_size
         }
 
         thread = MyThread(self, ACTION_FUNC[task.action], [task])
@@ -79,10 +114,18 @@ class DropboxModel(InterfaceModel):
     def create_folder(self, task: ExplorerTask) -> None:
         path = task.kwargs['path']
         self.dbx.files_create_folder(path, True)
+        self.invalidate(path)
         self.refresh()
 
     def api_delete(self, path: str) -> None:
         self.dbx.files_delete(path)
+        self.invalidate(path)
+
+    def api_move(self, path: str, new_path: str) -> Metadata:
+        metadata = self.dbx.files_move_v2(path, new_path).metadata
+        self.invalidate(path)
+        self.invalidate(new_path)
+        return metadata
 
     @status_update
     def delete(self, task: ExplorerTask) -> None:
@@ -93,7 +136,7 @@ class DropboxModel(InterfaceModel):
     def move(self, task: ExplorerTask) -> None:
         path = task.kwargs['path']
         new_path = task.kwargs['new_path']
-        self.dbx.files_move(path, new_path)
+        self.api_move(path, new_path)
 
 
     @status_update
@@ -102,154 +145,475 @@ class DropboxModel(InterfaceModel):
         webbrowser.open(f"https://www.dropbox.com/home{path}")
 
 
-    def _get_dbx_folder_size(self, path: str, info: dict) -> int:
-        """
-        recursive function to retrieve folder size in bytes
-        """
-        size = 0
-        folders = []
-        files = []
-
-        if info["finished"]:
-            return size
+    @status_update
+    def folder_size(self, task: ExplorerTask) -> None:
+        path = task.kwargs['path']
+        size = self.folder_sizes.size(path)
+        if size is not None:
+            print(colorama.Fore.MAGENTA + f"\"{path}\" is {size / self.BYTES_TO_MEGABYTES:.2f} MB")
+            task.set_progress(f"{size / self.BYTES_TO_MEGABYTES:.2f} MB")
+        self.refresh()
 
-        for entry in self.dbx.files_list_folder(path).entries:
-            if type(entry) == FolderMetadata:
-                folders.append(entry)
-            elif type(entry) == FileMetadata:
-                files.append(entry)
 
-        for subfolder in folders:
-            subfolder_path = path + "/" + subfolder.name
-            size += self._get_dbx_folder_size(subfolder_path, info)
+    @status_update
+    def download(self, task: ExplorerTask) -> None:
+        path = task.kwargs['path']
+        local_path = Path(task.kwargs['local_path'])
 
-        for file in files:
-            size += file.size
+        metadata = self.dbx.files_get_metadata(path)
 
-        return size
+        print(colorama.Fore.MAGENTA + f"Downloading \"{path}\" to \"{local_path}\"")
 
+        if isinstance(metadata, FileMetadata):
+            downloads = [(path, local_path)]
+            results = self._download_files(downloads, self._download_progress(metadata.size, task))
+            failed = [dbx_path for (dbx_path, _), result in zip(downloads, results) if result is None]
+        else:
+            failed = self.download_folder(metadata.path_display, local_path, task)
 
-    def _download_progress(self, info: dict):
-        dbx_path = info["dbx_path"]
-        local_path = info["local_path"]
-        if info["is_file"]:
-            total = self.dbx.files_get_metadata(dbx_path).size
+        if failed:
+            print(colorama.Fore.RED + f"Download Failed for {len(failed)} file(s)")
+            task.fail(f"couldn't download {', '.join(failed)}")
         else:
-            print(colorama.Fore.MAGENTA + "Retrieving folder size...")
-            total = self._get_dbx_folder_size(dbx_path, info)
+            print(colorama.Fore.MAGENTA + f"Download Finished")
 
-        if not info["finished"]:
-            print(colorama.Fore.MAGENTA + f"Download size: ({total / self.BYTES_TO_MEGABYTES:.2f} MB)")
 
-        while True:
-            if info["finished"]:
-                return
-            
-            if not os.path.exists(local_path):
-                sleep(2)
+    def download_folder(self, dbx_path: str, folder_local_path: Path, task: ExplorerTask = None) -> list[str]:
+        """
+        downloads every file in the folder into folder_local_path, except the
+        ones whose local copy already has the same contents.
+        returns the Dropbox paths of the files that failed to download
+        """
+        entries, cursor = self._list_entries(dbx_path)
+        self.folder_sizes.add_listing(dbx_path, entries, cursor)
+
+        files: list[tuple[FileMetadata, Path]] = []
+        # the local copies that may have the same contents are hashed all at once
+        candidates: dict[str, os.stat_result] = {}
+        for entry in entries:
+            entry_local_path = folder_local_path / entry.path_display[len(dbx_path) + 1:]
+            if isinstance(entry, FolderMetadata):
+                entry_local_path.mkdir(parents=True, exist_ok=True)
+            elif isinstance(entry, FileMetadata):
+                files.append((entry, entry_local_path))
+                try:
+                    file_stat = os.stat(entry_local_path)
+                except FileNotFoundError:
+                    continue
+                if file_stat.st_size == entry.size:
+                    candidates[str(entry_local_path)] = file_stat
+        local_hashes = get_hash_cache().hash_files(candidates) if candidates else {}
+
+        downloads = []
+        total = 0
+        for entry, entry_local_path in files:
+            if local_hashes.get(str(entry_local_path)) == entry.content_hash:
                 continue
+            downloads.append((entry.path_display, entry_local_path))
+            total += entry.size
 
-            current_download_mb = os.path.getsize(local_path) / self.BYTES_TO_MEGABYTES
-            total_mb = total / self.BYTES_TO_MEGABYTES
-            percentage = int(current_download_mb / total_mb * 100)
+        results = self._download_files(downloads, self._download_progress(total, task))
+        return [dbx_path for (dbx_path, _), result in zip(downloads, results) if result is None]
 
-            print(colorama.Fore.MAGENTA + f"Download Progress: {current_download_mb:.2f}/{total_mb:.2f} MB ({percentage}%)")
-            sleep(10)
 
+    def _download_progress(self, total: int, task: ExplorerTask = None) -> TransferProgress:
+        def report(progress: str) -> None:
+            print(colorama.Fore.MAGENTA + f"Download Progress: {progress}")
+            if task is not None:
+                task.set_progress(progress)
+        return TransferProgress(total, report)
 
-    @status_update
-    def download(self, task: ExplorerTask) -> None:
-        path = task.kwargs['path']
-        local_path = task.kwargs['local_path']
 
-        if os.path.exists(local_path):
-            os.remove(local_path)
+    def _download_files(self, downloads: list[tuple[str, Path]], progress: TransferProgress = None, on_verified: Callable[[str, FileMetadata, os.stat_result], None] = None) -> list[FileMetadata | None]:
+        """
+        downloads each (dbx_path, file_local_path), DOWNLOAD_WORKERS at a time.
+        returns the metadata of each download, or None if that one failed.
+        on_verified is called for each file that checks out, see _download_file
+        """
+        if not downloads:
+            return []
 
-        is_file = isinstance(self.dbx.files_get_metadata(path), FileMetadata)
-        if not is_file:
-            local_path += ".zip"
+        def download(dbx_path: str, file_local_path: Path) -> FileMetadata | None:
+            try:
+                return self._download_file(dbx_path, file_local_path, progress, on_verified)
+            except (ApiError, OSError) as e:
+                print(colorama.Fore.RED + f"Failed to download '{dbx_path}' ({e})")
+                return None
 
-        info = {
-            "dbx_path": path,
-            "local_path": local_path,
-            "is_file": is_file,
-            "finished": False
-        }
+        with ThreadPoolExecutor(get_config().download_workers, thread_name_prefix="Download") as executor:
+            return list(executor.map(download, *zip(*downloads)))
 
-        print(colorama.Fore.MAGENTA + f"Downloading \"{path}\" to \"{local_path}\"")
 
-        download_progress_thread = threading.Thread(target=self._download_progress, args=[info], daemon=True)
-        download_progress_thread.start()
+    def _download_file(self, dbx_path: str, file_local_path: Path, progress: TransferProgress = None, on_verified: Callable[[str, FileMetadata, os.stat_result], None] = None) -> FileMetadata:
+        """
+        streams the download next to file_local_path, hashing it on the way, and
+        only puts it in place once it is on disk and matches its content hash,
+        so the local copy is never lost to a bad download.
 
-        if is_file:
-            self.dbx.files_download_to_file(local_path, path)
-        else:
-            self.dbx.files_download_zip_to_file(local_path, path)
+        on_verified(dbx_path, metadata, stat) gets the stat the file will have
+        once it is in place (a rename keeps it), just before it is put there
+        """
+        file_local_path.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = self._partial_path(file_local_path)
 
-        print(colorama.Fore.MAGENTA + f"Download Finished")
-        info["finished"] = True
+        print(colorama.Fore.MAGENTA + f"Downloading \"{dbx_path}\"")
+
+        try:
+            metadata, response = self.dbx.files_download(dbx_path)
+            hasher = ContentHasher()
+            with response, open(partial_path, 'wb') as file:
+                for chunk in response.iter_content(self.DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+                    hasher.update(chunk)
+                    if progress is not None:
+                        progress.advance(len(chunk))
+                file.flush()
+                os.fsync(file.fileno())
+            if hasher.hexdigest() != metadata.content_hash:
+                raise OSError("the download doesn't match its content hash")
+            if on_verified is not None:
+                on_verified(dbx_path, metadata, os.stat(partial_path))
+            os.replace(partial_path, file_local_path)
+        except BaseException:
+            partial_path.unlink(missing_ok=True)
+            raise
+
+        return metadata
+
+
+    @staticmethod
+    def _partial_path(file_local_path: Path) -> Path:
+        return file_local_path.with_name(file_local_path.name + PARTIAL_DOWNLOAD_SUFFIX)
 
 
     @status_update
     def upload_file(self, task: ExplorerTask) -> bool:
-        success = self.api_upload_file(task.kwargs["path"], task.kwargs["dbx_path"])
-        if success:
+        metadata = self.api_upload_file(task.kwargs["path"], task.kwargs["dbx_path"])
+        if metadata is not None:
             self.refresh()
 
 
-    def api_upload_file(self, local_path: str, dbx_path: str) -> bool:
-        success = False
+    def api_upload_file(self, local_path: str, dbx_path: str) -> FileMetadata | None:
+        """
+        returns the metadata of the uploaded file, or None if it failed
+        """
+        metadata = None
 
-        file_size = os.path.getsize(local_path)
+        config = get_config()
+        policy = config.upload_policy
+        file_stat = os.stat(local_path)
+        file_size = file_stat.st_size
 
         print(colorama.Fore.BLUE + f"Uploading '{local_path}' file size: {file_size / self.BYTES_TO_MEGABYTES}")
 
         try:
-            if (file_size / self.BYTES_TO_MEGABYTES) < self.MAX_BUCKET_SIZE:
-                with open(local_path, 'rb') as file:
-                    data = file.read()
-                    self.dbx.files_upload(data, dbx_path, WriteMode.overwrite)
+            if policy.single_request(file_size):
+                with get_upload_budget().reserve(file_size), open(local_path, 'rb') as file:
+                    commit_info = self._commit_info(dbx_path, file_stat)
+                    metadata = self.dbx.files_upload(file.read(), dbx_path, commit_info.mode, client_modified=commit_info.client_modified)
             else:
-                with open(local_path, 'rb') as file:
-                    session_start_result : UploadSessionStartResult = self.dbx.files_upload_session_start(None)
+                metadata = self._upload_session(local_path, file_stat, dbx_path, policy, config.chunk_upload_workers)
+
+        except (ApiError, OSError) as e:
+            print(colorama.Fore.RED + f"Failed to upload '{local_path}' ({e})")
+        else:
+            self.invalidate(dbx_path)
+
+        return metadata
+
+
+    def _upload_session(self, local_path: str, file_stat: os.stat_result, dbx_path: str, policy: UploadPolicy, workers: int) -> FileMetadata:
+        """
+        uploads the file through an upload session that is journaled in the ledger
+        after every chunk, so an upload that was cut off (even by the app closing)
+        carries on from the last chunk Dropbox acknowledged instead of starting over
+        """
+        concurrent = workers > 1
+
+        session = get_ledger().get_upload_session(dbx_path)
+        if session is not None and not session.resumable(local_path, file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino, policy.chunk_size, concurrent):
+            session = None
 
-                    bucket_size_bytes = self.MAX_BUCKET_SIZE_BYTES
-                    session_cursor = UploadSessionCursor(session_start_result.session_id, 0)
-                    commit_info = CommitInfo(dbx_path)
+        def upload(session: UploadSession | None) -> FileMetadata:
+            if concurrent:
+                return self._upload_chunks_concurrently(local_path, file_stat, dbx_path, policy, session, workers)
+            return self._upload_in_chunks(local_path, file_stat, dbx_path, policy, session)
 
-                    number_of_buckets = int((file_size / self.MAX_BUCKET_SIZE_BYTES) + 1)
-                    last_append_size = file_size % self.MAX_BUCKET_SIZE_BYTES
-                    
-                    print(f"bucket size: {bucket_size_bytes}")
-                    print(f"last append size: {last_append_size}")
+        if session is None:
+            metadata = upload(None)
+        else:
+            print(colorama.Fore.BLUE + f"Resuming the upload of '{local_path}'")
+            try:
+                metadata = upload(session)
+            except ApiError as e:
+                # expired, or already finished. anything else (e.g. too_large)
+                # would fail the same way from scratch
+                lookup_error = self._session_lookup_error(e)
+                if lookup_error is None or not (lookup_error.is_not_found() or lookup_error.is_closed()):
+                    raise
+                print(colorama.Fore.YELLOW + f"Couldn't resume the upload of '{local_path}' ({e.error}), starting again")
+                metadata = upload(None)
+
+        get_ledger_writer().remove_upload_session(dbx_path)
+        return metadata
+
+
+    @staticmethod
+    def _commit_info(dbx_path: str, file_stat: os.stat_result) -> CommitInfo:
+        # client_modified keeps the local modified time, Dropbox takes it as whole seconds in UTC
+        client_modified = datetime.fromtimestamp(file_stat.st_mtime_ns // NANOSECONDS, timezone.utc).replace(tzinfo=None)
+        return CommitInfo(dbx_path, WriteMode.overwrite, client_modified=client_modified)
+
+
+    def _new_upload_session(self, session_id: str, local_path: str, file_stat: os.stat_result, dbx_path: str, policy: UploadPolicy, concurrent: bool) -> UploadSession:
+        return UploadSession(
+            dbx_path, local_path, session_id, concurrent, policy.chunk_size, 0, frozenset(),
+            file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino, time_ns()
+        )
+
+
+    @staticmethod
+    def _session_lookup_error(e: ApiError) -> UploadSessionLookupError | None:
+        error = e.error
+        if isinstance(error, UploadSessionFinishError):
+            if not error.is_lookup_failed():
+                return None
+            error = error.get_lookup_failed()
+        return error if isinstance(error, UploadSessionLookupError) else None
+
+
+    def _upload_in_chunks(self, local_path: str, file_stat: os.stat_result, dbx_path: str, policy: UploadPolicy, session: UploadSession | None) -> FileMetadata:
+        """
+        the first chunk starts the upload session and the last one finishes it.
+        if Dropbox has a different offset than the journal, carries on from Dropbox's
+        """
+        ledger_writer = get_ledger_writer()
+        file_size = file_stat.st_size
+        offset = session.acknowledged if session else 0
 
-                    for i in range(1, number_of_buckets + 1):
-                        print(f"uploading bucket {i}/{number_of_buckets}")
+        while True:
+            length = min(policy.chunk_size, file_size - offset)
+
+            print(f"uploading {offset + length}/{file_size} bytes")
+
+            with get_upload_budget().reserve(length):
+                data = policy.read_chunk(local_path, offset, length)
+                try:
+                    if session is None:
+                        session_start_result: UploadSessionStartResult = self.dbx.files_upload_session_start(data)
+                        session = self._new_upload_session(session_start_result.session_id, local_path, file_stat, dbx_path, policy, False)
+                    elif offset + length < file_size:
+                        self.dbx.files_upload_session_append_v2(data, UploadSessionCursor(session.session_id, offset))
+                    else:
+                        return self.dbx.files_upload_session_finish(data, UploadSessionCursor(session.session_id, offset), self._commit_info(dbx_path, file_stat))
+                except ApiError as e:
+                    lookup_error = self._session_lookup_error(e)
+                    if lookup_error is None or not lookup_error.is_incorrect_offset():
+                        raise
+                    offset = lookup_error.get_incorrect_offset().correct_offset
+                    print(colorama.Fore.YELLOW + f"Dropbox already has {offset} bytes of '{local_path}', carrying on from there")
+                    continue
+                finally:
+                    # so the next chunk isn't read while this one is still held
+                    del data
+
+            offset += length
+            session = session._replace(acknowledged=offset)
+            ledger_writer.save_upload_session(session)
+            ledger_writer.flush()
+
+
+    def _upload_chunks_concurrently(self, local_path: str, file_stat: os.stat_result, dbx_path: str, policy: UploadPolicy, session: UploadSession | None, workers: int) -> FileMetadata:
+        """
+        appends the chunks to a concurrent upload session from several threads at
+        once, each one reading its own chunk so only workers chunks are in memory
+        (and no more than the upload budget shared with every other upload).
+        the last chunk closes the session, so it is only sent once every other
+        chunk has landed, and the finish carries no data.
+        chunks already in the journal's session aren't sent again
+        """
+        ledger_writer = get_ledger_writer()
+
+        if session is None:
+            session_start_result: UploadSessionStartResult = self.dbx.files_upload_session_start(b"", session_type=UploadSessionType.concurrent)
+            session = self._new_upload_session(session_start_result.session_id, local_path, file_stat, dbx_path, policy, True)
+            ledger_writer.save_upload_session(session)
+
+        chunks = policy.chunks(file_stat.st_size)
+        last_offset = chunks[-1][0]
+        journal_lock = threading.Lock()
+
+        def append(offset: int, length: int) -> None:
+            nonlocal session
+            with get_upload_budget().reserve(length):
+                data = policy.read_chunk(local_path, offset, length)
+                self.dbx.files_upload_session_append_v2(data, UploadSessionCursor(session.session_id, offset), close=offset == last_offset)
+                del data
+            with journal_lock:
+                session = session._replace(chunks_done=session.chunks_done | {offset})
+                ledger_writer.save_upload_session(session)
+                print(f"uploaded chunk {len(session.chunks_done)}/{len(chunks)}")
+            ledger_writer.flush()
+
+        with ThreadPoolExecutor(workers, thread_name_prefix="ChunkUpload") as executor:
+            futures = [executor.submit(append, offset, length) for offset, length in chunks[:-1] if offset not in session.chunks_done]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        if last_offset not in session.chunks_done:
+            append(*chunks[-1])
+
+        return self.dbx.files_upload_session_finish(b"", UploadSessionCursor(session.session_id, file_stat.st_size), self._commit_info(dbx_path, file_stat))
+
+
+    def upload_files(self, jobs: Iterable[UploadJob]) -> Iterator[UploadResult]:
+        """
+        uploads UPLOAD_WORKERS files at a time, the results come back in the same order as jobs
+        with the FileMetadata of each uploaded file as their value.
 
-                        bucket = file.read(bucket_size_bytes)
-                        self.dbx.files_upload_session_append_v2(bucket, session_cursor)
+        with BATCH_UPLOADS on, files small enough for a single request are only
+        staged as upload sessions and then committed together, up to
+        BATCH_MAX_FILES at a time, so the commit is paid once per batch
+        """
+        config = get_config()
+        pool = UploadPool(self._upload_or_stage if config.batch_uploads else self.api_upload_file, config.upload_workers)
 
-                        if i < number_of_buckets:
-                            session_cursor.offset += bucket_size_bytes
-                        else:
-                            session_cursor.offset += last_append_size
+        # results are held back until the staged uploads before them are committed
+        waiting: list[UploadResult] = []
+        staged: list[UploadResult] = []
 
-                        # print(session_cursor.offset)
+        def commit() -> Iterator[UploadResult]:
+            metadata = self._finish_upload_batch([result.value for result in staged])
+            committed = dict(zip(map(id, staged), metadata))
+            results = [
+                result._replace(success=committed[id(result)] is not None, value=committed[id(result)]) if id(result) in committed else result
+                for result in waiting
+            ]
+            waiting.clear()
+            staged.clear()
+            yield from results
 
-                    print("finish up")
+        for result in pool.run(jobs):
+            waiting.append(result)
+            if isinstance(result.value, UploadSessionFinishArg):
+                staged.append(result)
+                if len(staged) >= self.BATCH_MAX_FILES:
+                    yield from commit()
+            elif not staged:
+                yield from commit()
 
-                    if self._file_exists(dbx_path):
-                        print("deleting previous file")
-                        self.dbx.files_delete(dbx_path)
+        yield from commit()
 
-                    self.dbx.files_upload_session_finish(None, session_cursor, commit_info)
 
-            success = True
-        
-        except ApiError as e:
+    def _upload_or_stage(self, local_path: str, dbx_path: str) -> UploadSessionFinishArg | FileMetadata | None:
+        file_stat = os.stat(local_path)
+        file_size = file_stat.st_size
+
+        if not get_config().upload_policy.single_request(file_size):
+            return self.api_upload_file(local_path, dbx_path)
+
+        print(colorama.Fore.BLUE + f"Staging '{local_path}' file size: {file_size / self.BYTES_TO_MEGABYTES}")
+
+        try:
+            with get_upload_budget().reserve(file_size), open(local_path, 'rb') as file:
+                data = file.read()
+                length = len(data)
+                session_start_result: UploadSessionStartResult = self.dbx.files_upload_session_start(data, close=True)
+                del data
+        except (ApiError, OSError) as e:
             print(colorama.Fore.RED + f"Failed to upload '{local_path}' ({e})")
+            return None
+
+        session_cursor = UploadSessionCursor(session_start_result.session_id, length)
+        return UploadSessionFinishArg(session_cursor, self._commit_info(dbx_path, file_stat))
+
+
+    def _finish_upload_batch(self, entries: list[UploadSessionFinishArg]) -> list[FileMetadata | None]:
+        if not entries:
+            return []
+
+        print(colorama.Fore.BLUE + f"Committing {len(entries)} uploads")
 
-        return success
+        try:
+            batch_result: UploadSessionFinishBatchResult = self.dbx.files_upload_session_finish_batch_v2(entries)
+        except (ApiError, OSError) as e:
+            print(colorama.Fore.RED + f"Failed to commit {len(entries)} uploads ({e})")
+            return [None] * len(entries)
+
+        metadata = []
+        for entry, entry_result in zip(entries, batch_result.entries):
+            if entry_result.is_failure():
+                print(colorama.Fore.RED + f"Failed to upload '{entry.commit.path}' ({entry_result.get_failure()})")
+                metadata.append(None)
+            else:
+                metadata.append(entry_result.get_success())
+                self.invalidate(entry.commit.path)
+        return metadata
+
+
+    def relocate_files(self, relocations: list[tuple[str, str]], move: bool) -> list[Metadata | None]:
+        """
+        moves, or copies, each (from_path, to_path) within Dropbox so nothing is uploaded.
+        returns the metadata at each to_path, or None if that one failed
+        """
+        results = []
+        for start in range(0, len(relocations), self.BATCH_MAX_FILES):
+            results.extend(self._relocate_batch(relocations[start:start + self.BATCH_MAX_FILES], move))
+
+        for (from_path, to_path), metadata in zip(relocations, results):
+            if metadata is not None:
+                self.invalidate(to_path)
+                if move:
+                    self.invalidate(from_path)
+        return results
+
+
+    def _relocate_batch(self, relocations: list[tuple[str, str]], move: bool) -> list[Metadata | None]:
+        verb = "move" if move else "copy"
+
+        try:
+            if len(relocations) == 1:
+                relocate = self.dbx.files_move_v2 if move else self.dbx.files_copy_v2
+                return [relocate(*relocations[0]).metadata]
+
+            print(colorama.Fore.BLUE + f"Batch {verb} of {len(relocations)} files")
+
+            entries = [RelocationPath(from_path, to_path) for from_path, to_path in relocations]
+            if move:
+                launch = self.dbx.files_move_batch_v2(entries)
+                check = self.dbx.files_move_batch_check_v2
+            else:
+                launch = self.dbx.files_copy_batch_v2(entries)
+                check = self.dbx.files_copy_batch_check_v2
+
+            if launch.is_complete():
+                batch_result: RelocationBatchV2Result = launch.get_complete()
+            else:
+                job_id = launch.get_async_job_id()
+                while True:
+                    sleep(self.BATCH_CHECK_INTERVAL)
+                    status = check(job_id)
+                    if not status.is_in_progress():
+                        batch_result = status.get_complete()
+                        break
+        except (ApiError, OSError) as e:
+            print(colorama.Fore.RED + f"Failed to {verb} {len(relocations)} files ({e})")
+            return [None] * len(relocations)
+
+        metadata = []
+        for (from_path, to_path), entry_result in zip(relocations, batch_result.entries):
+            if entry_result.is_success():
+                metadata.append(entry_result.get_success())
+            else:
+                error = entry_result.get_failure() if entry_result.is_failure() else entry_result
+                print(colorama.Fore.RED + f"Failed to {verb} '{from_path}' to '{to_path}' ({error})")
+                metadata.append(None)
+        return metadata
 
 
     @status_update
@@ -257,178 +621,312 @@ class DropboxModel(InterfaceModel):
         path = task.kwargs['path']
         dbx_path = task.kwargs['dbx_path']
 
-        for dirpath, dirnames, filenames in os.walk(path):
-            for filename in filenames:
-                # construct the full local path
-                file_local_path = os.path.join(dirpath, filename)
+        def jobs() -> Iterator[UploadJob]:
+            for dirpath, dirnames, filenames in os.walk(path):
+                for filename in filenames:
+                    # construct the full local path
+                    file_local_path = os.path.join(dirpath, filename)
 
-                # construct the full Dropbox path
-                file_relative_path = os.path.relpath(file_local_path, path)
-                file_dropbox_path = os.path.join(dbx_path, file_relative_path)
-                self.api_upload_file(file_local_path, file_dropbox_path)
+                    # construct the full Dropbox path
+                    file_relative_path = os.path.relpath(file_local_path, path)
+                    file_dropbox_path = os.path.join(dbx_path, file_relative_path)
+                    yield UploadJob(file_local_path, file_dropbox_path)
+
+        for _ in self.upload_files(jobs()):
+            pass
 
         self.refresh()
 
 
     @status_update
-    def sync(self, task: ExplorerTask):
+    def plan_sync(self, task: ExplorerTask):
         local_path = task.kwargs['local_path']
         dbx_path = task.kwargs['dbx_path']
 
-        config = read_config()
+        plan = self.build_sync_plan(local_path, dbx_path)
+        self.plan_ready.emit(plan, {"local_path": local_path, "dbx_path": dbx_path})
 
-        synced_paths: dict = config["TIME_LAST_SYNCED_FROM_CLOUD"]
-        time_zone: str = config["TIME_ZONE"]
 
-        if Path(dbx_path).suffix:
-            self.sync_file(local_path, dbx_path, synced_paths, time_zone)
-        else:
-            self.sync_folder(local_path, dbx_path, time_zone)
+    @status_update
+    def sync(self, task: ExplorerTask):
+        local_path = task.kwargs['local_path']
+        dbx_path = task.kwargs['dbx_path']
+
+        plan: SyncPlan = task.kwargs.get('plan') or self.build_sync_plan(local_path, dbx_path)
+        self.execute_plan(plan, local_path, task)
         self.refresh()
 
 
-    def sync_file(self, local_path: str, dbx_path: str, synced_paths: dict, time_zone: str) -> None:
+    def estimate_upload_requests(self, size: int) -> int:
+        config = get_config()
+        requests = config.upload_policy.requests(size)
+        if config.chunk_upload_workers > 1 and requests > 1:
+            # concurrent sessions are started and finished without any data
+            requests += 2
+        return requests
+
+
+    def build_sync_plan(self, local_path: str, dbx_path: str) -> SyncPlan:
         """
         local_path: the user's local dropbox location
-        dbx_path: the path to the file on the user's dropbox cloud
+        dbx_path: the path to the file or folder on the user's dropbox cloud
         """
+        config = get_config()
+        plan = SyncPlan(SyncLedger.CLOUD, dbx_path)
+        metadata = self.dbx.files_get_metadata(dbx_path)
+        # the local files it ignores are never uploaded, so changes to them don't hold the cursor back
+        matcher = IgnoreMatcher(local_path, config.dbx_ignore, config.gitignore_overrides, gitignore_cache=get_gitignore_cache())
+
+        if isinstance(metadata, FileMetadata):
+            self._plan_file(local_path, metadata, get_ledger(), config.tz, plan, matcher)
+        else:
+            self._plan_folder(local_path, metadata.path_display, get_ledger(), config.tz, plan, matcher, metadata.id)
 
-        dropbox_file_metadata: FileMetadata = self.dbx.files_get_metadata(dbx_path)
+        return plan
 
-        display_path = dropbox_file_metadata.path_display
 
-        tz = pytz.timezone(time_zone)
+    def _list_entries(self, dbx_path: str, cursor: str = None) -> tuple[list[Metadata], str]:
+        """
+        everything in the folder, recursively, or only what changed since cursor.
+        returns the entries and the cursor to list the next changes from
+        """
+        if cursor is None:
+            return list_folder(self.dbx, dbx_path, recursive=True)
+        return list_changes(self.dbx, cursor)
+
 
-        last_dropbox_modification_utc_dt: datetime.datetime = dropbox_file_metadata.server_modified
-        last_dropbox_modification_utc_dt = pytz.UTC.localize(last_dropbox_modification_utc_dt)
+    def _plan_folder(self, local_path: str, dbx_path: str, ledger: SyncLedger, tz: pytz.BaseTzInfo, plan: SyncPlan, matcher: IgnoreMatcher, folder_id: str = None) -> None:
+        """
+        after the first sync of a folder, only what changed in it since the
+        last sync is listed, from the cursor that sync saved.
 
-        file_local_path = Path(local_path, display_path[1:])
+        the folder is listed by its id when there is one, so the cursor
+        follows it if it is renamed (its ledger row is moved along with it)
+        """
+        entries = None
+        cursor = ledger.get_cursor(plan.root)
+        if cursor is not None:
+            try:
+                entries, plan.cursor = self._list_entries(dbx_path, cursor)
+                print(colorama.Fore.BLUE + f"{len(entries)} changes in '{dbx_path}' since the last sync")
+            except ApiError as e:
+                # reset by Dropbox, or the folder isn't there anymore
+                if not isinstance(e.error, ListFolderContinueError):
+                    raise
+                print(colorama.Fore.YELLOW + f"Couldn't list the changes in '{dbx_path}' ({e.error}), listing everything")
+        if entries is None:
+            entries, plan.cursor = self._list_entries(folder_id or dbx_path)
+            self.folder_sizes.add_listing(dbx_path, entries, plan.cursor)
+
+        # only the latest change to each path counts
+        entries = list({entry.path_lower: entry for entry in entries}.values())
+        files = [entry for entry in entries if isinstance(entry, FileMetadata)]
+
+        for entry in entries:
+            if isinstance(entry, DeletedMetadata):
+                self._plan_deleted(local_path, entry.path_display, ledger, plan, matcher)
+
+        # the local copies that may have the same contents are hashed all at once
+        candidates: dict[str, os.stat_result] = {}
+        for entry in files:
+            file_local_path = os.path.join(local_path, entry.path_display[1:])
+            try:
+                file_stat = os.stat(file_local_path)
+            except FileNotFoundError:
+                continue
+            if file_stat.st_size != entry.size or self._synced_content(entry, ledger):
+                continue
+            candidates[file_local_path] = file_stat
+        local_hashes = get_hash_cache().hash_files(candidates) if candidates else {}
 
+        for entry in files:
+            self._plan_file(local_path, entry, ledger, tz, plan, matcher, local_hashes)
 
-        download = False
-        if display_path in synced_paths:
-            last_synced_timestamp = os.path.getmtime(file_local_path)
-            # Convert the timestamp to a datetime object
-            last_synced_dt = datetime.datetime.fromtimestamp(last_synced_timestamp)
-            last_synced_dt = last_synced_dt.replace(microsecond=0)
-            last_synced_dt = tz.localize(last_synced_dt)
 
-            if last_synced_dt < last_dropbox_modification_utc_dt:
-                download = True
-            else:
-                print(colorama.Fore.GREEN + "Didn't need to sync/download " + display_path)
+    def _plan_deleted(self, local_path: str, display_path: str, ledger: SyncLedger, plan: SyncPlan, matcher: IgnoreMatcher) -> None:
+        """
+        a local copy is only deleted if it hasn't changed since it was synced,
+        a deleted folder keeps whatever is left in it
+        """
+        deleted_local_path = os.path.join(local_path, display_path[1:])
+
+        if os.path.isdir(deleted_local_path) and not os.path.islink(deleted_local_path):
+            for dirpath, dirnames, filenames in os.walk(deleted_local_path):
+                for filename in filenames:
+                    file_local_path = os.path.join(dirpath, filename)
+                    self._plan_deleted_file(file_local_path, "/" + os.path.relpath(file_local_path, local_path), ledger, plan, matcher)
+            plan.add(PlanItem(PlanAction.DELETE, display_path, 0, True, reason="deleted in the cloud"))
+        elif os.path.isfile(deleted_local_path):
+            self._plan_deleted_file(deleted_local_path, display_path, ledger, plan, matcher)
+
+
+    def _plan_deleted_file(self, file_local_path: str, relative_path: str, ledger: SyncLedger, plan: SyncPlan, matcher: IgnoreMatcher) -> None:
+        file_stat = os.stat(file_local_path)
+        entries = [entry for entry in (ledger.get_entry(SyncLedger.LOCAL, relative_path), ledger.get_entry(SyncLedger.CLOUD, relative_path)) if entry is not None]
+
+        if not entries:
+            reason = "deleted in the cloud, but never synced from here"
+        elif file_stat.st_mtime_ns > max(entry.mtime_ns for entry in entries):
+            reason = "deleted in the cloud, but changed locally since last sync"
         else:
-            download = True
-
-        if download:
-            if not os.path.exists(file_local_path.parent):
-                os.makedirs(file_local_path.parent)
-
-            print(colorama.Fore.MAGENTA + f"Downloading to local Dropbox: \"{dbx_path}\"")
-            
-            info = {
-                "dbx_path": dbx_path,
-                "local_path": file_local_path,
-                "is_file": True,
-                "finished": False
-            }
-
-            download_progress_thread = threading.Thread(target=self._download_progress, args=[info], daemon=True)
-            download_progress_thread.start()
-            
-            self.dbx.files_download_to_file(file_local_path, dbx_path)
+            plan.add(PlanItem(PlanAction.DELETE, relative_path, file_stat.st_size, mtime_ns=file_stat.st_mtime_ns, reason="deleted in the cloud"))
+            return
 
-            print(colorama.Fore.MAGENTA + f"Download Finished")
-            info["finished"] = True
+        plan.add(PlanItem(PlanAction.SKIP, relative_path, file_stat.st_size, mtime_ns=file_stat.st_mtime_ns, reason=reason))
+        if self._waits_for_upload(file_local_path, file_stat, entries, matcher):
+            plan.deferred.append(relative_path)
 
-            self.update_last_time_synced(local_path, [display_path], time_zone, False)
-            # because we essentially 'modified' the local copy
-            self.update_last_time_synced(local_path, [display_path], time_zone)
 
+    @staticmethod
+    def _waits_for_upload(file_local_path: str, file_stat: os.stat_result, entries: list[LedgerEntry], matcher: IgnoreMatcher) -> bool:
+        """
+        whether the local copy changed since it was last synced and the next
+        local sync will upload it, which settles a cloud change left alone for it.
+        anything else would never be settled, and would hold the cursor back for good
+        """
+        if not entries or file_stat.st_mtime_ns <= max(entry.mtime_ns for entry in entries):
+            return False
+        return not matcher.is_ignored(file_local_path)
 
-    def sync_folder(self, local_path: str, dbx_path: str, time_zone: str) -> None:
+
+    @staticmethod
+    def _synced_content(dropbox_file_metadata: FileMetadata, ledger: SyncLedger) -> bool:
         """
-        local_path: the user's local dropbox location
-        dbx_path: the path to the folder on the user's dropbox cloud
+        whether the file's contents are what either side last synced
         """
+        display_path = dropbox_file_metadata.path_display
+        entries = (ledger.get_entry(SyncLedger.CLOUD, display_path), ledger.get_entry(SyncLedger.LOCAL, display_path))
+        return dropbox_file_metadata.content_hash in {entry.content_hash for entry in entries if entry is not None}
+
 
-        display_path = self.dbx.files_get_metadata(dbx_path).path_display
-        folder_local_path = Path(local_path, display_path[1:])
+    def _plan_file(self, local_path: str, dropbox_file_metadata: FileMetadata, ledger: SyncLedger, tz: pytz.BaseTzInfo, plan: SyncPlan, matcher: IgnoreMatcher, local_hashes: dict[str, str | None] = None) -> None:
+        """
+        the contents are compared first, by content hash, so a file that was
+        uploaded from here is never downloaded again. otherwise the local copy's
+        modified time is compared with client_modified, which uploads from here
+        set to the local modified time.
 
-        if not os.path.exists(folder_local_path.parent):
-            os.makedirs(folder_local_path.parent)
-        elif os.path.exists(folder_local_path):
-            shutil.rmtree(folder_local_path)
+        tz: only used to display times
+        local_hashes: the local copy's content hash, by its path, if it was already hashed
+        """
+        display_path = dropbox_file_metadata.path_display
+        cloud_hash = dropbox_file_metadata.content_hash
 
-        zip_path = str(folder_local_path) + ".zip"
+        # client_modified is a naive datetime in UTC
+        last_dropbox_modification = calendar.timegm(dropbox_file_metadata.client_modified.timetuple())
 
-        print(colorama.Fore.MAGENTA + f"Downloading to local Dropbox: \"{dbx_path}\"")
-        info = {
-            "dbx_path": dbx_path,
-            "local_path": zip_path,
-            "is_file": False,
-            "finished": False
-        }
-        download_progress_thread = threading.Thread(target=self._download_progress, args=[info], daemon=True)
-        download_progress_thread.start()
+        file_local_path = Path(local_path, display_path[1:])
 
-        self.dbx.files_download_zip_to_file(zip_path, dbx_path)
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(folder_local_path.parent)
+        try:
+            file_stat = os.stat(file_local_path)
+        except FileNotFoundError:
+            file_stat = None
 
-        print(colorama.Fore.MAGENTA + f"Download Finished")
-        info["finished"] = True
+        cloud_entry = ledger.get_entry(SyncLedger.CLOUD, display_path)
+        local_entry = ledger.get_entry(SyncLedger.LOCAL, display_path)
 
-        files = []
+        if file_stat is not None:
+            if self._synced_content(dropbox_file_metadata, ledger):
+                plan.add(PlanItem(PlanAction.SKIP, display_path, dropbox_file_metadata.size, mtime_ns=file_stat.st_mtime_ns, reason="unchanged in the cloud since last sync", content_hash=cloud_hash))
+                return
+            if local_hashes is not None:
+                local_hash = local_hashes.get(str(file_local_path))
+            elif file_stat.st_size == dropbox_file_metadata.size:
+                local_hash = get_hash_cache().get(str(file_local_path), file_stat)
+            else:
+                local_hash = None
+            if local_hash == cloud_hash:
+                plan.add(PlanItem(PlanAction.MARK_SYNCED, display_path, dropbox_file_metadata.size, mtime_ns=file_stat.st_mtime_ns, reason="local copy has the same contents", content_hash=cloud_hash))
+                return
 
-        for dirpath, dirnames, filenames in os.walk(folder_local_path):
-            for filename in filenames:
-                # construct the full local path
-                file_local_path = os.path.join(dirpath, filename)
-                file_relative_path = "/" + os.path.relpath(file_local_path, self.local_root)
-                files.append(file_relative_path)
+        if cloud_entry is None and local_entry is None:
+            reason = "never synced"
+        elif file_stat is None:
+            reason = "missing locally"
+        else:
+            # client_modified only has whole seconds
+            local_modified_ns = file_stat.st_mtime_ns
 
-        self.update_last_time_synced(local_path, files, time_zone)
+            if local_modified_ns // NANOSECONDS < last_dropbox_modification:
+                reason = "modified in the cloud"
+            else:
+                print(colorama.Fore.GREEN + "Didn't need to sync/download " + display_path + " (local copy modified " + format_timestamp(local_modified_ns, tz) + ")")
+                plan.add(PlanItem(PlanAction.SKIP, display_path, dropbox_file_metadata.size, mtime_ns=local_modified_ns, reason="local copy is newer"))
+                entries = [entry for entry in (local_entry, cloud_entry) if entry is not None]
+                if self._waits_for_upload(str(file_local_path), file_stat, entries, matcher):
+                    plan.deferred.append(display_path)
+                return
 
-        os.remove(zip_path)
+        plan.add(PlanItem(PlanAction.DOWNLOAD, display_path, dropbox_file_metadata.size, requests=1, reason=reason, content_hash=cloud_hash))
 
-    def update_last_time_synced(self, local_path: str, new_paths: list[str], time_zone: str, local: bool = True):
-        '''
-        puts all the paths in new_paths in TIME_LAST_SYNCED_FROM_... with their
-        modified time.
 
-        local_path: the path to the user's local dropbox folder
-        new_paths: the list of paths that correspond to the ones in the cloud
-        '''
+    def execute_plan(self, plan: SyncPlan, local_path: str, task: ExplorerTask = None) -> None:
+        ledger_writer = get_ledger_writer()
+        failed = False
+
+        # deletions first, a deleted folder may have been replaced by something that is downloaded
+        for item in plan.of(PlanAction.DELETE):
+            item_local_path = Path(local_path, item.path[1:])
+            if item.is_dir:
+                self._remove_empty_folders(item_local_path)
+                continue
+            try:
+                os.remove(item_local_path)
+            except OSError as e:
+                print(colorama.Fore.RED + f"Failed to delete '{item_local_path}' ({e})")
+                failed = True
+                continue
+            ledger_writer.remove(SyncLedger.LOCAL, [item.path])
+            ledger_writer.remove(SyncLedger.CLOUD, [item.path])
+
+        def record(dbx_path: str, metadata: FileMetadata, file_stat: os.stat_result) -> None:
+            # both sides, because we essentially 'modified' the local copy
+            ledger_writer.set(SyncLedger.CLOUD, dbx_path, file_stat.st_mtime_ns, metadata.content_hash)
+            ledger_writer.set(SyncLedger.LOCAL, dbx_path, file_stat.st_mtime_ns, metadata.content_hash, file_stat.st_ino, file_stat.st_size)
+
+        items = plan.of(PlanAction.DOWNLOAD)
+        downloads = [(item.path, Path(local_path, item.path[1:])) for item in items]
+        # the watcher leaves these alone until their ledger entries are committed,
+        # which happens once for all of them instead of after every file
+        destinations = {str(file_local_path) for _, file_local_path in downloads}
+        with self._downloading_lock:
+            self._downloading |= destinations
+        try:
+            results = self._download_files(downloads, self._download_progress(plan.download_bytes, task), record)
+            ledger_writer.flush()
+        finally:
+            with self._downloading_lock:
+                self._downloading -= destinations
+        failed = failed or any(metadata is None for metadata in results)
+
+        for item in plan.of(PlanAction.MARK_SYNCED):
+            try:
+                file_stat = os.stat(Path(local_path, item.path[1:]))
+            except FileNotFoundError:
+                continue
+            # changed since it was compared, it's up to the next sync
+            if file_stat.st_mtime_ns != item.mtime_ns:
+                continue
+            # both sides, so a local sync doesn't upload the same contents again
+            ledger_writer.set(SyncLedger.CLOUD, item.path, file_stat.st_mtime_ns, item.content_hash)
+            ledger_writer.set(SyncLedger.LOCAL, item.path, file_stat.st_mtime_ns, item.content_hash, file_stat.st_ino, file_stat.st_size)
+
+        # otherwise the next sync lists the same changes again
+        if plan.deferred:
+            print(colorama.Fore.YELLOW + f"{len(plan.deferred)} changes in '{plan.root}' were left alone, they will be listed again next sync")
+        if plan.cursor is not None and not failed and not plan.deferred:
+            ledger_writer.set_cursor(plan.root, plan.cursor)
+
+
+    @staticmethod
+    def _remove_empty_folders(folder_local_path: Path) -> None:
+        for dirpath, dirnames, filenames in os.walk(folder_local_path, topdown=False):
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                # something was kept in it
+                pass
 
-        if local:
-            suffix = "LOCAL"
-        else:
-            suffix = "CLOUD"
-
-        with open(Path(Path(__file__).parents[2], 'config.json'), 'r+') as json_file:
-            json_data = json.load(json_file)
-
-            new_entries = {}
-
-            for path in new_paths:
-                file_local_path = Path(local_path, path[1:])
-                timestamp = os.path.getmtime(file_local_path)
-                # Convert the timestamp to a datetime object
-                dt = datetime.datetime.fromtimestamp(timestamp)
-                dt = dt.replace(microsecond=0)
-                # Format the datetime object as a string
-                tz = pytz.timezone(time_zone)
-                dt = tz.localize(dt)
-                formatted = dt.strftime(TIMESTAMP_FORMAT)
-                
-                new_entries[path] = formatted
-
-            json_data['TIME_LAST_SYNCED_FROM_' + suffix].update(new_entries)
-            json_file.seek(0)
-            json.dump(json_data, json_file, indent=4)
-            json_file.truncate()
-    
 
     def _file_exists(self, path):
         try:
@@ -0,0 +1,189 @@
+"""
+How much is in a Dropbox folder, from one recursive listing kept up to date with its cursor
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Iterable
+
+from dropbox import Dropbox
+from dropbox.exceptions import ApiError
+from dropbox.files import (DeletedMetadata, FileMetadata, FolderMetadata,
+                           ListFolderContinueError, Metadata)
+
+from package.model.listing import list_changes, list_folder
+
+
+class FolderListing:
+    '''
+    The sizes of every file under root (lowercased paths) and the total of
+    every folder under it, root included, as of cursor
+    '''
+
+    def __init__(self, root: str, cursor: str) -> None:
+        self.root = root
+        self.cursor = cursor
+        self.files: dict[str, int] = {}
+        self.folders: dict[str, int] = {root: 0}
+        self.checked = time.monotonic()
+
+    def apply(self, entries: Iterable[Metadata]) -> None:
+        for entry in entries:
+            if isinstance(entry, FileMetadata):
+                self._set_file(entry.path_lower, entry.size)
+            elif isinstance(entry, FolderMetadata):
+                self.folders.setdefault(entry.path_lower, 0)
+            elif isinstance(entry, DeletedMetadata):
+                self._delete(entry.path_lower)
+
+    def _set_file(self, path: str, size: int) -> None:
+        change = size - self.files.get(path, 0)
+        self.files[path] = size
+        for folder in self._parents(path):
+            self.folders[folder] = self.folders.get(folder, 0) + change
+
+    def _delete(self, path: str) -> None:
+        # the listing doesn't say whether it was a file or a folder
+        if path in self.files:
+            for folder in self._parents(path):
+                self.folders[folder] -= self.files[path]
+            del self.files[path]
+            return
+
+        prefix = path + "/"
+        for file_path in [file_path for file_path in self.files if file_path.startswith(prefix)]:
+            self._set_file(file_path, 0)
+            del self.files[file_path]
+        for folder in [folder for folder in self.folders if folder == path or folder.startswith(prefix)]:
+            del self.folders[folder]
+
+    def _parents(self, path: str) -> Iterable[str]:
+        while path != self.root:
+            path = path.rsplit("/", 1)[0]
+            yield path
+
+
+class FolderSizes:
+    '''
+    Folder sizes for the explorer and for transfers. A folder is listed
+    recursively once, after which only what changed since is fetched
+    from the listing's cursor. The listing of a folder also answers for
+    every folder inside it.
+
+    The explorer only reads what is already known, and only if it was
+    checked in the last MAX_AGE seconds, so browsing never waits on Dropbox.
+    Nothing is listed while the lock is held, so a long listing doesn't
+    keep the explorer from reading either.
+    '''
+
+    MAX_AGE = 5 * 60 # seconds
+
+    def __init__(self, dbx: Dropbox) -> None:
+        self.dbx = dbx
+        self._listings: dict[str, FolderListing] = {}
+        self._lock = threading.Lock()
+
+    def size(self, dbx_path: str) -> int | None:
+        '''
+        the total size of everything in the folder, listing it if it hasn't been
+        '''
+        path = self._normalise(dbx_path)
+        with self._lock:
+            listing = self._listing_of(path)
+        if listing is None:
+            self.add_listing(dbx_path, *list_folder(self.dbx, dbx_path, recursive=True))
+            return self.cached_size(dbx_path)
+
+        try:
+            self.refresh(dbx_path)
+        except Exception:
+            # sizes that can't be brought up to date aren't shown at all
+            with self._lock:
+                if self._listings.get(listing.root) is listing:
+                    del self._listings[listing.root]
+            raise
+        return self.cached_size(dbx_path)
+
+    def cached_size(self, dbx_path: str) -> int | None:
+        '''
+        as of the last listing or refresh, None if the folder isn't in one
+        '''
+        path = self._normalise(dbx_path)
+        with self._lock:
+            listing = self._listing_of(path)
+            return listing.folders.get(path) if listing else None
+
+    def sizes_in(self, dbx_path: str) -> dict[str, int]:
+        '''
+        lowercased path -> total size of the folders directly in dbx_path that
+        are in a listing checked in the last MAX_AGE seconds. Nothing is
+        fetched from Dropbox.
+        '''
+        path = self._normalise(dbx_path)
+        with self._lock:
+            listing = self._listing_of(path)
+            if listing is None or time.monotonic() - listing.checked >= self.MAX_AGE:
+                return {}
+            return {folder: size for folder, size in listing.folders.items() if folder != path and folder.rsplit("/", 1)[0] == path}
+
+    def add_listing(self, dbx_path: str, entries: Iterable[Metadata], cursor: str) -> None:
+        '''
+        a complete recursive listing of dbx_path, from here or from anything
+        else that listed it anyway (e.g. a download)
+        '''
+        path = self._normalise(dbx_path)
+        listing = FolderListing(path, cursor)
+        listing.apply(entries)
+        with self._lock:
+            # the listings of folders inside this one aren't needed anymore
+            for root in [root for root in self._listings if self._contains(path, root)]:
+                del self._listings[root]
+            self._listings[path] = listing
+
+    def refresh(self, dbx_path: str) -> None:
+        '''
+        applies what changed in the listing dbx_path is in since its cursor
+        '''
+        path = self._normalise(dbx_path)
+        with self._lock:
+            listing = self._listing_of(path)
+            if listing is None:
+                return
+            root, cursor = listing.root, listing.cursor
+
+        try:
+            entries, new_cursor = list_changes(self.dbx, cursor)
+        except ApiError as e:
+            # reset by Dropbox, or the folder isn't there anymore
+            if not isinstance(e.error, ListFolderContinueError):
+                raise
+            with self._lock:
+                self._listings.pop(root, None)
+            if e.error.is_path():
+                return
+            self.add_listing(root, *list_folder(self.dbx, root, recursive=True))
+            return
+
+        with self._lock:
+            # unless another thread has already brought it up to date
+            if self._listings.get(root) is listing and listing.cursor == cursor:
+                listing.apply(entries)
+                listing.cursor = new_cursor
+                listing.checked = time.monotonic()
+
+    def _listing_of(self, path: str) -> FolderListing | None:
+        for root, listing in self._listings.items():
+            if self._contains(root, path):
+                return listing
+        return None
+
+    @staticmethod
+    def _contains(root: str, path: str) -> bool:
+        return path == root or path.startswith(root + "/")
+
+    @staticmethod
+    def _normalise(dbx_path: str) -> str:
+        # the root of the Dropbox is ""
+        return dbx_path.rstrip("/").lower()
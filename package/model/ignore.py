@@ -0,0 +1,306 @@
+"""
+Decides which local paths are left out of a sync
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from collections.abc import Callable, Iterable
+from typing import NamedTuple
+
+import colorama
+import pathspec
+
+from package.model.ledger import LedgerWriter, SyncLedger
+
+DBX_IGNORE = "DBX_IGNORE"
+GITIGNORE = ".gitignore"
+PARTIAL_DOWNLOAD = "partial download"
+# bytes that aren't UTF-8 in the name, which neither Dropbox nor the ledger can take
+INVALID_NAME = "invalid name"
+# downloads are written next to where they go under this suffix until they are verified
+PARTIAL_DOWNLOAD_SUFFIX = ".dbx-partial"
+
+
+class PathTrie:
+    '''
+    The literal paths from DBX_IGNORE or GITIGNORE_OVERRIDES, split into
+    folder names so a path is looked up one name at a time while walking
+    down the tree instead of comparing it against every entry
+    '''
+
+    _END = ""
+
+    def __init__(self, paths: Iterable[str]) -> None:
+        self.root: dict = {}
+        for path in paths:
+            node = self.root
+            for name in self._split(path):
+                node = node.setdefault(name, {})
+            node[self._END] = True
+
+    @staticmethod
+    def _split(path: str) -> list[str]:
+        return [name for name in path.split("/") if name]
+
+    @classmethod
+    def child(cls, node: dict | None, name: str) -> dict | None:
+        return node.get(name) if node else None
+
+    @classmethod
+    def is_end(cls, node: dict | None) -> bool:
+        return bool(node) and cls._END in node
+
+    def walk(self, path: str) -> tuple[dict | None, bool]:
+        '''
+        returns the node for path and whether it (or any folder above it) is in the trie
+        '''
+        node = self.root
+        for name in self._split(path):
+            if self.is_end(node):
+                return None, True
+            node = self.child(node, name)
+        return node, self.is_end(node)
+
+
+class GitignoreCache:
+    '''
+    .gitignore specs kept between syncs, keyed by the path of the .gitignore
+    and checked against its modified time and size, so unchanged files are
+    never read again.
+
+    The compiled specs only last as long as the app, between runs the
+    patterns (already rebased onto the root) are kept in the ledger and
+    compiled again from there, the specs themselves can't be stored safely.
+    '''
+
+    def __init__(self, ledger: SyncLedger, ledger_writer: LedgerWriter) -> None:
+        self.ledger = ledger
+        self.ledger_writer = ledger_writer
+        self._lock = threading.Lock()
+        # gitignore path -> (mtime_ns, size, relative_dir, spec)
+        self._entries: dict[str, tuple[int, int, str, pathspec.PathSpec]] = {}
+        self._seen: set[str] = set()
+
+    def get(self, gitignore_path: str, relative_dir: str, read_patterns: Callable[[], list[str]]) -> pathspec.PathSpec:
+        '''
+        read_patterns returns the patterns of the .gitignore rebased onto the root
+        '''
+        stat = os.stat(gitignore_path)
+        key = (stat.st_mtime_ns, stat.st_size, relative_dir)
+        with self._lock:
+            self._seen.add(gitignore_path)
+            cached = self._entries.get(gitignore_path)
+        if cached and cached[:3] == key:
+            return cached[3]
+
+        saved = self.ledger.get_gitignore(gitignore_path)
+        if saved is not None and saved[:3] == key:
+            patterns = saved[3]
+        else:
+            patterns = read_patterns()
+            self.ledger_writer.set_gitignore(gitignore_path, *key, patterns)
+
+        spec = pathspec.GitIgnoreSpec.from_lines(patterns)
+        with self._lock:
+            self._entries[gitignore_path] = (*key, spec)
+        return spec
+
+    def prune(self) -> None:
+        '''
+        forgets the .gitignore files that weren't seen since the last prune and have disappeared
+        '''
+        with self._lock:
+            seen = self._seen
+            self._seen = set()
+            for path in [path for path in self._entries if path not in seen and not os.path.exists(path)]:
+                self._entries.pop(path)
+        self.ledger_writer.remove_gitignores(path for path in self.ledger.gitignore_paths() if path not in seen and not os.path.exists(path))
+
+
+class DirectoryContext(NamedTuple):
+    relative_dir: str # relative to the root of the matcher, "" for the root itself
+    dbx_ignore_node: dict | None
+    override_node: dict | None
+    overridden: bool
+    spec: pathspec.PathSpec | None
+
+
+class IgnoreMatcher:
+    '''
+    DBX_IGNORE, GITIGNORE_OVERRIDES and the .gitignore files found along the way,
+    compiled once per sync.
+
+    The patterns of every .gitignore are rewritten to be relative to the root
+    and appended to the spec inherited from the folder above, so each
+    directory holds a single spec that already includes every .gitignore
+    above it (later patterns win, same as git).
+    '''
+
+    def __init__(self, root: str, dbx_ignore: Iterable[str], gitignore_overrides: Iterable[str], gitignore: bool = True, gitignore_cache: GitignoreCache = None) -> None:
+        self.root = root.rstrip("/") or "/"
+        self.dbx_ignore = PathTrie(dbx_ignore)
+        self.gitignore_overrides = PathTrie(gitignore_overrides)
+        self.gitignore = gitignore
+        self.gitignore_cache = gitignore_cache
+        self._contexts: dict[str, DirectoryContext | None] = {}
+        self._contexts_lock = threading.Lock()
+
+    def context_for(self, dir_path: str) -> DirectoryContext | None:
+        '''
+        the context for a folder somewhere under the root without scanning
+        everything above it, or None if the folder is ignored
+        '''
+        dir_path = dir_path.rstrip("/") or "/"
+        with self._contexts_lock:
+            if dir_path in self._contexts:
+                return self._contexts[dir_path]
+
+        if dir_path == self.root:
+            context = self.enter(None, dir_path, self._gitignore_names(dir_path))
+        else:
+            parent_path = os.path.dirname(dir_path)
+            parent = self.context_for(parent_path)
+            if parent is None or self.ignored(parent, dir_path, True):
+                context = None
+            else:
+                context = self.enter(parent, dir_path, self._gitignore_names(dir_path))
+
+        with self._contexts_lock:
+            self._contexts[dir_path] = context
+        return context
+
+    def is_ignored(self, path: str, is_dir: bool = False) -> bool:
+        '''
+        whether path, somewhere under the root, is ignored itself or is in an ignored folder
+        '''
+        context = self.context_for(os.path.dirname(path.rstrip("/")))
+        return context is None or self.ignored(context, path, is_dir) is not None
+
+    def invalidate(self, dir_path: str) -> None:
+        '''
+        forgets the contexts of dir_path and everything under it, e.g. after
+        a .gitignore in it changed
+        '''
+        dir_path = dir_path.rstrip("/") or "/"
+        prefix = dir_path.rstrip("/") + "/"
+        with self._contexts_lock:
+            for path in [path for path in self._contexts if path == dir_path or path.startswith(prefix)]:
+                del self._contexts[path]
+
+    @staticmethod
+    def _gitignore_names(dir_path: str) -> list[str]:
+        return [GITIGNORE] if os.path.isfile(os.path.join(dir_path, GITIGNORE)) else []
+
+    def enter(self, context: DirectoryContext | None, dir_path: str, names: Iterable[str]) -> DirectoryContext:
+        if context is None:
+            # the root, or the first folder of a scan that started further down
+            relative_dir = os.path.relpath(dir_path, self.root)
+            dbx_ignore_node, _ = self.dbx_ignore.walk(dir_path)
+            override_node, overridden = self.gitignore_overrides.walk(dir_path)
+            context = DirectoryContext("" if relative_dir == "." else relative_dir, dbx_ignore_node, override_node, overridden, None)
+        else:
+            name = os.path.basename(dir_path)
+            override_node = PathTrie.child(context.override_node, name)
+            context = DirectoryContext(
+                context.relative_dir + "/" + name if context.relative_dir else name,
+                PathTrie.child(context.dbx_ignore_node, name),
+                override_node,
+                context.overridden or PathTrie.is_end(override_node),
+                context.spec
+            )
+
+        if self.gitignore and GITIGNORE in names:
+            spec = self._read_gitignore(dir_path, context.relative_dir)
+            if spec is not None:
+                context = context._replace(spec=spec if context.spec is None else context.spec + spec)
+
+        return context
+
+    def ignored(self, context: DirectoryContext, path: str, is_dir: bool) -> str | None:
+        name = os.path.basename(path)
+
+        try:
+            name.encode("utf-8")
+        except UnicodeEncodeError:
+            return INVALID_NAME
+
+        if PathTrie.is_end(PathTrie.child(context.dbx_ignore_node, name)):
+            return DBX_IGNORE
+
+        if name.endswith(PARTIAL_DOWNLOAD_SUFFIX) and not is_dir:
+            return PARTIAL_DOWNLOAD
+
+        if context.spec is None or context.overridden or PathTrie.is_end(PathTrie.child(context.override_node, name)):
+            return None
+
+        relative_path = context.relative_dir + "/" + name if context.relative_dir else name
+        if self._matches(context.spec, relative_path + "/" if is_dir else relative_path):
+            return GITIGNORE
+
+        return None
+
+    @staticmethod
+    def _matches(spec: pathspec.PathSpec, relative_path: str) -> bool:
+        '''
+        whether the last pattern that matches the path itself ignores it, same as git.
+        pathspec also matches "folder/" against everything in the folder, which would
+        undo e.g. "folder/**" followed by "!folder/sub/" for the files in sub, so those
+        matches are skipped here; what is in an ignored folder is never looked at anyway
+        '''
+        for pattern in reversed(spec.patterns):
+            if pattern.include is None:
+                continue
+            result = pattern.match_file(relative_path)
+            if result is None:
+                continue
+            if "ps_d" in pattern.regex.groupindex and result.match.start("ps_d") != -1 and result.match.end("ps_d") != len(relative_path):
+                continue
+            return pattern.include
+        return False
+
+    def _read_gitignore(self, dir_path: str, relative_dir: str) -> pathspec.PathSpec | None:
+        gitignore_path = os.path.join(dir_path, GITIGNORE)
+        print(colorama.Fore.CYAN + "Found .gitignore: " + gitignore_path)
+
+        def read_patterns() -> list[str]:
+            with open(gitignore_path) as file:
+                return self._rebase_patterns(file.readlines(), relative_dir)
+
+        try:
+            if self.gitignore_cache is not None:
+                return self.gitignore_cache.get(gitignore_path, relative_dir, read_patterns)
+            return pathspec.GitIgnoreSpec.from_lines(read_patterns())
+        except (OSError, UnicodeDecodeError):
+            return None
+
+    @staticmethod
+    def _rebase_patterns(lines: Iterable[str], relative_dir: str) -> list[str]:
+        '''
+        rewrites .gitignore lines from relative_dir so they match paths relative to the root
+        '''
+        prefix = "/" + relative_dir + "/" if relative_dir else "/"
+        rebased = []
+
+        for line in lines:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+
+            negate = line.startswith("!")
+            pattern = line[1:] if negate else line
+
+            # "folder/**" is everything in the folder but not the folder itself
+            if pattern.endswith("/**"):
+                pattern += "/*"
+
+            # a slash anywhere except at the end anchors the pattern to the .gitignore's folder
+            if "/" in pattern.rstrip("/"):
+                pattern = prefix + pattern.lstrip("/")
+            else:
+                pattern = prefix + "**/" + pattern
+
+            rebased.append("!" + pattern if negate else pattern)
+
+        return rebased
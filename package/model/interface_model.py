@@ -1,16 +1,19 @@
 from __future__ import annotations
 
+import traceback
 from enum import Enum
 
 from PyQt5.QtCore import QObject, QThread, pyqtSignal
 
-from package.utils import read_config
+from package.model.ledger import LedgerWriteError
+from package.utils import Config, get_config, get_ledger_writer
 
 
 class TaskItemStatus(Enum):
     QUEUED = 1
     RUNNING = 2
     DONE = 3
+    FAILED = 4
 
 class MyThread(QThread):
     def __init__(self, parent, target=None, args=[]):
@@ -30,29 +33,53 @@ class ExplorerTask(QObject):
         self.action = action
         self.status = TaskItemStatus.QUEUED
         self.kwargs = kwargs
+        self.progress: str = None # e.g. how much of a download is done
+        self.error: str = None # what went wrong, the task fails if it is set
 
     def emit_update(self):
         self.task_update.emit()
 
+    def set_progress(self, progress: str):
+        self.progress = progress
+        self.emit_update()
+
+    def fail(self, error: str):
+        self.error = error if self.error is None else f"{self.error}; {error}"
+
 class InterfaceModel(QObject):
 
     refresh_signal = pyqtSignal()
+    # a SyncPlan and the kwargs to sync it with
+    plan_ready = pyqtSignal(object, dict)
 
     def __init__(self, local_root) -> None:
         super().__init__()
         self.local_root = local_root
 
-    def read_config(self) -> dict:
-        return read_config()
+    def read_config(self) -> Config:
+        return get_config()
 
     def refresh(self):
         self.refresh_signal.emit()
 
+    def wait_for_tasks(self) -> None:
+        '''
+        blocks until every task started by perform_task has finished
+        '''
+        for thread in self.findChildren(MyThread):
+            thread.wait()
+
     def get_list_of_paths(self, directory: str) -> list:
         '''
         retrieves a list of files and folders given a directory path
         '''
 
+    def invalidate(self, path: str) -> None:
+        '''
+        anything remembered about path and the directory it is in is checked
+        again the next time it is listed
+        '''
+
     def perform_task(self, task: ExplorerTask) -> MyThread:
         '''
         performs a given action using multithreading
@@ -63,9 +90,19 @@ class InterfaceModel(QObject):
             task.status = TaskItemStatus.RUNNING
             task.emit_update()
 
-            func(self, task)
+            try:
+                func(self, task)
+            except Exception as e:
+                traceback.print_exc()
+                task.fail(repr(e))
+
+            try:
+                # make sure everything the task synced is on disk before it is shown as done
+                get_ledger_writer().flush()
+            except LedgerWriteError as e:
+                task.fail(str(e))
 
-            task.status = TaskItemStatus.DONE
+            task.status = TaskItemStatus.DONE if task.error is None else TaskItemStatus.FAILED
             task.emit_update()
 
         return inner
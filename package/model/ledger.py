@@ -0,0 +1,589 @@
+"""
+Keeps track of when each path was last synced from local and from the cloud.
+Replaces the TIME_LAST_SYNCED_FROM_* dicts that used to live in config.json
+"""
+
+from __future__ import annotations
+
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from contextlib import contextmanager
+from datetime import datetime
+from typing import NamedTuple
+
+import pytz
+
+OLD_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S%z"
+
+NANOSECONDS = 10 ** 9
+
+def legacy_timestamp_to_ns(timestamp: str, tz: pytz.BaseTzInfo = None) -> int:
+    '''
+    converts a TIMESTAMP_FORMAT or OLD_TIMESTAMP_FORMAT string to epoch nanoseconds.
+    OLD_TIMESTAMP_FORMAT strings have no offset so they are read in tz
+    (or the system's time zone if tz is None).
+
+    the strings only have whole seconds, so the result is the very end of
+    that second. otherwise every file modified partway through the second
+    it was synced would look newer than the ledger
+    '''
+    try:
+        dt = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+    except ValueError:
+        dt = datetime.strptime(timestamp, OLD_TIMESTAMP_FORMAT)
+        if tz is not None:
+            dt = tz.localize(dt)
+    return int(dt.timestamp()) * NANOSECONDS + NANOSECONDS - 1
+
+
+class LedgerEntry(NamedTuple):
+    mtime_ns: int
+    content_hash: str | None = None # Dropbox's content hash of what was synced, if known
+    # of the local file when it was synced, to recognise it after a rename
+    inode: int | None = None
+    size: int | None = None
+
+
+class UploadSession(NamedTuple):
+    '''
+    an upload session that hasn't been finished yet, so it can be picked up
+    again after a crash. sequential sessions keep the number of bytes
+    Dropbox has acknowledged, concurrent ones the offsets of the chunks it has
+    '''
+    dbx_path: str
+    local_path: str
+    session_id: str
+    concurrent: bool
+    chunk_size: int
+    acknowledged: int
+    chunks_done: frozenset[int]
+    size: int
+    mtime_ns: int
+    inode: int
+    started_ns: int
+
+    LIFETIME_NS = 6 * 24 * 60 * 60 * NANOSECONDS # Dropbox keeps sessions for 7 days
+
+    def resumable(self, local_path: str, size: int, mtime_ns: int, inode: int, chunk_size: int, concurrent: bool) -> bool:
+        return (
+            (self.local_path, self.size, self.mtime_ns, self.inode, self.chunk_size, self.concurrent)
+            == (local_path, size, mtime_ns, inode, chunk_size, concurrent)
+            and time.time_ns() - self.started_ns < self.LIFETIME_NS
+        )
+
+
+class SyncLedger:
+    '''
+    Maps each synced path to the modified time (in epoch nanoseconds)
+    of the local copy when it was last synced.
+
+    Also keeps a snapshot of every local folder that was fully synced: its
+    modified time and a digest of the files inside of it (see
+    ScannedDirectory.digest), keyed by its path ("/" for the root).
+    And a journal of unfinished upload sessions (see UploadSession), the
+    content hashes of local files keyed by (inode, size, mtime_ns), the
+    list_folder cursor of each Dropbox folder that was synced, keyed by its
+    lowercase path, and the patterns of each .gitignore found, rewritten to
+    be relative to the root (see GitignoreCache).
+    '''
+
+    LOCAL = "LOCAL"
+    CLOUD = "CLOUD"
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, db_path) -> None:
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # commits are batched by LedgerWriter so each one can afford a full sync
+        self._connection.execute("PRAGMA synchronous=FULL")
+        self._create_tables()
+
+    def _create_tables(self) -> None:
+        with self.transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS synced ("
+                "   source TEXT NOT NULL,"
+                "   path TEXT NOT NULL,"
+                "   mtime_ns INTEGER NOT NULL,"
+                "   content_hash TEXT,"
+                "   inode INTEGER,"
+                "   size INTEGER,"
+                "   PRIMARY KEY (source, path)"
+                ") WITHOUT ROWID"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS synced_inode ON synced (source, inode)")
+            connection.execute("CREATE INDEX IF NOT EXISTS synced_content_hash ON synced (source, content_hash)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS snapshot ("
+                "   path TEXT PRIMARY KEY,"
+                "   mtime_ns INTEGER NOT NULL,"
+                "   digest BLOB NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS upload_sessions ("
+                "   dbx_path TEXT PRIMARY KEY,"
+                "   local_path TEXT NOT NULL,"
+                "   session_id TEXT NOT NULL,"
+                "   concurrent INTEGER NOT NULL,"
+                "   chunk_size INTEGER NOT NULL,"
+                "   acknowledged INTEGER NOT NULL,"
+                "   chunks_done TEXT NOT NULL,"
+                "   size INTEGER NOT NULL,"
+                "   mtime_ns INTEGER NOT NULL,"
+                "   inode INTEGER NOT NULL,"
+                "   started_ns INTEGER NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS local_hashes ("
+                "   inode INTEGER NOT NULL,"
+                "   size INTEGER NOT NULL,"
+                "   mtime_ns INTEGER NOT NULL,"
+                "   content_hash TEXT NOT NULL,"
+                "   PRIMARY KEY (inode, size, mtime_ns)"
+                ") WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cursors ("
+                "   dbx_path TEXT PRIMARY KEY,"
+                "   cursor TEXT NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS gitignores ("
+                "   path TEXT PRIMARY KEY,"
+                "   mtime_ns INTEGER NOT NULL,"
+                "   size INTEGER NOT NULL,"
+                "   relative_dir TEXT NOT NULL,"
+                "   patterns TEXT NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            else:
+                self._connection.execute("COMMIT")
+
+    def get(self, source: str, path: str) -> int | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT mtime_ns FROM synced WHERE source = ? AND path = ?", (source, path)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_entry(self, source: str, path: str) -> LedgerEntry | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT mtime_ns, content_hash, inode, size FROM synced WHERE source = ? AND path = ?", (source, path)
+            ).fetchone()
+        return LedgerEntry(*row) if row else None
+
+    def find_by_inode(self, source: str, inode: int) -> dict[str, LedgerEntry]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, mtime_ns, content_hash, inode, size FROM synced WHERE source = ? AND inode = ?", (source, inode)
+            ).fetchall()
+        return {path: LedgerEntry(*entry) for path, *entry in rows}
+
+    def find_by_content_hash(self, source: str, content_hash: str) -> dict[str, LedgerEntry]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, mtime_ns, content_hash, inode, size FROM synced WHERE source = ? AND content_hash = ?", (source, content_hash)
+            ).fetchall()
+        return {path: LedgerEntry(*entry) for path, *entry in rows}
+
+    def hashed_sizes(self, source: str) -> set[int]:
+        '''
+        the sizes of the synced files whose content hash is known
+        '''
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT size FROM synced WHERE source = ? AND content_hash IS NOT NULL AND size IS NOT NULL", (source,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def get_local_hash(self, inode: int, size: int, mtime_ns: int) -> str | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content_hash FROM local_hashes WHERE inode = ? AND size = ? AND mtime_ns = ?", (inode, size, mtime_ns)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_all(self, source: str) -> dict[str, int]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, mtime_ns FROM synced WHERE source = ? ORDER BY path", (source,)
+            ).fetchall()
+        return dict(rows)
+
+    def has_prefix(self, prefix: str) -> bool:
+        '''
+        whether anything at or under prefix was synced, from either side
+        '''
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM synced WHERE path = ? OR (path >= ? AND path < ?) LIMIT 1", self._prefix_range(prefix)
+            ).fetchone()
+        return row is not None
+
+    def paths(self, source: str) -> list[str]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path FROM synced WHERE source = ? ORDER BY path", (source,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_snapshot(self) -> dict[str, tuple[int, bytes]]:
+        with self._lock:
+            rows = self._connection.execute("SELECT path, mtime_ns, digest FROM snapshot").fetchall()
+        return {path: (mtime_ns, digest) for path, mtime_ns, digest in rows}
+
+    def get_upload_session(self, dbx_path: str) -> UploadSession | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT dbx_path, local_path, session_id, concurrent, chunk_size, acknowledged,"
+                " chunks_done, size, mtime_ns, inode, started_ns FROM upload_sessions WHERE dbx_path = ?", (dbx_path,)
+            ).fetchone()
+        if row is None:
+            return None
+        row = list(row)
+        row[3] = bool(row[3])
+        row[6] = frozenset(json.loads(row[6]))
+        return UploadSession(*row)
+
+    def get_cursor(self, dbx_path: str) -> str | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT cursor FROM cursors WHERE dbx_path = ?", (dbx_path.lower(),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_gitignore(self, gitignore_path: str) -> tuple[int, int, str, list[str]] | None:
+        '''
+        (mtime_ns, size, relative_dir, patterns) of the .gitignore when its patterns were saved
+        '''
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT mtime_ns, size, relative_dir, patterns FROM gitignores WHERE path = ?", (gitignore_path,)
+            ).fetchone()
+        if row is None:
+            return None
+        mtime_ns, size, relative_dir, patterns = row
+        return mtime_ns, size, relative_dir, json.loads(patterns)
+
+    def gitignore_paths(self) -> list[str]:
+        with self._lock:
+            rows = self._connection.execute("SELECT path FROM gitignores").fetchall()
+        return [row[0] for row in rows]
+
+    def apply(self, entries: dict[tuple[str, str], LedgerEntry | None], prefixes: Iterable[tuple[str, str]] = (), snapshot: dict[str, tuple[int, bytes] | None] = None, upload_sessions: dict[str, UploadSession | None] = None, local_hashes: dict[tuple[int, int, int], str] = None, renames: Iterable[tuple[str, str]] = (), cursors: dict[str, str | None] = None, gitignores: dict[str, tuple[int, int, str, list[str]] | None] = None) -> None:
+        '''
+        writes everything in one transaction. the prefixes (folders) are
+        removed first, then each (source, path) in entries is set to its
+        LedgerEntry, or removed if it is None. snapshot works the same way
+        with (mtime_ns, digest) for each folder, and upload_sessions with
+        the UploadSession for each Dropbox path. local_hashes replaces any
+        older hash of the same inode. cursors and gitignores work like snapshot,
+        with the cursor for each Dropbox folder and the (mtime_ns, size,
+        relative_dir, patterns) for each .gitignore. Last, everything under each (prefix,
+        new_prefix) in renames is moved to new_prefix, from both sides, the
+        snapshot and the cursors, replacing whatever was there.
+        '''
+        with self.transaction() as connection:
+            for source, prefix in prefixes:
+                connection.execute(
+                    "DELETE FROM synced WHERE source = ? AND (path = ? OR (path >= ? AND path < ?))",
+                    (source, *self._prefix_range(prefix))
+                )
+            connection.executemany(
+                "INSERT OR REPLACE INTO synced (source, path, mtime_ns, content_hash, inode, size) VALUES (?, ?, ?, ?, ?, ?)",
+                ((source, path, *entry) for (source, path), entry in entries.items() if entry is not None)
+            )
+            connection.executemany(
+                "DELETE FROM synced WHERE source = ? AND path = ?",
+                (key for key, entry in entries.items() if entry is None)
+            )
+            if snapshot:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO snapshot (path, mtime_ns, digest) VALUES (?, ?, ?)",
+                    ((path, *value) for path, value in snapshot.items() if value is not None)
+                )
+                connection.executemany(
+                    "DELETE FROM snapshot WHERE path = ?",
+                    ((path,) for path, value in snapshot.items() if value is None)
+                )
+            if upload_sessions:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO upload_sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        session._replace(chunks_done=json.dumps(sorted(session.chunks_done)))
+                        for session in upload_sessions.values() if session is not None
+                    )
+                )
+                connection.executemany(
+                    "DELETE FROM upload_sessions WHERE dbx_path = ?",
+                    ((dbx_path,) for dbx_path, session in upload_sessions.items() if session is None)
+                )
+            if local_hashes:
+                connection.executemany(
+                    "DELETE FROM local_hashes WHERE inode = ?",
+                    ((inode,) for inode, _, _ in local_hashes)
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO local_hashes (inode, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+                    ((*key, content_hash) for key, content_hash in local_hashes.items())
+                )
+            if cursors:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO cursors (dbx_path, cursor) VALUES (?, ?)",
+                    ((dbx_path, cursor) for dbx_path, cursor in cursors.items() if cursor is not None)
+                )
+                connection.executemany(
+                    "DELETE FROM cursors WHERE dbx_path = ?",
+                    ((dbx_path,) for dbx_path, cursor in cursors.items() if cursor is None)
+                )
+            if gitignores:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO gitignores (path, mtime_ns, size, relative_dir, patterns) VALUES (?, ?, ?, ?, ?)",
+                    ((path, *value[:3], json.dumps(value[3])) for path, value in gitignores.items() if value is not None)
+                )
+                connection.executemany(
+                    "DELETE FROM gitignores WHERE path = ?",
+                    ((path,) for path, value in gitignores.items() if value is None)
+                )
+            for prefix, new_prefix in renames:
+                for table, column, old, new in (("synced", "path", prefix, new_prefix), ("snapshot", "path", prefix, new_prefix), ("cursors", "dbx_path", prefix.lower(), new_prefix.lower())):
+                    connection.execute(
+                        f"DELETE FROM {table} WHERE {column} = ? OR ({column} >= ? AND {column} < ?)", self._prefix_range(new)
+                    )
+                    connection.execute(
+                        f"UPDATE {table} SET {column} = ? || substr({column}, ?) WHERE {column} = ? OR ({column} >= ? AND {column} < ?)",
+                        (new, len(old) + 1, *self._prefix_range(old))
+                    )
+
+    @staticmethod
+    def _prefix_range(prefix: str) -> tuple[str, str, str]:
+        # '0' is the character straight after '/', so every path
+        # inside the folder sorts between "prefix/" and "prefix0"
+        prefix = prefix.rstrip("/")
+        return prefix, prefix + "/", prefix + "0"
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class LedgerWriteError(Exception):
+    '''
+    some of what was queued on the LedgerWriter couldn't be committed
+    '''
+
+
+class LedgerWriter:
+    '''
+    The only thing that writes to the ledger. Worker threads queue their
+    updates here and they get committed together in one transaction once
+    BATCH_SIZE of them have built up or BATCH_INTERVAL seconds have passed.
+    Updates to the same path are coalesced so only the latest one is written.
+
+    A batch that fails to commit is dropped, and the next flush raises
+    LedgerWriteError for it, so whoever waits on the writer finds out.
+    '''
+
+    BATCH_SIZE = 1000
+    BATCH_INTERVAL = 5.0 # in seconds
+
+    _STOP = object()
+
+    def __init__(self, ledger: SyncLedger) -> None:
+        self.ledger = ledger
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="LedgerWriter", daemon=True)
+        self._thread.start()
+
+    def set(self, source: str, path: str, mtime_ns: int, content_hash: str = None, inode: int = None, size: int = None) -> None:
+        self._queue.put(("set", source, {path: LedgerEntry(mtime_ns, content_hash, inode, size)}))
+
+    def move(self, source: str, path: str, new_path: str, entry: LedgerEntry) -> None:
+        '''
+        the entry of path is now the one of new_path
+        '''
+        self._queue.put(("set", source, {path: None, new_path: entry}))
+
+    def update(self, source: str, entries: dict[str, int]) -> None:
+        '''
+        entries: path -> mtime_ns, any content hash they had is forgotten
+        '''
+        if entries:
+            self._queue.put(("set", source, {path: LedgerEntry(mtime_ns) for path, mtime_ns in entries.items()}))
+
+    def remove(self, source: str, paths: Iterable[str]) -> None:
+        paths = list(paths)
+        if paths:
+            self._queue.put(("remove", source, paths))
+
+    def remove_prefix(self, source: str, prefix: str) -> None:
+        self._queue.put(("remove_prefix", source, prefix))
+
+    def rename_prefix(self, prefix: str, new_prefix: str) -> None:
+        '''
+        everything at or under prefix is now under new_prefix. committed in
+        its own transaction, straight after anything queued before it
+        '''
+        self._queue.put(("rename_prefix", prefix.rstrip("/"), new_prefix.rstrip("/")))
+
+    def set_snapshot(self, path: str, mtime_ns: int, digest: bytes) -> None:
+        self._queue.put(("snapshot", {path: (mtime_ns, digest)}))
+
+    def remove_snapshot(self, paths: Iterable[str]) -> None:
+        paths = list(paths)
+        if paths:
+            self._queue.put(("snapshot", dict.fromkeys(paths)))
+
+    def save_upload_session(self, session: UploadSession) -> None:
+        self._queue.put(("upload_session", {session.dbx_path: session}))
+
+    def remove_upload_session(self, dbx_path: str) -> None:
+        self._queue.put(("upload_session", {dbx_path: None}))
+
+    def set_local_hash(self, inode: int, size: int, mtime_ns: int, content_hash: str) -> None:
+        self._queue.put(("local_hash", {(inode, size, mtime_ns): content_hash}))
+
+    def set_cursor(self, dbx_path: str, cursor: str) -> None:
+        self._queue.put(("cursor", {dbx_path.lower(): cursor}))
+
+    def remove_cursor(self, dbx_path: str) -> None:
+        self._queue.put(("cursor", {dbx_path.lower(): None}))
+
+    def set_gitignore(self, gitignore_path: str, mtime_ns: int, size: int, relative_dir: str, patterns: list[str]) -> None:
+        self._queue.put(("gitignore", {gitignore_path: (mtime_ns, size, relative_dir, patterns)}))
+
+    def remove_gitignores(self, gitignore_paths: Iterable[str]) -> None:
+        gitignore_paths = list(gitignore_paths)
+        if gitignore_paths:
+            self._queue.put(("gitignore", dict.fromkeys(gitignore_paths)))
+
+    def flush(self) -> None:
+        '''
+        blocks until everything queued before this call has been committed,
+        raises LedgerWriteError if any of it (or anything since the last
+        flush) couldn't be
+        '''
+        if not self._thread.is_alive():
+            return
+        done = threading.Event()
+        errors: list[str] = []
+        self._queue.put(("flush", done, errors))
+        done.wait()
+        if errors:
+            raise LedgerWriteError("; ".join(errors))
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+
+    def _run(self) -> None:
+        # (source, path) -> LedgerEntry, or None if the path is to be removed
+        pending: dict[tuple[str, str], LedgerEntry | None] = {}
+        pending_prefixes: list[tuple[str, str]] = []
+        # folder -> (mtime_ns, digest), or None if it is to be removed
+        pending_snapshot: dict[str, tuple[int, bytes] | None] = {}
+        pending_sessions: dict[str, UploadSession | None] = {}
+        pending_local_hashes: dict[tuple[int, int, int], str] = {}
+        # at most one, the batch is committed as soon as it is queued
+        pending_renames: list[tuple[str, str]] = []
+        pending_cursors: dict[str, str | None] = {}
+        pending_gitignores: dict[str, tuple[int, int, str, list[str]] | None] = {}
+        # the flushes waiting on the batch and the errors to pass on to them
+        waiting: list[tuple[threading.Event, list[str]]] = []
+        errors: list[str] = []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                op = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                op = None
+
+            stop = op is self._STOP
+
+            if op is not None and not stop:
+                if op[0] == "flush":
+                    waiting.append(op[1:])
+                elif op[0] == "set":
+                    _, source, entries = op
+                    for path, entry in entries.items():
+                        pending[(source, path)] = entry
+                elif op[0] == "remove":
+                    _, source, paths = op
+                    for path in paths:
+                        pending[(source, path)] = None
+                elif op[0] == "remove_prefix":
+                    _, source, prefix = op
+                    prefix = prefix.rstrip("/")
+                    for key in [key for key in pending if key[0] == source and (key[1] == prefix or key[1].startswith(prefix + "/"))]:
+                        pending.pop(key)
+                    pending_prefixes.append((source, prefix))
+                elif op[0] == "snapshot":
+                    pending_snapshot.update(op[1])
+                elif op[0] == "upload_session":
+                    pending_sessions.update(op[1])
+                elif op[0] == "local_hash":
+                    pending_local_hashes.update(op[1])
+                elif op[0] == "rename_prefix":
+                    pending_renames.append(op[1:])
+                elif op[0] == "cursor":
+                    pending_cursors.update(op[1])
+                elif op[0] == "gitignore":
+                    pending_gitignores.update(op[1])
+
+                if deadline is None and (pending or pending_prefixes or pending_snapshot or pending_sessions or pending_local_hashes or pending_cursors or pending_gitignores):
+                    deadline = time.monotonic() + self.BATCH_INTERVAL
+
+            if stop or waiting or pending_renames or len(pending) >= self.BATCH_SIZE or (deadline is not None and time.monotonic() >= deadline):
+                try:
+                    if pending or pending_prefixes or pending_snapshot or pending_sessions or pending_local_hashes or pending_renames or pending_cursors or pending_gitignores:
+                        # prefixes go first, any pending entries under them were queued afterwards.
+                        # everything else was queued before the rename
+                        self.ledger.apply(pending, pending_prefixes, pending_snapshot, pending_sessions, pending_local_hashes, pending_renames, pending_cursors, pending_gitignores)
+                except Exception as e:
+                    # anything, since the thread has to outlive a bad batch for the ones after it
+                    print(f"Failed to write {len(pending)} entries to the ledger ({e!r})")
+                    errors.append(f"failed to write {len(pending)} entries to the ledger ({e!r})")
+                finally:
+                    pending = {}
+                    pending_prefixes = []
+                    pending_snapshot = {}
+                    pending_sessions = {}
+                    pending_local_hashes = {}
+                    pending_renames = []
+                    pending_cursors = {}
+                    pending_gitignores = {}
+                    deadline = None
+                    if waiting:
+                        for event, flush_errors in waiting:
+                            flush_errors.extend(errors)
+                            event.set()
+                        waiting = []
+                        errors = []
+
+            if stop:
+                return
@@ -0,0 +1,32 @@
+"""
+Lists Dropbox folders through every page of list_folder
+"""
+
+from __future__ import annotations
+
+from dropbox import Dropbox
+from dropbox.files import ListFolderResult, Metadata
+
+
+def list_folder(dbx: Dropbox, dbx_path: str, recursive: bool = False) -> tuple[list[Metadata], str]:
+    '''
+    everything in the folder (and in the folders inside it if recursive).
+    returns the entries and the cursor to list the next changes from
+    '''
+    return _all_pages(dbx, dbx.files_list_folder(dbx_path, recursive=recursive))
+
+
+def list_changes(dbx: Dropbox, cursor: str) -> tuple[list[Metadata], str]:
+    '''
+    what changed since cursor, and the cursor to list the next changes from
+    '''
+    return _all_pages(dbx, dbx.files_list_folder_continue(cursor))
+
+
+def _all_pages(dbx: Dropbox, result: ListFolderResult) -> tuple[list[Metadata], str]:
+    entries = []
+    while True:
+        entries.extend(result.entries)
+        if not result.has_more:
+            return entries, result.cursor
+        result = dbx.files_list_folder_continue(result.cursor)
@@ -0,0 +1,116 @@
+"""
+The contents of recently visited Dropbox folders, so going back to one doesn't list it again
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+
+from dropbox import Dropbox
+from dropbox.exceptions import ApiError
+from dropbox.files import DeletedMetadata, ListFolderContinueError, Metadata
+
+from package.model.listing import list_changes, list_folder
+
+
+class FolderContents:
+    '''
+    what is directly in a folder, by lowercased path, as of cursor
+    '''
+
+    def __init__(self, cursor: str) -> None:
+        self.cursor = cursor
+        self.entries: dict[str, Metadata] = {}
+        self.checked = time.monotonic()
+        self.stale = False # something in it was changed from here
+
+    def apply(self, entries: list[Metadata]) -> None:
+        for entry in entries:
+            if isinstance(entry, DeletedMetadata):
+                self.entries.pop(entry.path_lower, None)
+            else:
+                self.entries[entry.path_lower] = entry
+
+
+class ListingCache:
+    '''
+    The last CAPACITY folders listed, least recently used dropped first.
+
+    A folder checked in the last MAX_AGE seconds is served as it is,
+    otherwise only what changed since its cursor is fetched. Whatever
+    is changed from here should be passed to invalidate so the folders
+    it is in are checked the next time instead.
+    '''
+
+    CAPACITY = 64 # folders
+    MAX_AGE = 10 # seconds
+
+    def __init__(self, dbx: Dropbox) -> None:
+        self.dbx = dbx
+        self._folders: OrderedDict[str, FolderContents] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def list(self, dbx_path: str) -> list[Metadata]:
+        path = self._normalise(dbx_path)
+        with self._lock:
+            contents = self._folders.get(path)
+            if contents is not None:
+                self._folders.move_to_end(path)
+                if not contents.stale and time.monotonic() - contents.checked < self.MAX_AGE:
+                    return list(contents.entries.values())
+                cursor = contents.cursor
+                # changes made from here while this is being fetched mark it stale again
+                contents.stale = False
+
+        if contents is None:
+            return self._list(dbx_path)
+
+        try:
+            entries, new_cursor = list_changes(self.dbx, cursor)
+        except ApiError as e:
+            # reset by Dropbox, or the folder isn't there anymore
+            if not isinstance(e.error, ListFolderContinueError):
+                raise
+            with self._lock:
+                self._folders.pop(path, None)
+            return self._list(dbx_path)
+
+        with self._lock:
+            # unless another thread has already brought it up to date
+            if contents.cursor == cursor:
+                contents.apply(entries)
+                contents.cursor = new_cursor
+            contents.checked = time.monotonic()
+            return list(contents.entries.values())
+
+    def invalidate(self, dbx_path: str) -> None:
+        '''
+        dbx_path was created, changed, moved or deleted: the folder it is in,
+        and it and the folders inside it if it is one, are checked the next
+        time they are listed
+        '''
+        path = self._normalise(dbx_path)
+        parent = path.rsplit("/", 1)[0]
+        with self._lock:
+            for folder, contents in self._folders.items():
+                if folder == parent or folder == path or folder.startswith(path + "/"):
+                    contents.stale = True
+
+    def _list(self, dbx_path: str) -> list[Metadata]:
+        entries, cursor = list_folder(self.dbx, dbx_path)
+        contents = FolderContents(cursor)
+        contents.apply(entries)
+
+        with self._lock:
+            self._folders[self._normalise(dbx_path)] = contents
+            self._folders.move_to_end(self._normalise(dbx_path))
+            while len(self._folders) > self.CAPACITY:
+                self._folders.popitem(last=False)
+            return list(contents.entries.values())
+
+    @staticmethod
+    def _normalise(dbx_path: str) -> str:
+        # the root of the Dropbox is ""
+        return dbx_path.rstrip("/").lower()
@@ -1,27 +1,68 @@
-import datetime
-import json
 import os
 import platform
 import shutil
 import subprocess
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Callable
 
 import colorama
-import pathspec
-import pytz
+from dropbox.exceptions import ApiError
+from dropbox.files import RelocationError
+from PyQt5.QtCore import pyqtSignal
 
 from package.model.dbx_model import DropboxModel
+from package.model.ignore import IgnoreMatcher
 from package.model.interface_model import (ExplorerTask, InterfaceModel,
                                            MyThread)
-from package.utils import TIMESTAMP_FORMAT, read_config
+from package.model.ledger import LedgerEntry, SyncLedger
+from package.model.scanner import ScanEntry, ScannedDirectory, TreeScanner
+from package.model.sync_plan import PlanAction, PlanItem, SyncPlan
+from package.model.upload_pool import UploadJob
+from package.model.watcher import LocalWatcher
+from package.utils import (get_config, get_gitignore_cache, get_hash_cache,
+                           get_ledger, get_ledger_writer)
 
 colorama.init(autoreset=True)  # Automatically reset colors after each print
 
 class LocalModel(InterfaceModel):
+
+    # relative paths that changed locally, emitted by the watcher
+    local_changes = pyqtSignal(list)
+
     def __init__(self, local_root, dbx_model: DropboxModel) -> None:
         super().__init__(local_root)
         self.dbx_model = dbx_model
+        self.watcher: LocalWatcher = None
+        self._watcher_rules: tuple[object, IgnoreMatcher] = None # (the config they were built from, the rules)
+        # one sync (or plan) at a time, so two can't upload or delete the same paths at once
+        self._sync_lock = threading.Lock()
+        # what the watcher saw change that no sync_paths has picked up yet
+        self._changed_paths: set[str] = set()
+        self._changed_paths_lock = threading.Lock()
+
+    def start_watching(self) -> None:
+        config = get_config()
+        if not config.watch_local_changes or self.watcher is not None:
+            return
+        self.watcher = LocalWatcher(self.local_root, self.local_changes.emit, self._watcher_ignore_rules, self.dbx_model.is_downloading)
+        self.watcher.start()
+
+    def _watcher_ignore_rules(self) -> IgnoreMatcher:
+        '''
+        built again whenever config.json changes, get_config gives a new Config then
+        '''
+        config = get_config()
+        if self._watcher_rules is None or self._watcher_rules[0] is not config:
+            matcher = IgnoreMatcher(self.local_root, config.dbx_ignore, config.gitignore_overrides, gitignore_cache=get_gitignore_cache())
+            self._watcher_rules = (config, matcher)
+        return self._watcher_rules[1]
+
+    def stop_watching(self) -> None:
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
 
     def get_list_of_paths(self, directory: str) -> list:
         file_list = []
@@ -42,6 +83,8 @@ class LocalModel(InterfaceModel):
             'rename': self.rename,
             'open': self.open_path,
             'sync': self.sync,
+            'plan_sync': self.plan_sync,
+            'sync_paths': self.sync_paths,
             'mark_as_synced': self.mark_as_synced
         }
 
@@ -58,22 +101,16 @@ class LocalModel(InterfaceModel):
         self.refresh()
 
     def _delete_local(self, path):
-        config = read_config()
-        synced_paths: dict = config["TIME_LAST_SYNCED_FROM_LOCAL"]
+        ledger_writer = get_ledger_writer()
 
         relative_path = "/" + os.path.relpath(path, self.local_root)
 
         if os.path.isfile(path):
             os.remove(path)
-            if relative_path in synced_paths:
-                synced_paths.pop(relative_path)
+            ledger_writer.remove(SyncLedger.LOCAL, [relative_path])
         else:
             shutil.rmtree(path)
-            keys_to_remove = [key for key in synced_paths.keys() if key.startswith(relative_path)]
-            for key in keys_to_remove:
-                synced_paths.pop(key)
-
-        self._write_to_synced_paths(synced_paths)
+            ledger_writer.remove_prefix(SyncLedger.LOCAL, relative_path)
 
     @status_update
     def delete_local(self, task: ExplorerTask) -> None:
@@ -90,9 +127,45 @@ class LocalModel(InterfaceModel):
 
     @status_update
     def rename(self, task: ExplorerTask) -> None:
+        '''
+        if anything under path was synced it is renamed in the cloud as well,
+        and its ledger entries are moved along, so nothing is transferred again
+        '''
         path = task.kwargs['path']
         new_path = task.kwargs['new_path']
-        os.rename(path, new_path)
+        relative_path = "/" + os.path.relpath(path, self.local_root)
+        new_relative_path = "/" + os.path.relpath(new_path, self.local_root)
+
+        ledger_writer = get_ledger_writer()
+        ledger_writer.flush()
+
+        # the cloud goes first so nothing has changed if it fails
+        moved_in_cloud = False
+        if get_ledger().has_prefix(relative_path):
+            try:
+                self.dbx_model.api_move(relative_path, new_relative_path)
+                moved_in_cloud = True
+            except ApiError as e:
+                error = e.error
+                not_in_cloud = isinstance(error, RelocationError) and error.is_from_lookup() and error.get_from_lookup().is_not_found()
+                if not not_in_cloud:
+                    print(colorama.Fore.RED + f"Failed to rename '{relative_path}' in Dropbox ({error})")
+                    task.fail(f"couldn't rename '{relative_path}' in Dropbox ({error})")
+                    return
+
+        try:
+            os.rename(path, new_path)
+        except OSError:
+            if moved_in_cloud:
+                try:
+                    self.dbx_model.api_move(new_relative_path, relative_path)
+                except Exception as e:
+                    # the task still fails with why the rename did
+                    print(colorama.Fore.RED + f"Failed to move '{new_relative_path}' back to '{relative_path}' in Dropbox ({e}), it is only renamed there")
+                    task.fail(f"'{relative_path}' is renamed to '{new_relative_path}' in Dropbox only")
+            raise
+
+        ledger_writer.rename_prefix(relative_path, new_relative_path)
 
     @status_update
     def open_path(self, task: ExplorerTask) -> None:
@@ -107,202 +180,306 @@ class LocalModel(InterfaceModel):
         path: str = task.kwargs['path']
         is_file: bool = task.kwargs['is_file']            
 
-        config = read_config()
-        synced_paths: dict = config["TIME_LAST_SYNCED_FROM_LOCAL"]
-        time_zone: str = config["TIME_ZONE"]
-
-        current_time = datetime.datetime.now()
-        current_time = current_time.replace(microsecond=0)
-        tz = pytz.timezone(time_zone)
-        current_time = tz.localize(current_time)
-        current_time_formatted = current_time.strftime(TIMESTAMP_FORMAT)
+        synced_paths = {}
+        current_time_ns = time.time_ns()
 
         if is_file:
             file_relative_path = "/" + os.path.relpath(path, self.local_root)
-            synced_paths[file_relative_path] = current_time_formatted
+            synced_paths[file_relative_path] = current_time_ns
         else:
             for dirpath, dirnames, filenames in os.walk(path):
                 for filename in filenames:
                     file_local_path = os.path.join(dirpath, filename)
                     file_relative_path = "/" + os.path.relpath(file_local_path, self.local_root)
-                    synced_paths[file_relative_path] = current_time_formatted
+                    synced_paths[file_relative_path] = current_time_ns
         
-        self._write_to_synced_paths(synced_paths)
-
-
-    @staticmethod
-    def _get_applicable_gitignores(path: str, gitignore_stack: list[tuple[str, pathspec.PathSpec]]) -> list:
-        applicable: Callable[[str], bool] = []
+        get_ledger_writer().update(SyncLedger.LOCAL, synced_paths)
+
+
+    @contextmanager
+    def _syncing(self, task: ExplorerTask):
+        '''
+        waits for any sync that is already running
+        '''
+        if not self._sync_lock.acquire(blocking=False):
+            task.set_progress("waiting for the sync before it")
+            self._sync_lock.acquire()
+            task.set_progress(None)
+        try:
+            yield
+        finally:
+            self._sync_lock.release()
 
-        for gitignore_path, gitignore_match in gitignore_stack:
-            if path.startswith(os.path.dirname(gitignore_path)):
-                applicable.append(gitignore_match)
-
-        return applicable
+    @status_update
+    def plan_sync(self, task: ExplorerTask) -> None:
+        with self._syncing(task):
+            plan = self.build_sync_plan()
+        self.plan_ready.emit(plan, {})
 
     @status_update
     def sync(self, task: ExplorerTask) -> None:
-        config = read_config()
-        synced_paths: dict = config["TIME_LAST_SYNCED_FROM_LOCAL"]
-        dbx_ignore: set = config["DBX_IGNORE"]
-        gitignore_overrides: set = config["GITIGNORE_OVERRIDES"]
-        time_zone: str = config["TIME_ZONE"]
-
-        gitignore_stack: list[tuple[str, pathspec.PathSpec]] = []
-        applicable_gitignores: list[pathspec.PathSpec] = []
-
-        ignored_directories: list[str] = []
-        ignored_dirs_stack: list[int] = []
-
-        dirpath: str
-        dirnames: list[str]
-        filenames: list[str]
-
-        last_dbx_ignored: str = None
-
-        for dirpath, dirnames, filenames in os.walk(self.local_root):
-            # Checks if the current directory is in ignored_directories.
-            # If so, continue to next directory
-            skip_dir = False
-            for dir in ignored_directories:
-                if dirpath.startswith(dir):
-                    skip_dir = True
-                    break
-            if skip_dir:
-                continue
-            
-            if last_dbx_ignored and dirpath.startswith(last_dbx_ignored):
-                print(colorama.Fore.CYAN + "Ignoring folder in DBX_IGNORE:", "/" + os.path.relpath(dirpath, self.local_root))
-                continue
-
-            skip = False
-            for ignored in config["DBX_IGNORE"]:
-                if dirpath.startswith(ignored):
-                    last_dbx_ignored = dirpath
-                    skip = True
-                    break
-            if skip:
-                print(colorama.Fore.CYAN + "Ignoring folder in DBX_IGNORE:", "/" + os.path.relpath(dirpath, self.local_root))
-                continue
-
-            override_gitignore = False
-            for override in gitignore_overrides:
-                if dirpath.startswith(override):
-                    override_gitignore = True
-                    break
-
-            # consider gitignore files
-            if '.gitignore' in filenames:
-                gitignore_path = os.path.join(dirpath, '.gitignore')
-                print(colorama.Fore.CYAN + "Found .gitignore: " + gitignore_path)
-                with open(gitignore_path) as file:
-                    spec = pathspec.GitIgnoreSpec.from_lines(file.readlines())
-                    gitignore_stack.append((gitignore_path, spec))
-
-                new_ignored_dicts = []
+        with self._syncing(task):
+            plan: SyncPlan = task.kwargs.get('plan') or self.build_sync_plan()
+            self.execute_plan(plan)
+        self.refresh()
 
-                for dirname in dirnames:
-                    dir_local_path = os.path.join(dirpath, dirname)
-                    if spec.match_file(dirname) and dir_local_path not in gitignore_overrides and not override_gitignore:
-                        new_ignored_dicts.append(dir_local_path)
-                        print(colorama.Fore.CYAN + "Ignoring folder in .gitignore:", os.path.join(dirpath, dirname))
+    @status_update
+    def sync_paths(self, task: ExplorerTask) -> None:
+        '''
+        only syncs the given paths (relative to local_root), e.g. the ones the watcher saw change.
+        batches that come in while another sync runs are synced together once it is done
+        '''
+        with self._changed_paths_lock:
+            self._changed_paths.update(task.kwargs['paths'])
+
+        with self._syncing(task):
+            with self._changed_paths_lock:
+                paths = sorted(self._changed_paths)
+                self._changed_paths.clear()
+            if not paths:
+                # an earlier batch waiting on the same sync took them
+                task.set_progress("synced with the batch before it")
+                return
+            plan = self.build_sync_plan(paths)
+            self.execute_plan(plan)
+        self.refresh()
 
-                ignored_directories.extend(new_ignored_dicts)
-                ignored_dirs_stack.append(len(new_ignored_dicts))
+    def build_sync_plan(self, paths: list[str] = None) -> SyncPlan:
+        '''
+        decides what to upload without uploading anything.
+        paths: only plan these paths (relative to local_root) instead of everything
+        '''
+        config = get_config()
+        ledger = get_ledger()
+
+        gitignore_cache = get_gitignore_cache()
+        matcher = IgnoreMatcher(self.local_root, config.dbx_ignore, config.gitignore_overrides, gitignore_cache=gitignore_cache)
+        scanner = TreeScanner(self.local_root, matcher)
+        snapshot = ledger.get_snapshot()
+        plan = SyncPlan(SyncLedger.LOCAL, self.local_root)
+
+        if paths is None:
+            paths = ["/"]
+
+        outermost: list[str] = []
+        for relative_path in sorted(paths):
+            if outermost and (outermost[-1] == "/" or relative_path.startswith(outermost[-1] + "/")):
+                continue
+            outermost.append(relative_path)
 
-                for filename in filenames:
-                    # construct the full local path
-                    file_local_path = os.path.join(dirpath, filename)
-                    file_relative_path = "/" + os.path.relpath(file_local_path, self.local_root)
+        for relative_path in outermost:
+            if relative_path == "/":
+                for directory in scanner.scan():
+                    self._plan_directory(directory, ledger, snapshot, plan)
+                continue
 
-                    sync_file = True
+            local_path = os.path.join(self.local_root, relative_path[1:])
 
-                    if file_local_path in dbx_ignore:
-                        print(colorama.Fore.CYAN + "Ignoring file in DBX_IGNORE:", file_relative_path)
-                        sync_file = False
+            # deleted paths are picked up by clean_synced_paths on the next start
+            if not os.path.exists(local_path) or os.path.islink(local_path) and os.path.isdir(local_path):
+                continue
 
-                    if spec.match_file(filename) and file_local_path not in gitignore_overrides and not override_gitignore:
-                        print(colorama.Fore.CYAN + "Ignoring file in .gitignore:", file_relative_path)
-                        sync_file = False
+            context = matcher.context_for(os.path.dirname(local_path))
+            is_dir = os.path.isdir(local_path)
+            if context is None:
+                continue
+            reason = matcher.ignored(context, local_path, is_dir)
+            if reason:
+                plan.add(PlanItem(PlanAction.IGNORE, relative_path, 0, is_dir, reason=reason))
+                continue
 
-                    if sync_file:
-                        self._sync_file(file_local_path, file_relative_path, synced_paths, time_zone)
+            if is_dir:
+                for directory in scanner.scan(relative_path, context):
+                    self._plan_directory(directory, ledger, snapshot, plan)
             else:
-                applicable_gitignores = self._get_applicable_gitignores(dirpath, gitignore_stack)
-
-                for dirname in dirnames:
-                    dir_local_path = os.path.join(dirpath, dirname)
-                    for gitignore_match in applicable_gitignores:
-                        if gitignore_match.match_file(dir_local_path) and dir_local_path not in gitignore_overrides and not override_gitignore:
-                            ignored_directories.append(dir_local_path)
-                            print(colorama.Fore.CYAN + "Ignoring folder in .gitignore:", dir_local_path)
-
-                for filename in filenames:
-                    # construct the full local path
-                    file_local_path = os.path.join(dirpath, filename)
-                    file_relative_path = "/" + os.path.relpath(file_local_path, self.local_root)
-
-                    sync_file = True
-
-                    if file_local_path in dbx_ignore:
-                        print(colorama.Fore.CYAN + "Ignoring file in DBX_IGNORE:", file_relative_path)
-                        sync_file = False
-
-                    # Check if file is in a gitignore
-                    for gitignore_match in applicable_gitignores:
-                        if gitignore_match.match_file(file_local_path) and file_local_path not in gitignore_overrides and not override_gitignore:
-                            print(colorama.Fore.CYAN + "Ignoring file in .gitignore:", file_relative_path)
-                            sync_file = False
-                            break
-
-                    if sync_file:
-                        self._sync_file(file_local_path, file_relative_path, synced_paths, time_zone)
-
-            # Remove the top .gitignore file from the stack when leaving the directory
-            if gitignore_stack and not dirpath.startswith(os.path.dirname(gitignore_stack[-1][0])):
-                # print(colorama.Back.RED + dirpath + " " + gitignore_stack[-1][0])
-                gitignore_stack.pop()
-                ignored_directories = ignored_directories[:-ignored_dirs_stack.pop()]
-
-        # sort paths
-        synced_paths = {key:synced_paths[key] for key in sorted(synced_paths.keys())}
-        self._write_to_synced_paths(synced_paths)
+                stat = os.stat(local_path)
+                self._plan_file(ScanEntry(relative_path, stat.st_size, stat.st_mtime_ns, stat.st_ino), ledger, plan)
+
+        gitignore_cache.prune()
+        self._find_relocations(plan, ledger)
+        self._skip_unchanged_contents(plan, ledger)
+        return plan
+
+    def _plan_directory(self, directory: ScannedDirectory, ledger: SyncLedger, snapshot: dict[str, tuple[int, bytes]], plan: SyncPlan) -> None:
+        for ignored in directory.ignored:
+            kind = "folder" if ignored.is_dir else "file"
+            print(colorama.Fore.CYAN + f"Ignoring {kind} in {ignored.reason}:", ignored.relative_path)
+            plan.add(PlanItem(PlanAction.IGNORE, ignored.relative_path, 0, ignored.is_dir, reason=ignored.reason))
+
+        # nothing in the folder changed since every file in it was last synced
+        digest = directory.digest()
+        if snapshot.get(directory.relative_path) == (directory.mtime_ns, digest):
+            for entry in directory.files:
+                plan.add(PlanItem(PlanAction.SKIP, entry.relative_path, entry.size, mtime_ns=entry.mtime_ns, reason="folder unchanged"))
+            return
+
+        for entry in directory.files:
+            self._plan_file(entry, ledger, plan)
+        plan.folders[directory.relative_path] = (directory.mtime_ns, digest)
+
+    def _plan_file(self, entry: ScanEntry, ledger: SyncLedger, plan: SyncPlan) -> None:
+        synced_ns = ledger.get(SyncLedger.LOCAL, entry.relative_path)
+
+        if synced_ns is None:
+            reason = "never synced"
+        elif synced_ns < entry.mtime_ns:
+            reason = "modified since last sync"
+        else:
+            plan.add(PlanItem(PlanAction.SKIP, entry.relative_path, entry.size, mtime_ns=entry.mtime_ns, reason="already synced", inode=entry.inode))
+            return
+
+        requests = self.dbx_model.estimate_upload_requests(entry.size)
+        plan.add(PlanItem(PlanAction.UPLOAD, entry.relative_path, entry.size, mtime_ns=entry.mtime_ns, requests=requests, reason=reason, inode=entry.inode))
+
+    def _find_relocations(self, plan: SyncPlan, ledger: SyncLedger) -> None:
+        '''
+        new files that are really a synced file under another path are moved
+        in the cloud, or copied if the synced file is still there, instead of
+        being uploaded. a file is recognised by its inode if it wasn't modified,
+        otherwise by its content hash
+        '''
+        new_items = {
+            index: item for index, item in enumerate(plan.items)
+            if item.action == PlanAction.UPLOAD and item.reason == "never synced"
+        }
+        if not new_items:
+            return
+
+        # a synced file is only moved once, other copies of it are made from where it was moved to
+        moved: dict[str, str] = {}
+
+        def relocate(index: int, candidates: dict[str, LedgerEntry], reason: str, content_hash: str = None) -> bool:
+            item = plan.items[index]
+            for from_path, entry in sorted(candidates.items()):
+                if from_path == item.path:
+                    continue
+                if from_path in moved:
+                    # moves are carried out before copies
+                    action, from_path = PlanAction.COPY, moved[from_path]
+                else:
+                    try:
+                        from_inode = os.stat(os.path.join(self.local_root, from_path[1:])).st_ino
+                    except FileNotFoundError:
+                        from_inode = None
+                    # gone, or something else took its place
+                    if from_inode is None or entry.inode is not None and from_inode != entry.inode:
+                        moved[from_path] = item.path
+                        action = PlanAction.MOVE
+                    else:
+                        action = PlanAction.COPY
+                plan.items[index] = item._replace(action=action, requests=1, reason=reason, from_path=from_path, content_hash=content_hash or entry.content_hash)
+                return True
+            return False
+
+        to_hash: dict[str, os.stat_result] = {}
+        hashed_sizes = ledger.hashed_sizes(SyncLedger.LOCAL)
+        for index, item in new_items.items():
+            candidates = {
+                path: entry for path, entry in ledger.find_by_inode(SyncLedger.LOCAL, item.inode).items()
+                if (entry.mtime_ns, entry.size) == (item.mtime_ns, item.size)
+            }
+            if relocate(index, candidates, "same inode as a synced file"):
+                continue
+            # only worth hashing if some synced file has the same size
+            if item.size in hashed_sizes:
+                local_path = os.path.join(self.local_root, item.path[1:])
+                try:
+                    to_hash[local_path] = os.stat(local_path)
+                except OSError:
+                    continue
+
+        if not to_hash:
+            return
+
+        print(colorama.Fore.BLUE + f"Hashing {len(to_hash)} new files")
+        hashes = get_hash_cache().hash_files(to_hash)
+
+        for index, item in new_items.items():
+            content_hash = hashes.get(os.path.join(self.local_root, item.path[1:]))
+            if content_hash is None or plan.items[index].action != PlanAction.UPLOAD:
+                continue
+            if not relocate(index, ledger.find_by_content_hash(SyncLedger.LOCAL, content_hash), "same contents as a synced file", content_hash):
+                plan.items[index] = item._replace(content_hash=content_hash)
+
+    def _skip_unchanged_contents(self, plan: SyncPlan, ledger: SyncLedger) -> None:
+        '''
+        files that were modified since they were synced are hashed, all of them
+        at once, and the ones whose content hash is still the one in the ledger
+        (e.g. touched, or saved without changes) are only marked as synced
+        '''
+        synced_hashes: dict[int, str] = {}
+        files: dict[str, os.stat_result] = {}
+        for index, item in enumerate(plan.items):
+            if item.action != PlanAction.UPLOAD:
+                continue
+            entry = ledger.get_entry(SyncLedger.LOCAL, item.path)
+            if entry is None or entry.content_hash is None:
+                continue
+            local_path = os.path.join(self.local_root, item.path[1:])
+            try:
+                stat = os.stat(local_path)
+            except OSError:
+                continue
+            # changed again since it was scanned, the upload will sort it out
+            if stat.st_mtime_ns != item.mtime_ns:
+                continue
+            synced_hashes[index] = entry.content_hash
+            files[local_path] = stat
+
+        if not files:
+            return
+
+        print(colorama.Fore.BLUE + f"Hashing {len(files)} modified files")
+        hashes = get_hash_cache().hash_files(files)
+
+        for index, synced_hash in synced_hashes.items():
+            item = plan.items[index]
+            content_hash = hashes.get(os.path.join(self.local_root, item.path[1:]))
+            if content_hash == synced_hash:
+                plan.items[index] = item._replace(action=PlanAction.MARK_SYNCED, requests=0, reason="contents unchanged", content_hash=content_hash)
+            elif content_hash is not None:
+                plan.items[index] = item._replace(content_hash=content_hash)
+
+    def execute_plan(self, plan: SyncPlan) -> None:
+        ledger = get_ledger()
+        ledger_writer = get_ledger_writer()
+        failed_folders = set()
+
+        # before the uploads, which may replace what is moved or copied.
+        # anything that couldn't be is uploaded instead
+        uploads = plan.of(PlanAction.UPLOAD)
+        for action in (PlanAction.MOVE, PlanAction.COPY):
+            items = plan.of(action)
+            if not items:
+                continue
+            results = self.dbx_model.relocate_files([(item.from_path, item.path) for item in items], action == PlanAction.MOVE)
+            for item, metadata in zip(items, results):
+                if metadata is None:
+                    uploads.append(item)
+                    continue
+                entry = LedgerEntry(item.mtime_ns, metadata.content_hash, item.inode, item.size)
+                if action == PlanAction.MOVE:
+                    ledger_writer.move(SyncLedger.LOCAL, item.from_path, item.path, entry)
+                    cloud_entry = ledger.get_entry(SyncLedger.CLOUD, item.from_path)
+                    if cloud_entry is not None:
+                        ledger_writer.move(SyncLedger.CLOUD, item.from_path, item.path, cloud_entry)
+                else:
+                    ledger_writer.set(SyncLedger.LOCAL, item.path, *entry)
+
+        jobs = (
+            UploadJob(os.path.join(self.local_root, item.path[1:]), item.path, item)
+            for item in uploads
+        )
+        for result in self.dbx_model.upload_files(jobs):
+            item: PlanItem = result.job.tag
+            if result.success:
+                ledger_writer.set(SyncLedger.LOCAL, item.path, item.mtime_ns, result.value.content_hash, item.inode, item.size)
+            else:
+                failed_folders.add(os.path.dirname(item.path))
 
-        self.refresh()
+        for item in plan.of(PlanAction.MARK_SYNCED):
+            ledger_writer.set(SyncLedger.LOCAL, item.path, item.mtime_ns, item.content_hash, item.inode, item.size)
 
-    def _sync_file(self, file_local_path: str, file_relative_path: str, synced_paths: dict[str, str], time_zone: str):
-        modified_timestamp = os.path.getmtime(file_local_path)
-        # Convert the timestamp to a datetime object
-        modified_dt = datetime.datetime.fromtimestamp(modified_timestamp)
-        modified_dt = modified_dt.replace(microsecond=0)
-        tz = pytz.timezone(time_zone)
-        modified_dt = tz.localize(modified_dt)
-        # Format the datetime object as a string
-        modified_formatted = modified_dt.strftime(TIMESTAMP_FORMAT)
-
-
-        if file_relative_path in synced_paths:
-            modified_synced = datetime.datetime.strptime(synced_paths[file_relative_path], TIMESTAMP_FORMAT)
-            if modified_synced < modified_dt:
-                success = self.dbx_model.api_upload_file(file_local_path, file_relative_path)
-                if success:
-                    synced_paths[file_relative_path] = modified_formatted
-                    self._write_to_synced_paths(synced_paths)
-            else:
-                pass
-                # print(colorama.Fore.GREEN + "Didn't need to sync: ", file_relative_path, modified_formatted)
-        else:
-            success = self.dbx_model.api_upload_file(file_local_path, file_relative_path)
-            if success:
-                synced_paths[file_relative_path] = modified_formatted
-                self._write_to_synced_paths(synced_paths)
-
-    @staticmethod
-    def _write_to_synced_paths(synced_paths: dict):
-        with open(Path(Path(__file__).parents[2], 'config.json'), 'r+') as json_file:
-            json_data = json.load(json_file)
-            json_data['TIME_LAST_SYNCED_FROM_LOCAL'] = synced_paths
-
-            json_file.seek(0)
-            json.dump(json_data, json_file, indent=4)
-            json_file.truncate()
\ No newline at end of file
+        for folder, (mtime_ns, digest) in plan.folders.items():
+            if folder not in failed_folders:
+                ledger_writer.set_snapshot(folder, mtime_ns, digest)
@@ -0,0 +1,49 @@
+"""
+How far along a transfer is, for showing on its task
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Callable
+from datetime import timedelta
+
+from package.utils import BYTES_PER_MEGABYTE
+
+
+class TransferProgress:
+    '''
+    Counts the bytes transferred out of total, from any number of threads,
+    and reports them with the throughput and the time left to on_update,
+    at most every UPDATE_INTERVAL seconds.
+    '''
+
+    UPDATE_INTERVAL = 1.0 # in seconds
+
+    def __init__(self, total: int, on_update: Callable[[str], None]) -> None:
+        self.total = total
+        self.done = 0
+        self.on_update = on_update
+        self._started = time.monotonic()
+        self._reported = 0.0
+        self._lock = threading.Lock()
+
+    def advance(self, amount: int) -> None:
+        with self._lock:
+            self.done += amount
+            now = time.monotonic()
+            if now - self._reported < self.UPDATE_INTERVAL and self.done < self.total:
+                return
+            self._reported = now
+            message = str(self)
+        self.on_update(message)
+
+    def __str__(self) -> str:
+        elapsed = time.monotonic() - self._started
+        throughput = self.done / elapsed if elapsed > 0 else 0
+        percentage = int(self.done / self.total * 100) if self.total else 100
+        message = f"{self.done / BYTES_PER_MEGABYTE:.2f}/{self.total / BYTES_PER_MEGABYTE:.2f} MB ({percentage}%), {throughput / BYTES_PER_MEGABYTE:.2f} MB/s"
+        if throughput and self.done < self.total:
+            message += f", {timedelta(seconds=int((self.total - self.done) / throughput))} left"
+        return message
@@ -0,0 +1,179 @@
+"""
+One set of limits and one retry policy for every call made to the Dropbox API
+"""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+from collections.abc import Callable, Iterator
+
+import colorama
+import requests
+from dropbox import Dropbox
+from dropbox.dropbox_client import RouteResult
+from dropbox.exceptions import AuthError, InternalServerError, RateLimitError
+
+
+class TokenBucket:
+    '''
+    rate tokens are added every second, up to capacity (a second's worth by
+    default), and acquire blocks until there are enough of them. Asking for
+    more than capacity at once waits for a full bucket and leaves it in
+    debt, so large requests still average out to rate.
+
+    A rate of 0 means no limit, although pause still applies.
+    '''
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if not self.rate:
+                        return
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    needed = min(amount, self.capacity)
+                    if self._tokens >= needed:
+                        self._tokens -= amount
+                        return
+                    wait = (needed - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        '''
+        nothing gets through for the next seconds
+        '''
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class ServiceUnavailableError(InternalServerError):
+    '''
+    a 503 that came with a Retry-After header
+    '''
+
+    def __init__(self, request_id, status_code, body, backoff: float) -> None:
+        super().__init__(request_id, status_code, body)
+        self.backoff = backoff
+
+
+class ThrottledDropbox(Dropbox):
+    '''
+    The Dropbox client shared by everything. Every call waits its turn
+    on the same limits:
+        requests: API calls per second
+        upload_bandwidth / download_bandwidth: bytes per second of file contents
+
+    The SDK's own retries are turned off and done here instead:
+        - a rate limit (429) pauses every call, not just the one that hit it,
+          for as long as Dropbox's Retry-After says and is always retried
+        - a 5xx (a 503's Retry-After is honoured), a dropped connection or a
+          timeout is retried with jittered exponential backoff, up to MAX_ATTEMPTS
+
+    A dropped connection or a timeout may come after Dropbox already did what
+    was asked, so those are only retried for IDEMPOTENT_ROUTES, or if the
+    connection was never made. Anything else (a copy, a delete, a batch
+    launch, a commit) raises so the caller can check what actually happened.
+    '''
+
+    MAX_ATTEMPTS = 8
+    BASE_DELAY = 1.0 # in seconds
+    MAX_DELAY = 60.0
+    DEFAULT_RATE_LIMIT_DELAY = 5.0
+    IDEMPOTENT_ROUTES = frozenset({
+        "users/get_current_account",
+        "files/get_metadata",
+        "files/download",
+        "files/list_folder",
+        "files/list_folder/continue",
+        # at the same offset again, Dropbox answers incorrect_offset if the first one got through
+        "files/upload_session/append_v2",
+        # a session that ends up unused just expires
+        "files/upload_session/start",
+        "files/move_batch/check_v2",
+        "files/copy_batch/check_v2",
+    })
+
+    def __init__(self, *args, requests_per_second: float = 0, upload_bytes_per_second: float = 0, download_bytes_per_second: float = 0, **kwargs) -> None:
+        kwargs['max_retries_on_error'] = 0
+        kwargs['max_retries_on_rate_limit'] = 0
+        super().__init__(*args, **kwargs)
+        self.requests = TokenBucket(requests_per_second)
+        self.upload_bandwidth = TokenBucket(upload_bytes_per_second)
+        self.download_bandwidth = TokenBucket(download_bytes_per_second)
+
+    def request_json_string_with_retry(self, host, route_name, route_style, request_json_arg, auth_type, request_binary, timeout=None):
+        attempt = 0
+        has_refreshed = False
+
+        while True:
+            self.requests.acquire()
+            if request_binary:
+                self.upload_bandwidth.acquire(len(request_binary))
+
+            try:
+                result = self.request_json_string(host, route_name, route_style, request_json_arg, auth_type, request_binary, timeout=timeout)
+            except AuthError as e:
+                if e.error and e.error.is_expired_access_token() and not has_refreshed:
+                    self.refresh_access_token()
+                    has_refreshed = True
+                    continue
+                raise
+            except RateLimitError as e:
+                error = e
+                delay = e.backoff if e.backoff is not None else self.DEFAULT_RATE_LIMIT_DELAY
+                self.requests.pause(delay)
+            except (InternalServerError, requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                attempt += 1
+                if attempt >= self.MAX_ATTEMPTS or not self._retryable(route_name, e):
+                    raise
+                delay = getattr(e, "backoff", None) or self._backoff(attempt)
+            else:
+                if isinstance(result, RouteResult) and result.http_resp is not None and self.download_bandwidth.rate:
+                    result.http_resp.iter_content = self._throttled(result.http_resp.iter_content, self.download_bandwidth)
+                return result
+
+            print(colorama.Fore.YELLOW + f"Retrying {route_name} in {delay:.1f}s ({error!r})")
+            time.sleep(delay)
+
+    def raise_dropbox_error_for_resp(self, res):
+        retry_after = res.headers.get('Retry-After')
+        if res.status_code == 503 and retry_after:
+            try:
+                backoff = float(retry_after)
+            except ValueError:
+                backoff = None
+            if backoff is not None:
+                raise ServiceUnavailableError(res.headers.get('x-dropbox-request-id'), res.status_code, res.text, backoff)
+        super().raise_dropbox_error_for_resp(res)
+
+    def _retryable(self, route_name: str, error: Exception) -> bool:
+        if isinstance(error, InternalServerError) or isinstance(error, requests.ConnectTimeout):
+            return True
+        return route_name in self.IDEMPOTENT_ROUTES
+
+    def _backoff(self, attempt: int) -> float:
+        # half of it fixed, half of it random so retries from several threads spread out
+        delay = min(self.MAX_DELAY, self.BASE_DELAY * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    @staticmethod
+    def _throttled(iter_content: Callable[..., Iterator[bytes]], bucket: TokenBucket) -> Callable[..., Iterator[bytes]]:
+        def throttled(*args, **kwargs) -> Iterator[bytes]:
+            for chunk in iter_content(*args, **kwargs):
+                bucket.acquire(len(chunk))
+                yield chunk
+        return throttled
@@ -0,0 +1,175 @@
+"""
+Walks the local Dropbox folder with os.scandir on a pool of threads
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import queue
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import colorama
+
+
+class ScanEntry(NamedTuple):
+    relative_path: str # relative to the scanned root, starting with "/"
+    size: int
+    mtime_ns: int
+    inode: int
+
+
+class IgnoredEntry(NamedTuple):
+    relative_path: str
+    is_dir: bool
+    reason: str
+
+
+class ScannedDirectory(NamedTuple):
+    relative_path: str # "/" for the scanned root
+    mtime_ns: int
+    files: list[ScanEntry]
+    ignored: list[IgnoredEntry]
+
+    def digest(self) -> bytes:
+        '''
+        changes whenever a file in this folder (not counting subfolders
+        or ignored files) is added, removed, resized or modified
+        '''
+        digest = hashlib.sha1()
+        for entry in sorted(self.files):
+            digest.update(f"{os.path.basename(entry.relative_path)}\0{entry.size}\0{entry.mtime_ns}\n".encode("utf-8", "surrogateescape"))
+        return digest.digest()
+
+
+class TreeScanner:
+    '''
+    Scans one directory per task on a thread pool, reusing the stat results
+    from os.scandir. Each directory is yielded as soon as it has been scanned,
+    so directories come out in no particular order, although a directory is
+    always entered before anything inside of it.
+
+    rules (optional) decides what gets skipped, normally an IgnoreMatcher.
+    It needs two methods:
+        enter(context, dir_path, names) -> context
+            called for every directory that is scanned with the context of
+            its parent (None for the root) and the names inside of it
+        ignored(context, path, is_dir) -> str | None
+            the reason a path inside that directory is ignored, or None
+    '''
+
+    WORKERS = 8
+    MAX_QUEUED = 256 # scanned directories waiting to be consumed
+
+    _DONE = object()
+
+    def __init__(self, root: str, rules=None, workers: int = WORKERS) -> None:
+        self.root = root.rstrip("/") or "/"
+        self.rules = rules
+        self.workers = workers
+
+    def files(self, relative_dir: str = "", context=None) -> Iterator[ScanEntry]:
+        for directory in self.scan(relative_dir, context):
+            yield from directory.files
+
+    def scan(self, relative_dir: str = "", context=None) -> Iterator[ScannedDirectory]:
+        '''
+        relative_dir: only scan this folder (e.g. "/Photos") instead of the whole root
+        context: the rules' context for the folder containing relative_dir
+        '''
+        relative_dir = relative_dir.rstrip("/")
+        results = queue.Queue(self.MAX_QUEUED)
+        cancelled = threading.Event()
+        pending = 1
+        pending_lock = threading.Lock()
+
+        def put(item) -> None:
+            # a full queue holds the workers back until the consumer catches up
+            while not cancelled.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def visit(dir_path: str, relative_dir: str, context) -> None:
+            nonlocal pending
+            try:
+                if not cancelled.is_set():
+                    put(self._scan_directory(dir_path, relative_dir, context, schedule))
+            except Exception as e:
+                put(e)
+            finally:
+                with pending_lock:
+                    pending -= 1
+                    finished = pending == 0
+                if finished:
+                    put(self._DONE)
+
+        def schedule(dir_path: str, relative_dir: str, context) -> None:
+            nonlocal pending
+            with pending_lock:
+                pending += 1
+            executor.submit(visit, dir_path, relative_dir, context)
+
+        executor = ThreadPoolExecutor(self.workers, thread_name_prefix="TreeScanner")
+        executor.submit(visit, self.root + relative_dir, relative_dir, context)
+
+        try:
+            while True:
+                item = results.get()
+                if item is self._DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _scan_directory(self, dir_path: str, relative_dir: str, context, schedule) -> ScannedDirectory:
+        files: list[ScanEntry] = []
+        ignored: list[IgnoredEntry] = []
+
+        try:
+            with os.scandir(dir_path) as it:
+                entries = list(it)
+            dir_mtime_ns = os.stat(dir_path).st_mtime_ns
+        except OSError as e:
+            print(colorama.Fore.RED + f"Could not scan '{dir_path}' ({e})")
+            return ScannedDirectory(relative_dir or "/", 0, files, ignored)
+
+        if self.rules is not None:
+            context = self.rules.enter(context, dir_path, [entry.name for entry in entries])
+
+        for entry in entries:
+            relative_path = relative_dir + "/" + entry.name
+
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+
+            if self.rules is not None:
+                reason = self.rules.ignored(context, entry.path, is_dir)
+                if reason:
+                    ignored.append(IgnoredEntry(relative_path, is_dir, reason))
+                    continue
+
+            if is_dir:
+                # same as os.walk, symlinked folders are not followed
+                if not entry.is_symlink():
+                    schedule(entry.path, relative_path, context)
+                continue
+
+            try:
+                stat = entry.stat()
+            except OSError:
+                # broken symlink or removed since the directory was listed
+                continue
+            files.append(ScanEntry(relative_path, stat.st_size, stat.st_mtime_ns, stat.st_ino))
+
+        return ScannedDirectory(relative_dir or "/", dir_mtime_ns, files, ignored)
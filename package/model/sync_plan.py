@@ -0,0 +1,91 @@
+"""
+What a sync is going to do, worked out before anything is transferred
+"""
+
+from __future__ import annotations
+
+import json
+from enum import Enum
+from typing import NamedTuple
+
+
+class PlanAction(Enum):
+    UPLOAD = "upload"
+    MOVE = "move" # a synced file that was renamed, moved in the cloud instead of uploaded again
+    COPY = "copy" # a duplicate of a synced file, copied in the cloud
+    DOWNLOAD = "download"
+    DELETE = "delete" # deleted in the cloud, and unchanged locally since it was synced
+    SKIP = "skip"
+    MARK_SYNCED = "mark_synced" # modified but the contents are what was last synced
+    IGNORE = "ignore"
+
+
+class PlanItem(NamedTuple):
+    action: PlanAction
+    path: str # relative to the Dropbox root, starting with "/"
+    size: int # in bytes
+    is_dir: bool = False
+    mtime_ns: int = 0 # of the local copy when the plan was made
+    requests: int = 0 # estimated number of API calls
+    reason: str = ""
+    content_hash: str | None = None # of the local copy, if it was hashed
+    inode: int | None = None # of the local copy
+    from_path: str | None = None # what a MOVE or COPY is made from, relative to the Dropbox root
+
+
+class SyncPlan:
+    '''
+    Every decision a sync makes, in the order they will be carried out.
+
+    Executing the plan goes through these items instead of scanning again,
+    so a plan should be executed soon after it is made. Folders whose
+    files are all uploaded successfully are recorded in the ledger's
+    snapshot with the (mtime_ns, digest) in folders. A cloud sync keeps
+    the list_folder cursor it got in cursor, to be saved once every change
+    up to it has been applied. Changes it leaves alone until the local copy,
+    which changed since it was synced, has been uploaded go in deferred, and
+    keep the cursor from being saved so they are listed again.
+    '''
+
+    def __init__(self, source: str, root: str) -> None:
+        self.source = source # SyncLedger.LOCAL or SyncLedger.CLOUD, the side being synced from
+        self.root = root # the local folder or Dropbox path that was planned
+        self.items: list[PlanItem] = []
+        self.folders: dict[str, tuple[int, bytes]] = {}
+        self.cursor: str | None = None
+        self.deferred: list[str] = []
+
+    def add(self, item: PlanItem) -> None:
+        self.items.append(item)
+
+    def of(self, action: PlanAction) -> list[PlanItem]:
+        return [item for item in self.items if item.action == action]
+
+    @property
+    def upload_bytes(self) -> int:
+        return sum(item.size for item in self.items if item.action == PlanAction.UPLOAD)
+
+    @property
+    def download_bytes(self) -> int:
+        return sum(item.size for item in self.items if item.action == PlanAction.DOWNLOAD)
+
+    @property
+    def requests(self) -> int:
+        return sum(item.requests for item in self.items)
+
+    def summary(self) -> dict:
+        return {
+            "source": self.source,
+            "root": self.root,
+            **{action.value: len(self.of(action)) for action in PlanAction},
+            "upload_bytes": self.upload_bytes,
+            "download_bytes": self.download_bytes,
+            "requests": self.requests
+        }
+
+    def to_json(self) -> str:
+        items = [
+            {**item._asdict(), "action": item.action.value}
+            for item in self.items
+        ]
+        return json.dumps({"summary": self.summary(), "items": items}, indent=4)
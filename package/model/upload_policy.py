@@ -0,0 +1,86 @@
+"""
+How files are split up into requests when uploading
+"""
+
+from __future__ import annotations
+
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+MEBIBYTE = 1024 ** 2
+
+
+class UploadPolicy:
+    '''
+    A file up to chunk_size bytes is uploaded in one request, anything
+    bigger goes through an upload session one chunk at a time, so at most
+    chunk_size bytes of a file are in memory at once.
+
+    chunk_size has to be a multiple of BLOCK_SIZE (Dropbox hashes files in
+    4 MiB blocks and concurrent upload sessions need chunks lined up with
+    them) and no bigger than MAX_REQUEST_SIZE.
+    '''
+
+    BLOCK_SIZE = 4 * MEBIBYTE
+    MAX_REQUEST_SIZE = 148 * MEBIBYTE # largest multiple of BLOCK_SIZE under the 150 MiB request limit
+    DEFAULT_CHUNK_SIZE = 32 * MEBIBYTE
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        if chunk_size % self.BLOCK_SIZE or not self.BLOCK_SIZE <= chunk_size <= self.MAX_REQUEST_SIZE:
+            raise ValueError(f"chunk size has to be a multiple of 4 MiB up to {self.MAX_REQUEST_SIZE // MEBIBYTE} MiB, got {chunk_size} bytes")
+        self.chunk_size = chunk_size
+
+    def single_request(self, size: int) -> bool:
+        return size <= self.chunk_size
+
+    def chunks(self, size: int) -> list[tuple[int, int]]:
+        '''
+        (offset, length) of each chunk of a file that is size bytes long
+        '''
+        return [(offset, min(self.chunk_size, size - offset)) for offset in range(0, size, self.chunk_size)]
+
+    def requests(self, size: int) -> int:
+        '''
+        the first chunk starts the session and the last one finishes it
+        '''
+        return 1 if self.single_request(size) else len(self.chunks(size))
+
+    @staticmethod
+    def read_chunk(local_path: str, offset: int, length: int) -> bytes:
+        '''
+        the SDK only takes bytes for request bodies, so the chunk is read straight into one
+        '''
+        with open(local_path, 'rb') as file:
+            file.seek(offset)
+            data = file.read(length)
+        if len(data) != length:
+            raise OSError(f"'{local_path}' changed size while it was being uploaded")
+        return data
+
+
+class MemoryBudget:
+    '''
+    The bytes of file contents held in memory by every upload at once, so
+    UPLOAD_WORKERS files each with CHUNK_UPLOAD_WORKERS chunks in flight
+    can't add up to more than capacity. reserve blocks until there is room;
+    asking for more than capacity waits until nothing else is held.
+    '''
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._used = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, amount: int) -> Iterator[None]:
+        amount = min(amount, self.capacity)
+        with self._condition:
+            self._condition.wait_for(lambda: self._used + amount <= self.capacity)
+            self._used += amount
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._used -= amount
+                self._condition.notify_all()
@@ -0,0 +1,73 @@
+"""
+Uploads several files at once instead of one after the other
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, NamedTuple
+
+import colorama
+
+
+class UploadJob(NamedTuple):
+    local_path: str
+    dbx_path: str
+    tag: Any = None # handed back untouched in the result, e.g. the PlanItem
+
+
+class UploadResult(NamedTuple):
+    job: UploadJob
+    success: bool
+    error: Exception | None = None
+    value: Any = None # whatever upload returned
+
+
+class UploadPool:
+    '''
+    Runs upload(local_path, dbx_path) for each job on a pool of threads and
+    yields the results in the same order as the jobs. The upload succeeded
+    if it returned something truthy.
+
+    Only MAX_PENDING_PER_WORKER jobs per worker are taken from the iterable
+    ahead of the results being consumed, so a slow upload holds back
+    whatever is producing the jobs (e.g. os.walk) instead of everything
+    piling up in memory.
+
+    An upload that raises is reported as a failed result and the rest carry on.
+    '''
+
+    MAX_PENDING_PER_WORKER = 2
+
+    def __init__(self, upload: Callable[[str, str], Any], workers: int) -> None:
+        self.upload = upload
+        self.workers = workers
+
+    def run(self, jobs: Iterable[UploadJob]) -> Iterator[UploadResult]:
+        max_pending = self.workers * self.MAX_PENDING_PER_WORKER
+        pending: deque[tuple[UploadJob, Future]] = deque()
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="UploadPool") as executor:
+            try:
+                for job in jobs:
+                    if len(pending) >= max_pending:
+                        yield self._result(*pending.popleft())
+                    pending.append((job, executor.submit(self.upload, job.local_path, job.dbx_path)))
+
+                while pending:
+                    yield self._result(*pending.popleft())
+            finally:
+                # stopped early, don't start anything that hasn't been started
+                for _, future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def _result(job: UploadJob, future: Future) -> UploadResult:
+        try:
+            value = future.result()
+            return UploadResult(job, bool(value), value=value)
+        except Exception as e:
+            print(colorama.Fore.RED + f"Failed to upload '{job.local_path}' ({e})")
+            return UploadResult(job, False, e)
@@ -0,0 +1,236 @@
+"""
+Watches the local Dropbox folder for changes so only those paths need syncing.
+Uses inotify on Linux and falls back to polling everywhere else
+(or when inotify runs out of watches)
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import platform
+import select
+import struct
+import threading
+import time
+from collections.abc import Callable
+
+import colorama
+
+from package.model.ignore import GITIGNORE
+from package.model.scanner import TreeScanner
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONTFOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR | IN_DONTFOLLOW)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class _Inotify:
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: str) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def read_events(self) -> list[tuple[int, int, str]]:
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class LocalWatcher:
+    '''
+    Collects the paths that change under root (relative to it, starting with
+    "/") and hands them to on_changes in one go once things have been quiet
+    for QUIET_PERIOD seconds, or at most MAX_DELAY seconds after the first change.
+
+    make_rules returns the IgnoreMatcher that keeps ignored folders from
+    being watched or polled. It is called again every so often and should
+    return a new one once the ignore settings change. A changed .gitignore
+    invalidates what the matcher knows about its folder, and the whole
+    folder is handed on, since what it no longer ignores has to be synced.
+
+    skip(path) tells it to leave a changed path (absolute) alone, e.g. a download
+    whose ledger entry isn't committed yet.
+    '''
+
+    QUIET_PERIOD = 2.0 # in seconds
+    MAX_DELAY = 30.0
+    POLL_INTERVAL = 60.0
+
+    def __init__(self, root: str, on_changes: Callable[[list[str]], None], make_rules: Callable[[], object] = None, skip: Callable[[str], bool] = None) -> None:
+        self.root = root.rstrip("/") or "/"
+        self.on_changes = on_changes
+        self.make_rules = make_rules
+        self.skip = skip
+        self.rules = make_rules() if make_rules is not None else None
+
+        self._dirty: set[str] = set()
+        self._first_change: float = None
+        self._last_change: float = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="LocalWatcher", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self) -> None:
+        if platform.system() == "Linux":
+            try:
+                self._watch_inotify()
+                return
+            except OSError as e:
+                print(colorama.Fore.YELLOW + f"inotify unavailable ({e}), polling for local changes instead")
+        self._watch_polling()
+
+    def _mark_dirty(self, relative_path: str) -> None:
+        if self.skip is not None and relative_path != "/" and self.skip(self.root + relative_path):
+            return
+        now = time.monotonic()
+        if not self._dirty:
+            self._first_change = now
+        self._last_change = now
+        self._dirty.add(relative_path)
+
+    def _emit_if_settled(self) -> None:
+        if not self._dirty:
+            return
+        now = time.monotonic()
+        if now - self._last_change >= self.QUIET_PERIOD or now - self._first_change >= self.MAX_DELAY:
+            paths = sorted(self._dirty)
+            self._dirty = set()
+            self.on_changes(paths)
+
+    def _rules_changed(self) -> bool:
+        if self.make_rules is None:
+            return False
+        rules = self.make_rules()
+        if rules is self.rules:
+            return False
+        self.rules = rules
+        return True
+
+    def _relative(self, path: str) -> str:
+        return "/" + os.path.relpath(path, self.root) if path != self.root else "/"
+
+    def _scan_directories(self, relative_dir: str = "") -> list[str]:
+        context = None
+        if relative_dir and self.rules is not None:
+            context = self.rules.context_for(os.path.dirname(self.root + relative_dir))
+            if context is None:
+                return []
+        scanner = TreeScanner(self.root, self.rules)
+        return [directory.relative_path for directory in scanner.scan(relative_dir, context)]
+
+    def _watch_inotify(self) -> None:
+        inotify = _Inotify()
+        watches: dict[int, str] = {}
+
+        def add_watches(relative_dir: str = "") -> None:
+            for directory in self._scan_directories(relative_dir):
+                path = self.root if directory == "/" else self.root + directory
+                try:
+                    watches[inotify.add_watch(path)] = path
+                except FileNotFoundError:
+                    pass
+
+        try:
+            add_watches()
+            print(colorama.Fore.CYAN + f"Watching {len(watches)} folders for local changes")
+
+            while not self._stop.is_set():
+                readable, _, _ = select.select([inotify.fd], [], [], 0.5)
+                if readable:
+                    for wd, mask, name in inotify.read_events():
+                        if mask & IN_Q_OVERFLOW:
+                            # events were lost, everything has to be checked
+                            self._mark_dirty("/")
+                            continue
+                        if mask & IN_IGNORED:
+                            watches.pop(wd, None)
+                            continue
+
+                        dir_path = watches.get(wd)
+                        if dir_path is None or not name:
+                            continue
+                        relative_path = self._relative(os.path.join(dir_path, name))
+
+                        if name == GITIGNORE and self.rules is not None:
+                            # what it ignored may have to be watched, and synced, now
+                            self.rules.invalidate(dir_path)
+                            add_watches("" if dir_path == self.root else self._relative(dir_path))
+                            self._mark_dirty(self._relative(dir_path))
+                        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                            add_watches(relative_path)
+                        self._mark_dirty(relative_path)
+
+                if self._rules_changed():
+                    add_watches()
+
+                self._emit_if_settled()
+        finally:
+            inotify.close()
+
+    def _watch_polling(self) -> None:
+        def snapshot() -> dict[str, tuple[int, int]]:
+            scanner = TreeScanner(self.root, self.rules)
+            return {entry.relative_path: (entry.size, entry.mtime_ns) for entry in scanner.files()}
+
+        previous = snapshot()
+        next_poll = time.monotonic() + self.POLL_INTERVAL
+
+        while not self._stop.wait(0.5):
+            self._rules_changed()
+            if time.monotonic() >= next_poll:
+                current = snapshot()
+                for path, stat in current.items():
+                    if previous.get(path) != stat:
+                        if os.path.basename(path) == GITIGNORE and self.rules is not None:
+                            self.rules.invalidate(os.path.dirname(self.root + path))
+                            self._mark_dirty(os.path.dirname(path))
+                        self._mark_dirty(path)
+                previous = current
+                next_poll = time.monotonic() + self.POLL_INTERVAL
+
+            self._emit_if_settled()
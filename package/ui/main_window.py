@@ -2,7 +2,7 @@ from os.path import dirname, join, realpath
 from sys import argv
 
 from PyQt5.QtCore import pyqtSlot
-from PyQt5.QtGui import QIcon, QKeySequence
+from PyQt5.QtGui import QCloseEvent, QIcon, QKeySequence
 from PyQt5.QtWidgets import QGridLayout, QMainWindow, QShortcut, QWidget
 
 from package.model.dbx_model import DropboxModel
@@ -56,6 +56,8 @@ class MainWindow(QMainWindow):
         central_layout.setSpacing(0)
         self.local_explorer.left_clicked.connect(self.explorer_focus)
 
+        self.local_model.start_watching()
+
         self.dbx_tasks_status.set_explorer(self.dbx_explorer)
         self.local_tasks_status.set_explorer(self.local_explorer)
 
@@ -74,6 +76,18 @@ class MainWindow(QMainWindow):
         deselect_all = QShortcut(QKeySequence("Ctrl+D"), self)
         deselect_all.activated.connect(lambda: self.focused_explorer.item_list.deselect_all())
 
+    def closeEvent(self, event: QCloseEvent) -> None:
+        self.local_model.stop_watching()
+        super().closeEvent(event)
+
+    def shutdown(self) -> None:
+        '''
+        stops everything that could still write to the ledger, so it can be closed
+        '''
+        self.local_model.stop_watching()
+        self.dbx_model.wait_for_tasks()
+        self.local_model.wait_for_tasks()
+
     @pyqtSlot(QWidget)
     def explorer_focus(self, widget: QWidget):
         self.focused_explorer = widget
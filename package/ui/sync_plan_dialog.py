@@ -0,0 +1,73 @@
+from pathlib import Path
+
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtWidgets import (QDialog, QFileDialog, QHBoxLayout, QLabel,
+                             QPushButton, QTextEdit, QVBoxLayout)
+
+from package.model.sync_plan import PlanAction, SyncPlan
+from package.utils import BYTES_PER_MEGABYTE
+
+
+class SyncPlanDialog(QDialog):
+
+    sync_requested = pyqtSignal()
+
+    def __init__(self, plan: SyncPlan):
+        super().__init__()
+
+        self.plan = plan
+
+        self.setWindowTitle("Sync Preview")
+
+        summary = plan.summary()
+        summary_label = QLabel(
+            f"Sync of \"{plan.root}\"\n"
+            f"Upload: {summary['upload']} files ({plan.upload_bytes / BYTES_PER_MEGABYTE:.2f} MB)\n"
+            f"Move: {summary['move']}    Copy: {summary['copy']} (in the cloud, nothing uploaded)\n"
+            f"Download: {summary['download']} items ({plan.download_bytes / BYTES_PER_MEGABYTE:.2f} MB)    Delete: {summary['delete']}\n"
+            f"Skip: {summary['skip']}    Unchanged contents: {summary['mark_synced']}    Ignore: {summary['ignore']}\n"
+            f"Estimated requests: {plan.requests}"
+        )
+
+        # Everything that will be transferred first, then what won't be
+        multiline_text = QTextEdit()
+        multiline_text.setReadOnly(True)
+        lines = []
+        for action in PlanAction:
+            for item in plan.of(action):
+                source = f"{item.from_path} -> " if item.from_path else ""
+                lines.append(f"[{action.value}] {source}{item.path}" + (f" ({item.reason})" if item.reason else ""))
+        multiline_text.setText("\n".join(lines))
+
+        close_button = QPushButton('Close')
+        export_button = QPushButton('Export JSON')
+        sync_button = QPushButton('Sync')
+        sync_button.setEnabled(any(item.action not in (PlanAction.SKIP, PlanAction.IGNORE) for item in plan.items))
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(close_button)
+        button_layout.addWidget(export_button)
+        button_layout.addWidget(sync_button)
+
+        layout = QVBoxLayout()
+        layout.addWidget(summary_label)
+        layout.addWidget(multiline_text)
+        layout.addLayout(button_layout)
+
+        self.setLayout(layout)
+
+        close_button.clicked.connect(self.close)
+        export_button.clicked.connect(self.export_json)
+        sync_button.clicked.connect(self.sync)
+
+        self.setMinimumWidth(1000)
+
+    def export_json(self):
+        path = QFileDialog.getSaveFileName(self, "Export Sync Plan", str(Path.home() / "sync_plan.json"))[0]
+        if path:
+            with open(path, 'w') as file:
+                file.write(self.plan.to_json())
+
+    def sync(self):
+        self.sync_requested.emit()
+        self.close()
@@ -3,6 +3,8 @@ from PyQt5.QtGui import QMouseEvent
 from PyQt5.QtWidgets import QApplication, QSplitter, QWidget
 
 from package.model.interface_model import ExplorerTask, InterfaceModel
+from package.model.sync_plan import SyncPlan
+from package.ui.sync_plan_dialog import SyncPlanDialog
 from package.ui.widgets.explorers.base.directory_panel import DirectoryPanel
 from package.ui.widgets.explorers.base.item_list import ItemList
 from package.ui.widgets.task_status import TaskStatusPopup
@@ -29,6 +31,8 @@ class Explorer(QSplitter):
         self.directory_panel : DirectoryPanel
         self.item_list : ItemList
 
+        self.model.plan_ready.connect(self.show_sync_plan)
+
     def change_explorer_directory(self, path):
         QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
         
@@ -55,4 +59,10 @@ class Explorer(QSplitter):
         model_task.task_update.connect(lambda : ui_task.receive_task_update(model_task))
         model_task.task_update.connect(lambda : self.task_status_changed.emit(self, model_task))
         thread = self.model.perform_task(model_task)
-        thread.start()
\ No newline at end of file
+        thread.start()
+
+    @pyqtSlot(object, dict)
+    def show_sync_plan(self, plan: SyncPlan, kwargs: dict):
+        dialog = SyncPlanDialog(plan)
+        dialog.sync_requested.connect(lambda: self.process_task('sync', {**kwargs, "plan": plan, "description": f"Syncing \"{plan.root}\""}))
+        dialog.exec_()
@@ -5,12 +5,14 @@ from PyQt5.QtGui import QMouseEvent
 from PyQt5.QtSvg import QSvgWidget
 from package.model.interface_model import InterfaceModel
 
+BYTES_TO_MEGABYTES = 1000 ** 2
+
 class ExplorerItem(QWidget):
 
     selection_state_changed = pyqtSignal(object)
     perform_task = pyqtSignal(str, dict)
 
-    def __init__(self, parent, explorer, model, path, is_file):
+    def __init__(self, parent, explorer, model, path, is_file, size=None):
         super().__init__(parent)
 
         self.item_list = parent
@@ -20,6 +22,7 @@ class ExplorerItem(QWidget):
         self.basename = path.split('/')[-1]
 
         self.is_file = is_file
+        self.size = size # in bytes, None if it isn't known
 
         self.setAttribute(Qt.WidgetAttribute.WA_StyledBackground, True)
         self.setAttribute(Qt.WidgetAttribute.WA_NoMousePropagation, True)
@@ -46,6 +49,11 @@ class ExplorerItem(QWidget):
         self.item_layout.addWidget(self.icon)
         self.item_layout.addWidget(self.label)
 
+        if size is not None:
+            self.size_label = QLabel(f"{size / BYTES_TO_MEGABYTES:.2f} MB")
+            self.size_label.setStyleSheet("color: grey;")
+            self.item_layout.addWidget(self.size_label)
+
         self.create_right_click_menu()
 
         self.menu.installEventFilter(self)
@@ -127,6 +127,7 @@ class ItemList(QScrollArea):
 
     def process_action(self, action: str) -> None:
         if action == 'Refresh':
+            self.model.invalidate(self.current_directory)
             self.show_list_of_items(self.current_directory)
         if action == 'Create Folder':
             text, ok = QInputDialog.getText(self, "Create Folder", "Enter name of new folder:")
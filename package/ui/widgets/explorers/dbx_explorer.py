@@ -54,7 +54,7 @@ class DropboxExplorer(Explorer):
             super().__init__(parent, model, current_directory)
 
         def get_explorer_item(self, item_data: list):
-            return DropboxExplorer.DropboxExplorerItem(self, self.explorer, self.model, item_data[0], item_data[1])
+            return DropboxExplorer.DropboxExplorerItem(self, self.explorer, self.model, item_data[0], item_data[1], item_data[2])
         
         def create_right_click_menu(self):
             super().create_right_click_menu()
@@ -76,14 +76,17 @@ class DropboxExplorer(Explorer):
                 self.perform_task.emit('upload_folder', {"path":folder_path, "dbx_path":dbx_path, "description":description})
 
     class DropboxExplorerItem(ExplorerItem):
-        def __init__(self, parent, explorer, model,  path, is_file):
-            super().__init__(parent, explorer, model,  path, is_file)
+        def __init__(self, parent, explorer, model,  path, is_file, size=None):
+            super().__init__(parent, explorer, model,  path, is_file, size)
 
         def create_right_click_menu(self):
             super().create_right_click_menu()
             self.menu.addSeparator()
             self.menu.addAction("Download")
             self.menu.addAction("Sync")
+            self.menu.addAction("Preview Sync")
+            if not self.is_file:
+                self.menu.addAction("Calculate Size")
 
         def eventFilter(self, object, event: QEvent) -> bool:
             return super().eventFilter(object, event)
@@ -99,4 +102,8 @@ class DropboxExplorer(Explorer):
                     description = f"Download \"{self.path}\" to \"{download_path}\""
                     self.perform_task.emit('download', {"path":self.path, "local_path":download_path, "description":description})
             elif action == 'Sync':
-                self.perform_task.emit('sync', {"local_path":self.model.read_config()["DROPBOX_LOCATION"], "dbx_path":self.path, "description": "Syncing to local"})
\ No newline at end of file
+                self.perform_task.emit('sync', {"local_path":self.model.read_config().dropbox_location, "dbx_path":self.path, "description": "Syncing to local"})
+            elif action == 'Preview Sync':
+                self.perform_task.emit('plan_sync', {"local_path":self.model.read_config().dropbox_location, "dbx_path":self.path, "description": f"Planning sync of \"{self.path}\""})
+            elif action == 'Calculate Size':
+                self.perform_task.emit('folder_size', {"path":self.path, "description": f"Size of \"{self.path}\""})
\ No newline at end of file
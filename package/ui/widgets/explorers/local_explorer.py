@@ -17,12 +17,18 @@ class LocalExplorer(Explorer):
         self.item_list.left_clicked.connect(self.mouseReleaseEvent)
         self.item_list.perform_task.connect(self.process_task)
 
+        model.local_changes.connect(self.sync_local_changes)
+
         self.addWidget(self.directory_panel)
         self.addWidget(self.item_list)
 
         self.setStretchFactor(0, 0)
         self.setStretchFactor(1, 1)
 
+    def sync_local_changes(self, paths: list):
+        description = f"Syncing {len(paths)} changed path{'' if len(paths) == 1 else 's'}"
+        self.process_task('sync_paths', {"paths": paths, "description": description})
+
     class LocalDirectoryPanel(DirectoryPanel):
         def __init__(self, parent: QWidget, current_directory: str, header: str):
             super().__init__(parent, current_directory, header)
@@ -62,11 +68,14 @@ class LocalExplorer(Explorer):
             super().create_right_click_menu()
             self.menu.addSeparator()
             self.menu.addAction("Sync")
+            self.menu.addAction("Preview Sync")
 
         def process_action(self, action: str) -> None:
             super().process_action(action)
             if action == 'Sync':
                 self.perform_task.emit('sync', {'description': 'Syncing local files'})
+            elif action == 'Preview Sync':
+                self.perform_task.emit('plan_sync', {'description': 'Planning sync of local files'})
 
     class LocalExplorerItem(ExplorerItem):
         def __init__(self, parent, explorer, model,  path, is_file):
@@ -29,6 +29,10 @@ class StatusBar(QStatusBar):
         statusbar_section = self._get_statusbar_section(model) # type: StatusBar.StatusBarSection
         if task.status == TaskItemStatus.DONE:
             statusbar_section.set_task_status("no tasks to perform")
+        elif task.status == TaskItemStatus.FAILED:
+            statusbar_section.set_task_status(f"{task.kwargs['description']} failed: {task.error}")
+        elif task.progress:
+            statusbar_section.set_task_status(f"{task.kwargs['description']}: {task.progress}")
         else:
             statusbar_section.set_task_status(task.kwargs["description"])
 
@@ -121,7 +121,8 @@ class TaskStatusPopup(QWidget):
         TASK_STATUS_TO_ICON_PATH = {
             TaskItemStatus.QUEUED: str(Path(Path(__file__).parents[1], 'icons', "clock.svg")),
             TaskItemStatus.RUNNING: str(Path(Path(__file__).parents[1], 'icons', "loading.svg")),
-            TaskItemStatus.DONE: str(Path(Path(__file__).parents[1], 'icons', "check-lg.svg"))
+            TaskItemStatus.DONE: str(Path(Path(__file__).parents[1], 'icons', "check-lg.svg")),
+            TaskItemStatus.FAILED: str(Path(Path(__file__).parents[1], 'icons', "x.svg"))
         }
 
         def __init__(self, parent, action_label):
@@ -143,6 +144,7 @@ class TaskStatusPopup(QWidget):
             self.icon.renderer().setAspectRatioMode(Qt.AspectRatioMode.KeepAspectRatio)
             self.icon.setFixedSize(20, 20)
 
+            self.action_label = action_label
             self.label = QLabel(action_label)
 
             self.item_layout.addWidget(self.icon)
@@ -151,4 +153,10 @@ class TaskStatusPopup(QWidget):
         @pyqtSlot(ExplorerTask)
         def receive_task_update(self, task: ExplorerTask):
             print(vars(task))
-            self.icon.load(self.TASK_STATUS_TO_ICON_PATH[task.status])
\ No newline at end of file
+            self.icon.load(self.TASK_STATUS_TO_ICON_PATH[task.status])
+            if task.status == TaskItemStatus.FAILED:
+                self.label.setText(f"{self.action_label}: failed ({task.error})")
+            elif task.progress:
+                self.label.setText(f"{self.action_label}: {task.progress}")
+            else:
+                self.label.setText(self.action_label)
\ No newline at end of file
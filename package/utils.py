@@ -5,6 +5,7 @@ Takes care of auth and gets the files & folders
 
 import json
 import os
+import threading
 from collections.abc import Iterable
 from datetime import datetime
 from pathlib import Path
@@ -14,11 +15,24 @@ import requests
 from dropbox import Dropbox
 from dropbox.exceptions import AuthError
 
+from package.model.content_hash import HashCache
+from package.model.ignore import GitignoreCache, IgnoreMatcher
+from package.model.ledger import (NANOSECONDS, TIMESTAMP_FORMAT, LedgerWriter,
+                                  SyncLedger, legacy_timestamp_to_ns)
+from package.model.rate_limit import ThrottledDropbox
+from package.model.scanner import TreeScanner
+from package.model.upload_policy import MEBIBYTE, MemoryBudget, UploadPolicy
+
 PROJECT_ROOT = Path(__file__).parents[1]
 CONFIG_PATH = Path(PROJECT_ROOT, 'config.json')
+LEDGER_PATH = Path(PROJECT_ROOT, 'ledger.db')
+
+BYTES_PER_MEGABYTE = 1000 ** 2
 
-OLD_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
-TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S%z"
+LEDGER_KEYS = {
+    SyncLedger.LOCAL: 'TIME_LAST_SYNCED_FROM_LOCAL',
+    SyncLedger.CLOUD: 'TIME_LAST_SYNCED_FROM_CLOUD'
+}
 
 def create_dbx() -> Dropbox:
     with open(CONFIG_PATH, 'r+') as json_file:
@@ -30,7 +44,13 @@ def create_dbx() -> Dropbox:
         ACCESS_TOKEN = json_data["ACCESS_TOKEN"]
         REFRESH_TOKEN = json_data["REFRESH_TOKEN"]
 
-        return Dropbox(app_key=APP_KEY, app_secret=APP_SECRET, oauth2_access_token=ACCESS_TOKEN, oauth2_refresh_token=REFRESH_TOKEN)
+        # 0 means no limit
+        return ThrottledDropbox(
+            app_key=APP_KEY, app_secret=APP_SECRET, oauth2_access_token=ACCESS_TOKEN, oauth2_refresh_token=REFRESH_TOKEN,
+            requests_per_second=json_data.get("MAX_REQUESTS_PER_SECOND", 0),
+            upload_bytes_per_second=json_data.get("MAX_UPLOAD_MB_PER_SECOND", 0) * BYTES_PER_MEGABYTE,
+            download_bytes_per_second=json_data.get("MAX_DOWNLOAD_MB_PER_SECOND", 0) * BYTES_PER_MEGABYTE
+        )
 
 def validate_dbx(dbx: Dropbox) -> bool:
     # Check that the access token is valid
@@ -56,122 +76,309 @@ def create_config(code: str, app_key: str, app_secret: str, dropbox_location: st
         'APP_SECRET': app_secret,
         'ACCESS_TOKEN': r_data["access_token"],
         'REFRESH_TOKEN': r_data["refresh_token"],
-        'GITIGNORE_OVERRIDES': [],
-        'TIME_LAST_SYNCED_FROM_CLOUD': {},
-        'TIME_LAST_SYNCED_FROM_LOCAL': {}
+        'GITIGNORE_OVERRIDES': []
     }
 
     with open(CONFIG_PATH, "w") as json_file:
         json.dump(config_data, json_file, indent=4)
 
+_ledger: SyncLedger = None
+_ledger_writer: LedgerWriter = None
+_ledger_lock = threading.Lock()
+
+def get_ledger() -> SyncLedger:
+    '''
+    the ledger for reading. all writes should go through get_ledger_writer()
+    '''
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = SyncLedger(LEDGER_PATH)
+        return _ledger
+
+def get_ledger_writer() -> LedgerWriter:
+    global _ledger_writer
+    ledger = get_ledger()
+    with _ledger_lock:
+        if _ledger_writer is None:
+            _ledger_writer = LedgerWriter(ledger)
+        return _ledger_writer
+
+def get_hash_cache() -> HashCache:
+    return HashCache(get_ledger(), get_ledger_writer())
+
+_upload_budget: MemoryBudget = None
+_upload_budget_lock = threading.Lock()
+
+def get_upload_budget() -> MemoryBudget:
+    '''
+    shared by every upload, sized by UPLOAD_MEMORY_MB when it is first needed
+    '''
+    global _upload_budget
+    with _upload_budget_lock:
+        if _upload_budget is None:
+            _upload_budget = MemoryBudget(get_config().upload_memory)
+        return _upload_budget
+
+def close_ledger() -> None:
+    '''
+    commits anything still queued and closes the ledger. called on shutdown
+    '''
+    global _ledger, _ledger_writer, _gitignore_cache
+    with _gitignore_cache_lock:
+        # it holds on to the ledger
+        _gitignore_cache = None
+    with _ledger_lock:
+        if _ledger_writer is not None:
+            _ledger_writer.close()
+            _ledger_writer = None
+        if _ledger is not None:
+            _ledger.close()
+            _ledger = None
+
+class Config:
+    '''
+    Read-only view of config.json with the ignore sets
+    and the time zone already built
+    '''
+
+    def __init__(self, config_data: dict) -> None:
+        self._data = config_data
+        self._dbx_ignore = frozenset(config_data["DBX_IGNORE"])
+        self._gitignore_overrides = frozenset(config_data["GITIGNORE_OVERRIDES"])
+        self._tz = pytz.timezone(config_data["TIME_ZONE"])
+
+        try:
+            self._upload_policy = UploadPolicy(int(config_data.get("UPLOAD_CHUNK_SIZE_MB", UploadPolicy.DEFAULT_CHUNK_SIZE // MEBIBYTE)) * MEBIBYTE)
+        except ValueError as e:
+            print(f"Ignoring UPLOAD_CHUNK_SIZE_MB ({e})")
+            self._upload_policy = UploadPolicy()
+
+    @property
+    def dropbox_location(self) -> str:
+        return self._data.get("DROPBOX_LOCATION", "")
+
+    @property
+    def time_zone(self) -> str:
+        return self._data["TIME_ZONE"]
+
+    @property
+    def tz(self) -> pytz.BaseTzInfo:
+        return self._tz
+
+    @property
+    def dbx_ignore(self) -> frozenset[str]:
+        return self._dbx_ignore
+
+    @property
+    def gitignore_overrides(self) -> frozenset[str]:
+        return self._gitignore_overrides
+
+    @property
+    def watch_local_changes(self) -> bool:
+        return self._data.get("WATCH_LOCAL_CHANGES", True)
+
+    @property
+    def upload_workers(self) -> int:
+        return max(1, int(self._data.get("UPLOAD_WORKERS", 4)))
+
+    @property
+    def download_workers(self) -> int:
+        return max(1, int(self._data.get("DOWNLOAD_WORKERS", 4)))
+
+    @property
+    def upload_policy(self) -> UploadPolicy:
+        return self._upload_policy
+
+    @property
+    def chunk_upload_workers(self) -> int:
+        return max(1, int(self._data.get("CHUNK_UPLOAD_WORKERS", 4)))
+
+    @property
+    def upload_memory(self) -> int:
+        '''
+        in bytes, at least one chunk
+        '''
+        return max(self._upload_policy.chunk_size, int(self._data.get("UPLOAD_MEMORY_MB", 128)) * MEBIBYTE)
+
+    @property
+    def batch_uploads(self) -> bool:
+        return self._data.get("BATCH_UPLOADS", True)
+
+    def get(self, key: str, default=None):
+        return self._data.get(key, default)
+
+_config: Config = None
+_config_signature: tuple[int, int] = None
+_config_lock = threading.Lock()
+
+def get_config() -> Config:
+    '''
+    config.json is only read again when its modified time or size changes
+    '''
+    global _config, _config_signature
+    with _config_lock:
+        stat = os.stat(CONFIG_PATH)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if _config is None or signature != _config_signature:
+            _config = Config(read_config())
+            _config_signature = signature
+        return _config
+
+_gitignore_cache: GitignoreCache = None
+_gitignore_cache_lock = threading.Lock()
+
+def get_gitignore_cache() -> GitignoreCache:
+    global _gitignore_cache
+    with _gitignore_cache_lock:
+        if _gitignore_cache is None:
+            _gitignore_cache = GitignoreCache(get_ledger(), get_ledger_writer())
+        return _gitignore_cache
+
 def read_config() -> dict:
     with open(CONFIG_PATH, 'r') as json_file:
         config_data = json.load(json_file)
 
-        if "DBX_IGNORE" not in config_data:
-            config_data["DBX_IGNORE"] = set()
-        else:
-            config_data["DBX_IGNORE"] = set(config_data["DBX_IGNORE"])
+    if "SYNCED_PATHS" in config_data or any(key in config_data for key in LEDGER_KEYS.values()):
+        migrate_to_ledger(config_data)
 
-        if "GITIGNORE_OVERRIDES" not in config_data:
-            config_data["GITIGNORE_OVERRIDES"] = set()
-        else:
-            config_data["GITIGNORE_OVERRIDES"] = set(config_data["GITIGNORE_OVERRIDES"])
+    if "DBX_IGNORE" not in config_data:
+        config_data["DBX_IGNORE"] = set()
+    else:
+        config_data["DBX_IGNORE"] = set(config_data["DBX_IGNORE"])
 
-        if "TIME_LAST_SYNCED_FROM_LOCAL" not in config_data:
-            config_data["TIME_LAST_SYNCED_FROM_LOCAL"] = dict()
-        
-        if "TIME_LAST_SYNCED_FROM_CLOUD" not in config_data:
-            config_data["TIME_LAST_SYNCED_FROM_CLOUD"] = dict()
+    if "GITIGNORE_OVERRIDES" not in config_data:
+        config_data["GITIGNORE_OVERRIDES"] = set()
+    else:
+        config_data["GITIGNORE_OVERRIDES"] = set(config_data["GITIGNORE_OVERRIDES"])
 
-        return config_data
-    
-def clean_synced_paths(local_dbx_path: str) -> Iterable[str]:
+    return config_data
 
-    print("Reading config")
-    config: dict = read_config()
+def migrate_to_ledger(config_data: dict) -> None:
+    '''
+    one-time move of the TIME_LAST_SYNCED_FROM_... dicts out of config.json
+    and into the ledger. config.json is rewritten without them.
+    '''
+    print("Moving synced paths from config.json to the ledger")
 
-    existing_files = set()
-    existing_folders = set()
+    if "SYNCED_PATHS" in config_data:
+        if LEDGER_KEYS[SyncLedger.LOCAL] not in config_data:
+            print("Changing SYNCED_PATHS to TIME_LAST_SYNCED_FROM_LOCAL")
+            config_data[LEDGER_KEYS[SyncLedger.LOCAL]] = config_data["SYNCED_PATHS"]
+        config_data.pop("SYNCED_PATHS")
 
-    print("Scanning through local files")
-    last_ignored: str = None
-    for dirpath, dirnames, filenames in os.walk(local_dbx_path):
-        if last_ignored and dirpath.startswith(last_ignored):
+    tz = pytz.timezone(config_data["TIME_ZONE"])
+    ledger_writer = get_ledger_writer()
+    for source, key in LEDGER_KEYS.items():
+        if key not in config_data:
             continue
+        entries = {path: legacy_timestamp_to_ns(timestamp, tz) for path, timestamp in config_data.pop(key).items()}
+        ledger_writer.update(source, entries)
+    ledger_writer.flush()
 
-        skip = False
-        for ignored in config["DBX_IGNORE"]:
-            if dirpath.startswith(ignored):
-                last_ignored = dirpath
-                skip = True
-                break
-        if skip: continue
+    with open(CONFIG_PATH, 'w') as json_file:
+        json.dump(config_data, json_file, indent=4)
 
-        existing_folders.add("/" + os.path.relpath(dirpath, local_dbx_path))
-        for filename in filenames:
-            file_local_path = os.path.join(dirpath, filename)
-            file_relative_path = "/" + os.path.relpath(file_local_path, local_dbx_path)
-            existing_files.add(file_relative_path)
+def clean_synced_paths(local_dbx_path: str) -> Iterable[str]:
 
-    if "SYNCED_PATHS" in config:
-        if "TIME_LAST_SYNCED_FROM_LOCAL" not in config:
-            print("Changing SYNCED_PATHS to TIME_LAST_SYNCED_FROM_LOCAL")
-            config["TIME_LAST_SYNCED_FROM_LOCAL"] = config["SYNCED_PATHS"]
-        config.pop("SYNCED_PATHS")
+    print("Reading config")
+    config = get_config()
+    ledger = get_ledger()
+    ledger_writer = get_ledger_writer()
+
+    matcher = IgnoreMatcher(local_dbx_path, config.dbx_ignore, (), gitignore=False)
+    snapshot = ledger.get_snapshot()
+
+    if snapshot:
+        print("Checking synced folders against the snapshot")
+        existing_folders, nonexistent_files = _find_nonexistent_files(local_dbx_path, matcher, ledger, snapshot)
+
+        deleted_folders = [folder for folder in snapshot if not os.path.isdir(os.path.join(local_dbx_path, folder[1:]))]
+        ledger_writer.remove_snapshot(deleted_folders)
+    else:
+        existing_files = set()
+        existing_folders = set()
+
+        print("Scanning through local files")
+        for directory in TreeScanner(local_dbx_path, matcher).scan():
+            existing_folders.add(directory.relative_path)
+            for entry in directory.files:
+                existing_files.add(entry.relative_path)
+
+        print("Checking for modified files")
+        nonexistent_files = set()
+        for path in ledger.paths(SyncLedger.LOCAL):
+            # ignored files aren't scanned, that doesn't mean they were deleted
+            if path not in existing_files and not matcher.is_ignored(os.path.join(local_dbx_path, path[1:])):
+                nonexistent_files.add(path)
+
+    ledger_writer.remove(SyncLedger.LOCAL, nonexistent_files)
+    ledger_writer.flush()
 
-    print("Checking for modified files")
-    new_time_last_synced_from_local = {}
-    nonexistent_files = set()
-    for path, time in config["TIME_LAST_SYNCED_FROM_LOCAL"].items():
-        if path in existing_files:
-            new_time_last_synced_from_local[path] = time
-        else:
-            nonexistent_files.add(path)
-
-    print("Checking time zone formatting")
-    tz = pytz.timezone(config['TIME_ZONE'])
-    for path, time in new_time_last_synced_from_local.items():
-        try:
-            datetime.strptime(time, TIMESTAMP_FORMAT)
-        except ValueError:
-            dt = datetime.strptime(time, OLD_TIMESTAMP_FORMAT)
-            dt = tz.localize(dt)
-            new_time_last_synced_from_local[path] = datetime.strftime(dt, TIMESTAMP_FORMAT)
+    return find_paths_to_delete(existing_folders, nonexistent_files)
 
-    config['TIME_LAST_SYNCED_FROM_LOCAL'] = new_time_last_synced_from_local
 
-    config['GITIGNORE_OVERRIDES'] = list(config['GITIGNORE_OVERRIDES'])
+def _find_nonexistent_files(local_dbx_path: str, matcher: IgnoreMatcher, ledger: SyncLedger, snapshot: dict[str, tuple[int, bytes]]) -> tuple[set[str], set[str]]:
+    '''
+    only looks at the folders holding synced files instead of walking everything.
+    a folder's modified time changes whenever something inside of it is
+    created, deleted or renamed, so a folder that still has the modified time
+    from the snapshot still has every synced file in it and isn't even listed.
+    ignored files are left out, whether they are still there or not
+    '''
+    synced_by_folder: dict[str, list[str]] = {}
+    for path in ledger.paths(SyncLedger.LOCAL):
+        synced_by_folder.setdefault(os.path.dirname(path), []).append(path)
 
-    # This may look useless, but removing them and adding them back in again
-    # puts them at the bottom of the file so that other attributes can be
-    # seen at the top of the config file
-    config['TIME_LAST_SYNCED_FROM_CLOUD'] = config.pop("TIME_LAST_SYNCED_FROM_CLOUD")
-    config['TIME_LAST_SYNCED_FROM_LOCAL'] = config.pop("TIME_LAST_SYNCED_FROM_LOCAL")
+    existing_folders = {"/"}
+    nonexistent_files = set()
 
-    # convert any old timestamp to use time zones
-    convert_to_time_zone_format(config, 'TIME_LAST_SYNCED_FROM_CLOUD')
-    convert_to_time_zone_format(config, 'TIME_LAST_SYNCED_FROM_LOCAL')
+    def folder_exists(folder: str) -> bool:
+        dir_path = os.path.join(local_dbx_path, folder[1:])
+        return matcher.context_for(dir_path) is not None and os.path.isdir(dir_path)
 
-    config["DBX_IGNORE"] = list(config["DBX_IGNORE"])
-    config["GITIGNORE_OVERRIDES"] = list(config["GITIGNORE_OVERRIDES"])
+    for folder, paths in synced_by_folder.items():
+        dir_path = os.path.join(local_dbx_path, folder[1:])
+        context = matcher.context_for(dir_path)
+        if context is None:
+            continue
+        paths = [path for path in paths if not matcher.ignored(context, os.path.join(dir_path, os.path.basename(path)), False)]
+        try:
+            mtime_ns = os.stat(dir_path).st_mtime_ns if os.path.isdir(dir_path) else None
+        except OSError:
+            mtime_ns = None
 
-    with open(CONFIG_PATH, 'w') as json_file:
-        json.dump(config, json_file, indent=4)
+        if mtime_ns is None:
+            nonexistent_files.update(paths)
+            continue
+        existing_folders.add(folder)
+
+        names = None
+        if snapshot.get(folder, (None,))[0] != mtime_ns:
+            with os.scandir(dir_path) as it:
+                names = {entry.name for entry in it if entry.is_file()}
+
+        for path in paths:
+            if names is not None and os.path.basename(path) not in names:
+                nonexistent_files.add(path)
+
+    # find_paths_to_delete needs the closest folder above each deleted file that still exists
+    for path in nonexistent_files:
+        folder = os.path.dirname(path)
+        while folder not in existing_folders:
+            if folder_exists(folder):
+                existing_folders.add(folder)
+                break
+            folder = os.path.dirname(folder)
 
-    return find_paths_to_delete(existing_folders, nonexistent_files)
+    return existing_folders, nonexistent_files
 
 
-def convert_to_time_zone_format(config: dict, synced_times_key: str):
-    for path, timestamp_str in config[synced_times_key].items():
-        try:
-            timestamp_datetime = datetime.strptime(timestamp_str, OLD_TIMESTAMP_FORMAT)
-            tz = pytz.timezone(config["TIME_ZONE"])
-            timestamp_datetime_tz = tz.localize(timestamp_datetime)
-            config[synced_times_key][path] = timestamp_datetime_tz.strftime(TIMESTAMP_FORMAT)
-        except ValueError as e:
-            # correct time zone format
-            pass
+def format_timestamp(mtime_ns: int, tz: pytz.BaseTzInfo) -> str:
+    '''
+    only for displaying ledger times, everything else compares the integers
+    '''
+    return datetime.fromtimestamp(mtime_ns // NANOSECONDS, tz).strftime(TIMESTAMP_FORMAT)
 
 
 def find_paths_to_delete(existing_folders, nonexistent_files) -> set[str]:
@@ -0,0 +1,187 @@
+"""
+IgnoreMatcher against what git check-ignore says about the same tree, plus
+the DBX_IGNORE and GITIGNORE_OVERRIDES settings git knows nothing about
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from package.model.ignore import DBX_IGNORE, GITIGNORE, IgnoreMatcher
+from package.model.scanner import TreeScanner
+
+GITIGNORES = {
+    "": [
+        "build/",
+        "*.log",
+        "!keep.log",
+        "/docs/*.tmp",
+        "/top-only",
+        "**/cache",
+        "secret/*",
+        "!secret/shared",
+        "# a comment",
+        "\\#literal",
+        "vendor/**",
+        "!vendor/sub/",
+    ],
+    "docs": [
+        "!important.log",
+        "sub/",
+        "/local.txt",
+        "*.bak",
+    ],
+    "docs/sub": [
+        "!everything",
+    ],
+    "src": [
+        "!build/",
+        "gen/**",
+        "a?c",
+    ],
+}
+
+FILES = [
+    "build/x/a",
+    "src/build/b",
+    "src/lib/build/c",
+    "a.log",
+    "keep.log",
+    "logs/d.log",
+    "docs/a.tmp",
+    "docs/more/b.tmp",
+    "src/c.tmp",
+    "top-only",
+    "src/top-only",
+    "cache/e",
+    "src/deep/cache/f",
+    "secret/key",
+    "secret/shared",
+    "#literal",
+    "# a comment",
+    "docs/important.log",
+    "docs/other.log",
+    "docs/sub/everything",
+    "docs/sub/g",
+    "docs/local.txt",
+    "src/local.txt",
+    "docs/x.bak",
+    "docs/more/y.bak",
+    "x.bak",
+    "src/gen/h",
+    "src/gen/deeper/i",
+    "src/abc",
+    "src/abbc",
+    "src/main.py",
+    "vendor/a",
+    "vendor/sub/f",
+]
+
+
+@unittest.skipUnless(shutil.which("git"), "needs git")
+class GitCheckIgnoreTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.root = os.path.join(self.directory.name, "Dropbox")
+        os.mkdir(self.root)
+        subprocess.run(["git", "init", "-q", self.root], check=True)
+
+        for relative_dir, lines in GITIGNORES.items():
+            dir_path = os.path.join(self.root, relative_dir)
+            os.makedirs(dir_path, exist_ok=True)
+            with open(os.path.join(dir_path, GITIGNORE), "w") as file:
+                file.write("\n".join(lines) + "\n")
+
+        for relative_path in FILES:
+            path = os.path.join(self.root, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "w").close()
+
+    def git_ignored(self, relative_paths: list[str]) -> set[str]:
+        result = subprocess.run(
+            ["git", "check-ignore", "--no-index", "--stdin"],
+            cwd=self.root, input="\n".join(relative_paths) + "\n", capture_output=True, text=True
+        )
+        # 1 means nothing was ignored
+        self.assertIn(result.returncode, (0, 1), result.stderr)
+        return set(result.stdout.splitlines())
+
+    def all_paths(self) -> list[tuple[str, bool]]:
+        paths = []
+        for dir_path, dir_names, file_names in os.walk(self.root):
+            dir_names[:] = [name for name in dir_names if name != ".git"]
+            for name in dir_names:
+                paths.append((os.path.relpath(os.path.join(dir_path, name), self.root), True))
+            for name in file_names:
+                paths.append((os.path.relpath(os.path.join(dir_path, name), self.root), False))
+        return sorted(paths)
+
+    def test_matches_git(self):
+        paths = self.all_paths()
+        git_ignored = self.git_ignored([path for path, _ in paths])
+        matcher = IgnoreMatcher(self.root, (), ())
+
+        for path, is_dir in paths:
+            with self.subTest(path=path):
+                self.assertEqual(matcher.is_ignored(os.path.join(self.root, path), is_dir), path in git_ignored)
+
+    def test_scanner_matches_git(self):
+        files = [path for path, is_dir in self.all_paths() if not is_dir]
+        git_ignored = self.git_ignored(files)
+        scanner = TreeScanner(self.root, IgnoreMatcher(self.root, [os.path.join(self.root, ".git")], ()))
+        scanned = {entry.relative_path[1:] for entry in scanner.files()}
+
+        self.assertEqual(scanned, set(files) - git_ignored)
+
+    def test_changed_gitignore_needs_invalidate(self):
+        matcher = IgnoreMatcher(self.root, (), ())
+        path = os.path.join(self.root, "src", "main.py")
+        self.assertFalse(matcher.is_ignored(path))
+
+        with open(os.path.join(self.root, "src", GITIGNORE), "a") as file:
+            file.write("*.py\n")
+        self.assertFalse(matcher.is_ignored(path))
+        matcher.invalidate(os.path.join(self.root, "src"))
+        self.assertTrue(matcher.is_ignored(path))
+        self.assertIn("src/main.py", self.git_ignored(["src/main.py"]))
+
+
+class SettingsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.root = self.directory.name
+        os.makedirs(os.path.join(self.root, "project", "build"))
+        with open(os.path.join(self.root, "project", GITIGNORE), "w") as file:
+            file.write("build/\n*.o\n")
+
+    def path(self, relative_path: str) -> str:
+        return os.path.join(self.root, relative_path)
+
+    def test_dbx_ignore(self):
+        matcher = IgnoreMatcher(self.root, [self.path("project/notes.txt"), self.path("private")], ())
+        context = matcher.context_for(self.path("project"))
+        self.assertEqual(matcher.ignored(context, self.path("project/notes.txt"), False), DBX_IGNORE)
+        self.assertTrue(matcher.is_ignored(self.path("private"), True))
+        self.assertTrue(matcher.is_ignored(self.path("private/anything")))
+        self.assertFalse(matcher.is_ignored(self.path("notes.txt")))
+
+    def test_gitignore_overrides(self):
+        matcher = IgnoreMatcher(self.root, (), [self.path("project/build")])
+        self.assertFalse(matcher.is_ignored(self.path("project/build"), True))
+        self.assertFalse(matcher.is_ignored(self.path("project/build/main.o")))
+        self.assertTrue(matcher.is_ignored(self.path("project/main.o")))
+
+    def test_gitignore_off(self):
+        matcher = IgnoreMatcher(self.root, (), (), gitignore=False)
+        self.assertFalse(matcher.is_ignored(self.path("project/main.o")))
+        self.assertFalse(matcher.is_ignored(self.path("project/build"), True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+"""
+The LedgerWriter batching, coalescing and moving rows around in the ledger
+"""
+
+import os
+import tempfile
+import time
+import unittest
+
+from package.model.ledger import LedgerWriteError, LedgerWriter, SyncLedger
+
+LOCAL = SyncLedger.LOCAL
+CLOUD = SyncLedger.CLOUD
+
+
+class LedgerWriterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.ledger = SyncLedger(os.path.join(self.directory.name, "ledger.db"))
+        self.addCleanup(self.ledger.close)
+        self.writer = LedgerWriter(self.ledger)
+        self.addCleanup(self.writer.close)
+        # nothing is committed on a timer unless a test waits for it
+        self.writer.BATCH_INTERVAL = 60.0
+
+    def wait_for(self, condition) -> None:
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "the writer never committed")
+            time.sleep(0.01)
+
+    def test_commits_on_flush(self):
+        self.writer.set(LOCAL, "/a", 1)
+        time.sleep(0.1)
+        self.assertIsNone(self.ledger.get(LOCAL, "/a"))
+
+        self.writer.flush()
+        self.assertEqual(self.ledger.get(LOCAL, "/a"), 1)
+
+    def test_commits_when_the_batch_is_full(self):
+        self.writer.BATCH_SIZE = 3
+        for i in range(3):
+            self.writer.set(LOCAL, f"/{i}", i)
+        self.wait_for(lambda: self.ledger.get(LOCAL, "/2") is not None)
+        self.assertEqual(self.ledger.get_all(LOCAL), {"/0": 0, "/1": 1, "/2": 2})
+
+    def test_commits_after_the_interval(self):
+        self.writer.BATCH_INTERVAL = 0.1
+        self.writer.set(LOCAL, "/a", 1)
+        self.wait_for(lambda: self.ledger.get(LOCAL, "/a") is not None)
+
+    def test_coalesces_updates_to_the_same_path(self):
+        self.writer.set(LOCAL, "/a", 1, content_hash="old")
+        self.writer.set(LOCAL, "/a", 2, content_hash="new", inode=3, size=4)
+        self.writer.set(CLOUD, "/a", 5)
+        self.writer.set(LOCAL, "/b", 1)
+        self.writer.remove(LOCAL, ["/b"])
+        self.writer.flush()
+
+        self.assertEqual(self.ledger.get_entry(LOCAL, "/a"), (2, "new", 3, 4))
+        self.assertEqual(self.ledger.get(CLOUD, "/a"), 5)
+        self.assertIsNone(self.ledger.get(LOCAL, "/b"))
+
+    def test_remove_prefix_keeps_what_is_queued_after_it(self):
+        self.writer.set(LOCAL, "/folder/old", 1)
+        self.writer.set(LOCAL, "/folder2/kept", 1)
+        self.writer.flush()
+
+        self.writer.set(LOCAL, "/folder/queued", 2)
+        self.writer.remove_prefix(LOCAL, "/folder")
+        self.writer.set(LOCAL, "/folder/new", 3)
+        self.writer.flush()
+
+        self.assertEqual(self.ledger.get_all(LOCAL), {"/folder/new": 3, "/folder2/kept": 1})
+
+    def test_failed_batch_raises_on_flush(self):
+        self.writer.set(LOCAL, "/a", 1)
+        # not UTF-8, so sqlite can't take it and the whole batch is dropped
+        self.writer.set(LOCAL, "/bad\udcff", 1)
+        with self.assertRaises(LedgerWriteError):
+            self.writer.flush()
+        self.assertIsNone(self.ledger.get(LOCAL, "/a"))
+
+        # the error is only raised once and the writer carries on
+        self.writer.set(LOCAL, "/b", 2)
+        self.writer.flush()
+        self.assertEqual(self.ledger.get(LOCAL, "/b"), 2)
+
+    def test_failed_timed_batch_raises_on_the_next_flush(self):
+        self.writer.BATCH_INTERVAL = 0.05
+        self.writer.set(LOCAL, "/bad\udcff", 1)
+        time.sleep(0.3)
+        with self.assertRaises(LedgerWriteError):
+            self.writer.flush()
+        self.writer.flush()
+
+    def test_rename_prefix(self):
+        for source in (LOCAL, CLOUD):
+            self.writer.set(source, "/a", 1)
+            self.writer.set(source, "/a/x", 2)
+            self.writer.set(source, "/a/sub/y", 3)
+            self.writer.set(source, "/ab", 4)
+            self.writer.set(source, "/b/stale", 5)
+        self.writer.set_snapshot("/a", 1, b"a")
+        self.writer.set_snapshot("/a/sub", 2, b"sub")
+        self.writer.set_snapshot("/b", 3, b"stale")
+        self.writer.set_cursor("/A/Sub", "cursor")
+        self.writer.set_cursor("/b", "stale")
+        self.writer.flush()
+
+        self.writer.rename_prefix("/a/", "/b")
+        # committed straight away, without waiting for a flush
+        self.wait_for(lambda: self.ledger.get(LOCAL, "/b/x") is not None)
+
+        for source in (LOCAL, CLOUD):
+            self.assertEqual(self.ledger.get_all(source), {"/b": 1, "/b/x": 2, "/b/sub/y": 3, "/ab": 4})
+        self.assertEqual(self.ledger.get_snapshot(), {"/b": (1, b"a"), "/b/sub": (2, b"sub")})
+        self.assertEqual(self.ledger.get_cursor("/b/sub"), "cursor")
+        self.assertIsNone(self.ledger.get_cursor("/a/sub"))
+        self.assertIsNone(self.ledger.get_cursor("/b"))
+
+    def test_rename_prefix_comes_after_what_was_queued_before_it(self):
+        self.writer.set(LOCAL, "/a/x", 1)
+        self.writer.rename_prefix("/a", "/b")
+        self.writer.set(LOCAL, "/a/y", 2)
+        self.writer.flush()
+
+        self.assertEqual(self.ledger.get_all(LOCAL), {"/b/x": 1, "/a/y": 2})
+
+    def test_cursors_and_gitignores(self):
+        self.writer.set_cursor("/Photos", "1")
+        self.writer.set_gitignore("/root/.gitignore", 1, 2, "", ["/**/*.o"])
+        self.writer.flush()
+        self.assertEqual(self.ledger.get_cursor("/photos"), "1")
+        self.assertEqual(self.ledger.get_gitignore("/root/.gitignore"), (1, 2, "", ["/**/*.o"]))
+
+        self.writer.remove_cursor("/PHOTOS")
+        self.writer.remove_gitignores(["/root/.gitignore"])
+        self.writer.flush()
+        self.assertIsNone(self.ledger.get_cursor("/photos"))
+        self.assertEqual(self.ledger.gitignore_paths(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
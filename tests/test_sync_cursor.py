@@ -0,0 +1,237 @@
+"""
+When a cloud sync saves its cursor, against a fake Dropbox that lists a
+folder and the changes since a cursor the way the real one does
+"""
+
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import pytz
+import requests
+from dropbox.exceptions import ApiError
+from dropbox.files import (DeletedMetadata, FileMetadata, FolderMetadata,
+                           ListFolderContinueError, ListFolderResult)
+
+import package.model.dbx_model as dbx_model
+import package.utils as utils
+from package.model.content_hash import ContentHasher
+from package.model.sync_plan import SyncPlan
+
+CLOUD_IS_NEWER = datetime(2100, 1, 1)
+LOCAL_IS_NEWER = datetime(2000, 1, 1)
+
+
+class FakeConfig:
+    tz = pytz.utc
+    gitignore_overrides = frozenset()
+    download_workers = 2
+
+    def __init__(self) -> None:
+        self.dbx_ignore = frozenset()
+
+
+class FakeResponse:
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def iter_content(self, chunk_size: int):
+        for offset in range(0, len(self.data), chunk_size):
+            yield self.data[offset:offset + chunk_size]
+
+
+class FakeDropbox:
+    '''
+    one folder, "/f". changes are what listing from a cursor returns, and a
+    download of anything in broken is cut off
+    '''
+
+    def __init__(self) -> None:
+        self.files: dict[str, tuple[bytes, datetime]] = {}
+        self.changes: list = []
+        self.broken: set[str] = set()
+        self.listed_from: list[str] = []
+        self.cursors = 0
+        self.reset = False
+
+    def put(self, path: str, data: bytes, client_modified: datetime = CLOUD_IS_NEWER) -> None:
+        self.files[path] = (data, client_modified)
+        self.changes.append(self.metadata(path))
+
+    def delete(self, path: str) -> None:
+        del self.files[path]
+        self.changes.append(DeletedMetadata(name=os.path.basename(path), path_display=path, path_lower=path.lower()))
+
+    def metadata(self, path: str) -> FileMetadata:
+        data, client_modified = self.files[path]
+        hasher = ContentHasher()
+        hasher.update(data)
+        return FileMetadata(
+            name=os.path.basename(path), id="id:" + path, client_modified=client_modified, server_modified=client_modified,
+            rev="0123456789", size=len(data), path_display=path, path_lower=path.lower(), content_hash=hasher.hexdigest()
+        )
+
+    def files_get_metadata(self, path):
+        return FolderMetadata(name="f", id="id:/f", path_display="/f", path_lower="/f")
+
+    def files_list_folder(self, path, recursive=False):
+        self.changes.clear()
+        return ListFolderResult([self.metadata(path) for path in self.files], self._cursor(), False)
+
+    def files_list_folder_continue(self, cursor):
+        self.listed_from.append(cursor)
+        if self.reset:
+            raise ApiError("request", ListFolderContinueError.reset, None, None)
+        changes = self.changes
+        self.changes = []
+        return ListFolderResult(changes, self._cursor(), False)
+
+    def files_download(self, path):
+        if path in self.broken:
+            raise requests.ConnectionError("cut off")
+        return self.metadata(path), FakeResponse(self.files[path][0])
+
+    def _cursor(self) -> str:
+        self.cursors += 1
+        return f"cursor{self.cursors}"
+
+
+class SyncCursorTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.directory.name, "Dropbox")
+        os.makedirs(os.path.join(self.root, "f"))
+
+        self.config = FakeConfig()
+        for patch in (
+            mock.patch.object(utils, "LEDGER_PATH", os.path.join(self.directory.name, "ledger.db")),
+            mock.patch.object(utils, "_ledger", None),
+            mock.patch.object(utils, "_ledger_writer", None),
+            mock.patch.object(utils, "_gitignore_cache", None),
+            mock.patch.object(utils, "get_config", lambda: self.config),
+            mock.patch.object(dbx_model, "get_config", lambda: self.config),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(utils.close_ledger)
+
+        self.dbx = FakeDropbox()
+        self.model = dbx_model.DropboxModel(self.root, self.dbx)
+
+        self.dbx.put("/f/a", b"a")
+        self.sync()
+        self.assertEqual(self.cursor(), "cursor1")
+
+    def sync(self) -> SyncPlan:
+        plan = self.model.build_sync_plan(self.root, "/f")
+        self.model.execute_plan(plan, self.root)
+        utils.get_ledger_writer().flush()
+        return plan
+
+    def cursor(self) -> str | None:
+        return utils.get_ledger().get_cursor("/f")
+
+    def local(self, path: str) -> str:
+        return os.path.join(self.root, path[1:])
+
+    def change_locally(self, path: str) -> None:
+        with open(self.local(path), "wb") as file:
+            file.write(b"changed here")
+        later = time.time() + 10
+        os.utime(self.local(path), (later, later))
+
+    def test_carries_on_from_the_cursor(self):
+        self.dbx.put("/f/b", b"b")
+        self.sync()
+
+        self.assertEqual(self.dbx.listed_from, ["cursor1"])
+        self.assertEqual(self.cursor(), "cursor2")
+        with open(self.local("/f/b"), "rb") as file:
+            self.assertEqual(file.read(), b"b")
+
+    def test_failed_download_keeps_the_cursor(self):
+        self.dbx.put("/f/b", b"b")
+        self.dbx.broken.add("/f/b")
+        self.sync()
+        self.assertEqual(self.cursor(), "cursor1")
+
+        # the same change is listed again and downloaded this time
+        self.dbx.broken.clear()
+        self.dbx.changes.append(self.dbx.metadata("/f/b"))
+        self.sync()
+        self.assertEqual(self.dbx.listed_from, ["cursor1", "cursor1"])
+        self.assertEqual(self.cursor(), "cursor3")
+        self.assertTrue(os.path.exists(self.local("/f/b")))
+
+    def test_deletion_of_a_local_change_is_deferred(self):
+        self.change_locally("/f/a")
+        self.dbx.delete("/f/a")
+        plan = self.sync()
+
+        self.assertEqual(plan.deferred, ["/f/a"])
+        self.assertTrue(os.path.exists(self.local("/f/a")))
+        self.assertEqual(self.cursor(), "cursor1")
+
+    def test_older_cloud_change_is_deferred(self):
+        self.change_locally("/f/a")
+        self.dbx.put("/f/a", b"changed in the cloud", LOCAL_IS_NEWER)
+        plan = self.sync()
+
+        self.assertEqual(plan.deferred, ["/f/a"])
+        with open(self.local("/f/a"), "rb") as file:
+            self.assertEqual(file.read(), b"changed here")
+        self.assertEqual(self.cursor(), "cursor1")
+
+    def test_never_synced_file_does_not_hold_the_cursor(self):
+        self.dbx.put("/f/b", b"b")
+        self.dbx.delete("/f/b")
+        with open(self.local("/f/b"), "wb") as file:
+            file.write(b"only here")
+        plan = self.sync()
+
+        self.assertEqual(plan.deferred, [])
+        self.assertTrue(os.path.exists(self.local("/f/b")))
+        self.assertEqual(self.cursor(), "cursor2")
+
+    def test_ignored_file_does_not_hold_the_cursor(self):
+        self.config.dbx_ignore = frozenset({self.local("/f/a")})
+        self.change_locally("/f/a")
+        self.dbx.delete("/f/a")
+        plan = self.sync()
+
+        self.assertEqual(plan.deferred, [])
+        self.assertTrue(os.path.exists(self.local("/f/a")))
+        self.assertEqual(self.cursor(), "cursor2")
+
+    def test_unchanged_local_copy_follows_a_deletion(self):
+        self.dbx.delete("/f/a")
+        plan = self.sync()
+
+        self.assertEqual(plan.deferred, [])
+        self.assertFalse(os.path.exists(self.local("/f/a")))
+        self.assertEqual(self.cursor(), "cursor2")
+
+    def test_reset_cursor_lists_everything(self):
+        self.dbx.reset = True
+        self.dbx.put("/f/b", b"b")
+        self.sync()
+
+        self.assertEqual(self.dbx.listed_from, ["cursor1"])
+        self.assertEqual(self.cursor(), "cursor2")
+        self.assertTrue(os.path.exists(self.local("/f/b")))
+
+
+if __name__ == "__main__":
+    unittest.main()
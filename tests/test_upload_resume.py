@@ -0,0 +1,218 @@
+"""
+Resuming upload sessions from the ledger's journal, against a fake Dropbox
+that keeps its upload sessions the way the real one does
+"""
+
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import requests
+from dropbox.exceptions import ApiError
+from dropbox.files import (FileMetadata, UploadSessionAppendError,
+                           UploadSessionFinishError, UploadSessionLookupError,
+                           UploadSessionOffsetError, UploadSessionStartResult)
+
+import package.model.dbx_model as dbx_model
+import package.utils as utils
+from package.model.upload_policy import MEBIBYTE, UploadPolicy
+
+CHUNK_SIZE = 4 * MEBIBYTE
+
+
+class FakeConfig:
+    upload_policy = UploadPolicy(CHUNK_SIZE)
+    upload_memory = 64 * MEBIBYTE
+    batch_uploads = False
+
+    def __init__(self, chunk_upload_workers: int) -> None:
+        self.chunk_upload_workers = chunk_upload_workers
+
+
+class FakeDropbox:
+    '''
+    the upload session routes. fail(route, offset) is called before each
+    request and can raise to cut the upload off
+    '''
+
+    def __init__(self) -> None:
+        self.sessions: dict[str, dict[int, bytes]] = {}
+        self.concurrent: set[str] = set()
+        self.closed: set[str] = set()
+        self.files: dict[str, bytes] = {}
+        self.started = 0
+        self.appended: list[int] = []
+        self.fail = lambda route, offset: None
+
+    def files_upload_session_start(self, data, close=False, session_type=None):
+        self.fail("start", 0)
+        self.started += 1
+        session_id = f"session{self.started}"
+        self.sessions[session_id] = {0: data} if data else {}
+        if session_type is not None and session_type.is_concurrent():
+            self.concurrent.add(session_id)
+        return UploadSessionStartResult(session_id)
+
+    def files_upload_session_append_v2(self, data, cursor, close=False):
+        self.fail("append", cursor.offset)
+        chunks = self._lookup(cursor.session_id, UploadSessionAppendError)
+        if cursor.session_id in self.closed:
+            raise self._error(UploadSessionAppendError.closed)
+        # a concurrent session can only be closed once everything before the last chunk is there
+        in_order = cursor.session_id not in self.concurrent or close
+        if in_order and cursor.offset != self._length(chunks):
+            raise self._error(UploadSessionAppendError.incorrect_offset(UploadSessionOffsetError(self._length(chunks))))
+        chunks[cursor.offset] = data
+        if close:
+            self.closed.add(cursor.session_id)
+        self.appended.append(cursor.offset)
+        self.fail("appended", cursor.offset)
+
+    def files_upload_session_finish(self, data, cursor, commit):
+        self.fail("finish", cursor.offset)
+        try:
+            chunks = self._lookup(cursor.session_id, UploadSessionLookupError)
+        except ApiError as e:
+            raise self._error(UploadSessionFinishError.lookup_failed(e.error))
+        if data:
+            chunks[cursor.offset] = data
+        del self.sessions[cursor.session_id]
+        self.files[commit.path] = b"".join(chunks[offset] for offset in sorted(chunks))
+        size = len(self.files[commit.path])
+        return FileMetadata(name=commit.path[1:], id="id:file", client_modified=datetime(2020, 1, 1), server_modified=datetime(2020, 1, 1), rev="0123456789", size=size, path_display=commit.path)
+
+    def _lookup(self, session_id, error_type):
+        if session_id not in self.sessions:
+            raise self._error(error_type.not_found)
+        return self.sessions[session_id]
+
+    @staticmethod
+    def _length(chunks: dict[int, bytes]) -> int:
+        return sum(len(data) for data in chunks.values())
+
+    @staticmethod
+    def _error(error):
+        return ApiError("request", error, None, None)
+
+
+class UploadResumeTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.local_path = os.path.join(self.directory.name, "file")
+        self.contents = os.urandom(4 * CHUNK_SIZE + 3) # 5 chunks
+        with open(self.local_path, "wb") as file:
+            file.write(self.contents)
+
+        for patch in (
+            mock.patch.object(utils, "LEDGER_PATH", os.path.join(self.directory.name, "ledger.db")),
+            mock.patch.object(utils, "_ledger", None),
+            mock.patch.object(utils, "_ledger_writer", None),
+            mock.patch.object(utils, "_upload_budget", None),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(utils.close_ledger)
+
+        self.dbx = FakeDropbox()
+        self.model = dbx_model.DropboxModel(self.directory.name, self.dbx)
+
+    def upload(self, chunk_upload_workers: int = 1) -> FileMetadata | None:
+        config = FakeConfig(chunk_upload_workers)
+        with mock.patch.object(dbx_model, "get_config", lambda: config), mock.patch.object(utils, "get_config", lambda: config):
+            metadata = self.model.api_upload_file(self.local_path, "/file")
+        utils.get_ledger_writer().flush()
+        return metadata
+
+    def journal(self):
+        return utils.get_ledger().get_upload_session("/file")
+
+    def cut_off(self, route: str, offset: int):
+        def fail(failing_route, failing_offset):
+            if (failing_route, failing_offset) == (route, offset):
+                raise requests.ConnectionError("cut off")
+        return fail
+
+    def test_resumes_from_the_journal(self):
+        self.dbx.fail = self.cut_off("append", 2 * CHUNK_SIZE)
+        self.assertIsNone(self.upload())
+        self.assertEqual(self.journal().acknowledged, 2 * CHUNK_SIZE)
+
+        self.dbx.fail = lambda route, offset: None
+        self.dbx.appended.clear()
+        self.assertIsNotNone(self.upload())
+
+        self.assertEqual(self.dbx.started, 1)
+        self.assertEqual(self.dbx.appended, [2 * CHUNK_SIZE, 3 * CHUNK_SIZE])
+        self.assertEqual(self.dbx.files["/file"], self.contents)
+        self.assertIsNone(self.journal())
+
+    def test_carries_on_from_dropbox_offset(self):
+        # Dropbox got the chunk but the answer never came back, so the journal is a chunk behind
+        self.dbx.fail = self.cut_off("appended", 2 * CHUNK_SIZE)
+        self.assertIsNone(self.upload())
+        self.assertEqual(self.journal().acknowledged, 2 * CHUNK_SIZE)
+
+        self.dbx.fail = lambda route, offset: None
+        self.assertIsNotNone(self.upload())
+
+        self.assertEqual(self.dbx.started, 1)
+        self.assertEqual(self.dbx.files["/file"], self.contents)
+
+    def test_starts_again_when_the_session_expired(self):
+        self.dbx.fail = self.cut_off("append", 2 * CHUNK_SIZE)
+        self.assertIsNone(self.upload())
+
+        self.dbx.fail = lambda route, offset: None
+        self.dbx.sessions.clear()
+        self.assertIsNotNone(self.upload())
+
+        self.assertEqual(self.dbx.started, 2)
+        self.assertEqual(self.dbx.files["/file"], self.contents)
+        self.assertIsNone(self.journal())
+
+    def test_other_lookup_errors_are_not_started_again(self):
+        self.dbx.fail = self.cut_off("append", 2 * CHUNK_SIZE)
+        self.assertIsNone(self.upload())
+
+        def too_large(route, offset):
+            if route == "append":
+                raise FakeDropbox._error(UploadSessionAppendError.too_large)
+        self.dbx.fail = too_large
+        self.assertIsNone(self.upload())
+
+        self.assertEqual(self.dbx.started, 1)
+        self.assertNotIn("/file", self.dbx.files)
+
+    def test_concurrent_session_only_sends_missing_chunks(self):
+        self.dbx.fail = self.cut_off("append", 3 * CHUNK_SIZE)
+        self.assertIsNone(self.upload(chunk_upload_workers=2))
+        done = self.journal().chunks_done
+        self.assertNotIn(3 * CHUNK_SIZE, done)
+
+        self.dbx.fail = lambda route, offset: None
+        self.dbx.appended.clear()
+        self.assertIsNotNone(self.upload(chunk_upload_workers=2))
+
+        self.assertEqual(self.dbx.started, 1)
+        self.assertTrue(done.isdisjoint(self.dbx.appended))
+        self.assertEqual(done | set(self.dbx.appended), {offset for offset, _ in FakeConfig.upload_policy.chunks(len(self.contents))})
+        self.assertEqual(self.dbx.files["/file"], self.contents)
+
+    def test_concurrent_session_is_closed_last(self):
+        def slow_first_chunk(route, offset):
+            if (route, offset) == ("append", 0):
+                time.sleep(0.2)
+        self.dbx.fail = slow_first_chunk
+        self.assertIsNotNone(self.upload(chunk_upload_workers=4))
+
+        self.assertEqual(self.dbx.appended[-1], 4 * CHUNK_SIZE)
+        self.assertEqual(self.dbx.files["/file"], self.contents)
+
+
+if __name__ == "__main__":
+    unittest.main()